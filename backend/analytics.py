@@ -0,0 +1,95 @@
+import datetime
+from typing import Iterable, List, Optional
+
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Cast, NullIf
+
+from backend.models import Plant, Datapoint
+from backend.sharding import map_shards
+
+# Orderings of the fleet ranking, worst performers first: field and whether it is sorted in descending order
+FLEET_ORDERINGS = {
+    'ratio': ('energy_ratio', False),
+    'deficit': ('energy_deficit', True),
+    'irradiation': ('irradiation_ratio', False),
+}
+
+
+def _ratio(numerator: str, denominator: str):
+    return Cast(F(numerator), FloatField()) / NullIf(F(denominator), 0.0)
+
+
+def _get_ranking_key(order: str):
+    field, descending = FLEET_ORDERINGS[order]
+
+    def key(item: dict):
+        value = item[field]
+        if value is None:
+            return True, 0, item['id']
+        return False, -value if descending else value, item['id']
+
+    return key
+
+
+def get_fleet_ranking(
+        plant_ids: Optional[Iterable[int]],
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        order: str,
+        limit: int
+) -> List[dict]:
+    """
+    Rank plants by their aggregated performance within a range of dates, with a single grouped query per shard.
+    Only existing plants are ranked, as datapoints may outlive their plant in the shards.
+    :param plant_ids: Plant IDs to rank. Defaults to all plants.
+    :param date_from: Start timestamp (included)
+    :param date_to: End timestamp (excluded)
+    :param order: Ranking criterion, one of `FLEET_ORDERINGS`
+    :param limit: Maximum number of plants returned
+    :return: List with the aggregates of the top ranked plants
+    """
+    field, descending = FLEET_ORDERINGS[order]
+    ordering = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+    plants = Plant.objects.all() if plant_ids is None else Plant.objects.filter(id__in=plant_ids)
+    names = dict(plants.values_list('id', 'name'))
+
+    def rank_shard(alias: str, shard_plant_ids: List[int]) -> List[dict]:
+        datapoints = Datapoint.objects.using(alias).filter(plant_id__in=shard_plant_ids)
+        if date_from:
+            datapoints = datapoints.filter(timestamp__gte=date_from)
+        if date_to:
+            datapoints = datapoints.filter(timestamp__lt=date_to)
+
+        ranking = datapoints.values('plant_id').annotate(
+            datapoints=Count('id'),
+            total_energy_expected=Sum('energy_expected'),
+            total_energy_observed=Sum('energy_observed'),
+            total_irradiation_expected=Sum('irradiation_expected'),
+            total_irradiation_observed=Sum('irradiation_observed'),
+        ).annotate(
+            energy_ratio=_ratio('total_energy_observed', 'total_energy_expected'),
+            energy_deficit=F('total_energy_expected') - F('total_energy_observed'),
+            irradiation_ratio=_ratio('total_irradiation_observed', 'total_irradiation_expected'),
+        ).order_by(ordering, 'plant_id')[:limit]
+
+        return [
+            {
+                'id': item['plant_id'],
+                'datapoints': item['datapoints'],
+                'energy_expected': item['total_energy_expected'],
+                'energy_observed': item['total_energy_observed'],
+                'energy_ratio': item['energy_ratio'],
+                'energy_deficit': item['energy_deficit'],
+                'irradiation_expected': item['total_irradiation_expected'],
+                'irradiation_observed': item['total_irradiation_observed'],
+                'irradiation_ratio': item['irradiation_ratio'],
+            }
+            for item in ranking
+        ]
+
+    # Each shard returns its own top plants, merged into the top ones of the whole fleet
+    ranking = sorted(
+        (item for shard_ranking in map_shards(rank_shard, names) for item in shard_ranking),
+        key=_get_ranking_key(order)
+    )[:limit]
+    return [{'id': item['id'], 'name': names[item['id']], **item} for item in ranking]
@@ -0,0 +1,93 @@
+from http import HTTPStatus
+from typing import Callable, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from backend.fragments import FragmentJSONRenderer
+from backend.profiling import stage, track_queries
+from backend.routers import pin_to_primary, replica_reads
+from backend.tasks import schedule_polling
+from backend.views import PlantViewSet, parse_pull_request, parse_report_request, serialize_report
+
+
+def _run_api_call(func: Callable, request: Request) -> Tuple[int, object]:
+    """
+    Run a blocking API call, translating REST framework exceptions into error responses.
+    Meant to be executed in a worker thread, so that database connections opened there are released afterwards.
+    :param func: Callable receiving the request and returning the response data
+    :param request: REST framework request
+    :return: Tuple with the response status code and data
+    """
+    try:
+        with track_queries():
+            return HTTPStatus.OK, func(request)
+    except Exception as exc:
+        response = exception_handler(exc, {'request': request})
+        if response is None:
+            raise
+        return response.status_code, response.data
+    finally:
+        close_old_connections()
+
+
+async def _offload(func: Callable, request: HttpRequest) -> HttpResponse:
+    """
+    Run a blocking API call outside the event loop and render its result as JSON.
+    :param func: Callable receiving the request and returning the response data
+    :param request: Django request
+    :return: JSON response
+    """
+    request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]
+    )
+    status, data = await sync_to_async(_run_api_call, thread_sensitive=False)(func, request)
+    content = FragmentJSONRenderer().render(data) if data is not None else b''
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+def _build_report(request: Request) -> dict:
+    with stage('parse'):
+        plants, date_from, date_to, percentiles = parse_report_request(PlantViewSet.queryset, request.query_params)
+    paginator = api_settings.DEFAULT_PAGINATION_CLASS()
+    with stage('paginate'):
+        page = paginator.paginate_queryset(plants, request)
+    return paginator.get_paginated_response(serialize_report(page, date_from, date_to, percentiles)).data
+
+
+def _pull_datapoints(request: Request) -> None:
+    plant_ids, date_from, date_to = parse_pull_request(request.data)
+    # Publishing to the broker is blocking, so it is done from the worker thread as well
+    schedule_polling(plant_ids, date_from, date_to)
+
+
+async def report(request: HttpRequest) -> HttpResponse:
+    """
+    Async counterpart of `PlantViewSet.report`.
+    The report is built in a worker thread, so the event loop keeps serving other requests meanwhile.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    with replica_reads(request):
+        return await _offload(_build_report, request)
+
+
+async def pull_datapoints(request: HttpRequest) -> HttpResponse:
+    """
+    Async counterpart of `PlantViewSet.pull_datapoints`.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    response = await _offload(_pull_datapoints, request)
+    if response.status_code == HTTPStatus.OK:
+        pin_to_primary(response)
+    return response
+
+
+# `csrf_exempt` wraps views in a sync function on this Django version, so flag the coroutine directly instead
+pull_datapoints.csrf_exempt = True
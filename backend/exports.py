@@ -0,0 +1,262 @@
+"""
+Reports exported asynchronously into compressed files.
+
+An export is identified by its request along with the names and data versions of its plants, so identical requests
+share the same export, and its file is reused until any of those plants is renamed or its data changes. Files are
+written plant by plant into gzip streams, so the memory used doesn't grow with the size of the export.
+
+Each task writing an export is an attempt with its own token and temporary file, which refreshes the export while it
+writes. Exports not refreshed for a while are restarted, and an attempt superseded meanwhile never finishes them.
+"""
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from functools import partial
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from backend.fragments import FragmentJSONRenderer, encode_report_datapoints
+from backend.models import Plant, ReportExport
+from backend.reports import get_report_datapoints
+from backend.serializers import DatapointSerializer, PlantReportSerializer
+
+CSV_HEADER = [
+    'plant_id', 'plant_name', 'timestamp',
+    'energy_expected', 'energy_observed', 'irradiation_expected', 'irradiation_observed',
+]
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, default=str).encode()).hexdigest()
+
+
+def get_export_keys(
+        plant_ids: List[int],
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        export_format: str
+) -> Tuple[str, str]:
+    """
+    Get the keys identifying an export.
+    :return: Tuple with the key of the request along with the current names and data versions of its plants, and the
+        one of the request alone
+    """
+    request = [sorted(plant_ids), date_from, date_to, export_format]
+    # Names are part of the rows exported, so renaming a plant changes its exports too
+    versions = list(Plant.objects.filter(id__in=plant_ids).order_by('id').values_list(
+        'id', 'name', 'datapoints_version'
+    ))
+    return _hash([request, versions]), _hash(request)
+
+
+def get_export_path(export: ReportExport) -> str:
+    return str(settings.EXPORTS_DIR / f'{export.key}.{export.format}.gz')
+
+
+def delete_export_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _is_stale(export: ReportExport) -> bool:
+    # Exports not updated for a while were left behind by a worker which died meanwhile
+    timeout = datetime.timedelta(seconds=settings.EXPORT_STALE_TIMEOUT)
+    return export.status in (ReportExport.PENDING, ReportExport.RUNNING) and export.updated < timezone.now() - timeout
+
+
+def request_export(
+        plant_ids: List[int],
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        export_format: str
+) -> Tuple[ReportExport, bool]:
+    """
+    Get the export of a report for the current data of its plants, creating it if there is none.
+    Failed and stale exports are restarted, and exports of the same request superseded by a new one are deleted.
+    :param plant_ids: Plant IDs
+    :param date_from: Start timestamp (included)
+    :param date_to: End timestamp (excluded)
+    :param export_format: File format, one of `ReportExport.FORMATS`
+    :return: Tuple with the export and whether a task needs to be enqueued to write it
+    """
+    key, request_key = get_export_keys(plant_ids, date_from, date_to, export_format)
+    with transaction.atomic():
+        export, created = ReportExport.objects.get_or_create(key=key, defaults={
+            'request_key': request_key,
+            'plant_ids': sorted(plant_ids),
+            'date_from': date_from,
+            'date_to': date_to,
+            'format': export_format,
+        })
+        if created:
+            superseded = ReportExport.objects.filter(
+                request_key=request_key,
+                status__in=[ReportExport.DONE, ReportExport.FAILED]
+            ).exclude(id=export.id)
+            paths = [path for path in superseded.values_list('path', flat=True) if path]
+            superseded.delete()
+            transaction.on_commit(partial(delete_export_files, paths))
+            return export, True
+
+        if export.status == ReportExport.FAILED or _is_stale(export):
+            # Unless an attempt refreshed or finished it meanwhile
+            restarted = ReportExport.objects.filter(
+                id=export.id,
+                status=export.status,
+                updated=export.updated
+            ).update(status=ReportExport.PENDING, progress=0, updated=timezone.now())
+            if restarted:
+                export.refresh_from_db()
+                return export, True
+    return export, False
+
+
+def _write_csv(file, plants: List[Plant], export: ReportExport):
+    with io.TextIOWrapper(file, encoding='utf-8', newline='') as text:
+        writer = csv.writer(text)
+        writer.writerow(CSV_HEADER)
+        for plant in _iterate_plants(plants, export):
+            writer.writerows(
+                [plant.id, plant.name, *item.values()]
+                for item in DatapointSerializer(plant.report_datapoints, many=True).data
+            )
+
+
+def _write_json(file, plants: List[Plant], export: ReportExport):
+    # Same items as the results of a report, encoded reusing the cached fragments
+    renderer = FragmentJSONRenderer()
+    file.write(b'[')
+    for index, plant in enumerate(_iterate_plants(plants, export)):
+        plant.report_datapoints = encode_report_datapoints(
+            [plant],
+            {plant.id: plant.report_datapoints},
+            export.date_from,
+            export.date_to
+        )[plant.id]
+        if index:
+            file.write(b',')
+        file.write(renderer.render(PlantReportSerializer(plant).data))
+    file.write(b']')
+
+
+def _get_attempt_export(export_id, attempt: str):
+    return ReportExport.objects.filter(id=export_id, status=ReportExport.RUNNING, attempt=attempt)
+
+
+def _touch_export(export_id, attempt: str):
+    _get_attempt_export(export_id, attempt).update(updated=timezone.now())
+
+
+@contextmanager
+def _refresh_export(export_id, attempt: str):
+    """
+    Refresh a running export in the background while an attempt writes it, so it isn't taken as stale however long
+    a single plant takes.
+    """
+    stop = threading.Event()
+
+    def refresh():
+        try:
+            while not stop.wait(settings.EXPORT_STALE_TIMEOUT / 4):
+                try:
+                    _touch_export(export_id, attempt)
+                except Exception as e:
+                    logging.error({
+                        'message': 'Unable to refresh export',
+                        'export_id': export_id,
+                        'error': str(e)
+                    })
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _iterate_plants(plants: List[Plant], export: ReportExport):
+    """
+    Iterate the plants of an export with their report datapoints attached, recording the progress after each one.
+    """
+    for index, plant in enumerate(plants):
+        plant.report_datapoints = get_report_datapoints([plant], export.date_from, export.date_to)[plant.id]
+        yield plant
+        plant.report_datapoints = None
+        _get_attempt_export(export.id, export.attempt).update(
+            progress=(index + 1) / len(plants),
+            updated=timezone.now()
+        )
+
+
+WRITERS = {
+    ReportExport.CSV: _write_csv,
+    ReportExport.JSON: _write_json,
+}
+
+
+def write_export(export_id):
+    """
+    Write the file of a pending export.
+    Nothing is done if the export is not pending, as another task took it already, and the file is discarded if the
+    export was restarted by another task while writing it.
+    :param export_id: Export ID
+    """
+    attempt = uuid.uuid4().hex
+    if not ReportExport.objects.filter(id=export_id, status=ReportExport.PENDING).update(
+            status=ReportExport.RUNNING,
+            attempt=attempt,
+            updated=timezone.now()
+    ):
+        return
+    export = ReportExport.objects.get(id=export_id)
+    plants = list(Plant.objects.filter(id__in=export.plant_ids).order_by('id'))
+
+    os.makedirs(settings.EXPORTS_DIR, exist_ok=True)
+    path = get_export_path(export)
+    temporary_path = f'{path}.{attempt}.tmp'
+    try:
+        with _refresh_export(export_id, attempt), gzip.open(temporary_path, 'wb') as file:
+            WRITERS[export.format](file, plants, export)
+        with transaction.atomic():
+            # The export is locked so it can't be restarted between replacing its file and finishing it
+            owned = _get_attempt_export(export_id, attempt).select_for_update().exists()
+            if owned:
+                os.replace(temporary_path, path)
+                _get_attempt_export(export_id, attempt).update(
+                    status=ReportExport.DONE,
+                    progress=1,
+                    path=path,
+                    size=os.path.getsize(path),
+                    updated=timezone.now()
+                )
+    except Exception as e:
+        logging.error({
+            'message': 'Unable to write export',
+            'export_id': export_id,
+            'error': str(e)
+        })
+        delete_export_files([temporary_path])
+        _get_attempt_export(export_id, attempt).update(status=ReportExport.FAILED, updated=timezone.now())
+        return
+
+    if not owned:
+        delete_export_files([temporary_path])
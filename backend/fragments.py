@@ -0,0 +1,210 @@
+"""
+Cache of the serialized datapoints of each plant-day, spliced into report responses.
+
+Serializing datapoints costs far more than reading them, while those of past days rarely change. The JSON of the
+datapoints of each closed day, exactly as rendered within a report, is stored in a file under `REPORT_FRAGMENTS_DIR`
+and reused by later reports, which only serialize the days not cached yet. Fragments are deleted whenever datapoints
+are written into their day.
+"""
+import datetime
+import json
+import os
+import re
+import shutil
+import uuid
+from collections import defaultdict
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from backend.models import Plant, Datapoint
+from backend.profiling import ProfiledJSONRenderer, stage
+from backend.serializers import DatapointSerializer
+
+
+class RawJSON:
+    """
+    Value already encoded as JSON, written as it is by `FragmentJSONRenderer`.
+    """
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+def get_day(timestamp: datetime.datetime) -> datetime.date:
+    return timezone.localtime(timestamp).date()
+
+
+def get_day_bounds(day: datetime.date):
+    """
+    Get the first timestamp of a day and the first one of the next day.
+    """
+    time_zone = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time()), time_zone)
+    end = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()), time_zone)
+    return start, end
+
+
+def get_fragment_path(plant_id, day: datetime.date) -> Path:
+    return Path(settings.REPORT_FRAGMENTS_DIR) / str(plant_id) / f'{day:%Y-%m-%d}.json'
+
+
+def read_fragment(plant_id, day: datetime.date) -> Optional[bytes]:
+    try:
+        with open(get_fragment_path(plant_id, day), 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_fragment(plant_id, day: datetime.date, content: bytes) -> Path:
+    path = get_fragment_path(plant_id, day)
+    os.makedirs(path.parent, exist_ok=True)
+    # Several reports may write the same fragment at once, so each one uses its own temporary file
+    temporary_path = path.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+    with open(temporary_path, 'wb') as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+    return path
+
+
+def delete_fragment_files(paths: Iterable[Path]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def delete_fragments(plant_id, days: Iterable[datetime.date]):
+    """
+    Delete the fragments of the given days of a plant, if caching is enabled.
+    """
+    if settings.REPORT_FRAGMENTS_DIR:
+        delete_fragment_files(get_fragment_path(plant_id, day) for day in days)
+
+
+def delete_plant_fragments(plant_id):
+    """
+    Delete every fragment of a plant, if caching is enabled.
+    """
+    if settings.REPORT_FRAGMENTS_DIR:
+        shutil.rmtree(Path(settings.REPORT_FRAGMENTS_DIR) / str(plant_id), ignore_errors=True)
+
+
+def encode_datapoints(datapoints: List[Datapoint]) -> bytes:
+    """
+    Encode datapoints into the items of a JSON array, as rendered within a report.
+    """
+    if not datapoints:
+        return b''
+    return JSONRenderer().render(DatapointSerializer(datapoints, many=True).data)[1:-1]
+
+
+def _is_cacheable(
+        day: datetime.date,
+        today: datetime.date,
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime]
+) -> bool:
+    # Only closed days fully within the report range hold the same datapoints in every report
+    start, end = get_day_bounds(day)
+    return day < today and (date_from is None or date_from <= start) and (date_to is None or end <= date_to)
+
+
+def _discard_stale_fragments(plants: List[Plant], written: Dict[int, List[Path]]):
+    """
+    Delete the fragments just written for plants whose datapoints changed since they were read.
+    Versions are checked on the primary database, where writes show up first.
+    """
+    versions = dict(
+        Plant.objects.using(DEFAULT_DB_ALIAS).filter(id__in=written).values_list('id', 'datapoints_version')
+    )
+    for plant in plants:
+        if plant.id in written and versions.get(plant.id) != plant.datapoints_version:
+            delete_fragment_files(written[plant.id])
+
+
+def encode_report_datapoints(
+        plants: List[Plant],
+        datapoints: Dict[int, List[Datapoint]],
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime]
+) -> Dict[int, RawJSON]:
+    """
+    Encode the report datapoints of each plant, reusing the fragments cached for their days.
+    :param plants: Plants, as read before their datapoints
+    :param datapoints: Dictionary with the list of datapoints of each plant ID, sorted by timestamp
+    :param date_from: Start timestamp of the report (included)
+    :param date_to: End timestamp of the report (excluded)
+    :return: Dictionary with the JSON array of datapoints of each plant ID
+    """
+    if not settings.REPORT_FRAGMENTS_DIR:
+        return {plant.id: RawJSON(b'[' + encode_datapoints(datapoints[plant.id]) + b']') for plant in plants}
+
+    today = get_day(timezone.now())
+    encoded, written = {}, defaultdict(list)
+    for plant in plants:
+        parts = []
+        for day, day_datapoints in groupby(datapoints[plant.id], key=lambda datapoint: get_day(datapoint.timestamp)):
+            if not _is_cacheable(day, today, date_from, date_to):
+                parts.append(encode_datapoints(list(day_datapoints)))
+                continue
+            fragment = read_fragment(plant.id, day)
+            if fragment is None:
+                fragment = encode_datapoints(list(day_datapoints))
+                written[plant.id].append(write_fragment(plant.id, day, fragment))
+            parts.append(fragment)
+        encoded[plant.id] = RawJSON(b'[' + b','.join(parts) + b']')
+
+    if written:
+        _discard_stale_fragments(plants, written)
+    return encoded
+
+
+def _replace_raw_json(data, replace):
+    if isinstance(data, RawJSON):
+        return replace(data)
+    if isinstance(data, dict):
+        return {key: _replace_raw_json(value, replace) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_replace_raw_json(value, replace) for value in data]
+    return data
+
+
+class FragmentJSONRenderer(ProfiledJSONRenderer):
+    """
+    JSON renderer writing the `RawJSON` values within the data as they are.
+    Those are rendered as placeholders, which are then replaced by their content, so the output is the same as if
+    the values had been encoded along with the rest.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            # Raw values are compact, so they are decoded to be indented along with the rest
+            data = _replace_raw_json(data, lambda value: json.loads(value.content))
+            return super().render(data, accepted_media_type, renderer_context)
+
+        token = uuid.uuid4().hex
+        fragments = []
+
+        def replace(value: RawJSON) -> str:
+            fragments.append(value.content)
+            return f'{token}:{len(fragments) - 1}'
+
+        data = _replace_raw_json(data, replace)
+        content = super().render(data, accepted_media_type, renderer_context)
+        if not fragments:
+            return content
+        # Splicing is part of rendering, whose stage time adds up
+        with stage('render'):
+            return re.sub(
+                b'"' + token.encode() + rb':(\d+)"',
+                lambda match: fragments[int(match[1])],
+                content
+            )
@@ -0,0 +1,111 @@
+import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from django.db import connections
+from django.db.models import F, Func, IntegerField, Window
+from django.db.models.functions import Lag
+from django.utils import timezone
+
+from backend.models import Datapoint
+from backend.sharding import map_shards
+
+# Expected time between two consecutive datapoints of a plant
+DATAPOINT_INTERVAL = datetime.timedelta(hours=1)
+
+
+class Epoch(Func):
+    """
+    Seconds elapsed since the Unix epoch for a datetime expression.
+    """
+    function = 'UNIX_TIMESTAMP'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)",
+            **extra_context
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(EXTRACT(EPOCH FROM %(expressions)s) AS BIGINT)',
+            **extra_context
+        )
+
+
+class Gap(NamedTuple):
+    plant_id: int
+    start: datetime.datetime  # First missing timestamp
+    end: datetime.datetime  # Last missing timestamp
+
+    @property
+    def missing(self) -> int:
+        return int((self.end - self.start) / DATAPOINT_INTERVAL) + 1
+
+
+def find_gaps(plant_ids: Iterable[int]) -> List[Gap]:
+    """
+    Find the holes in the datapoints history of the given Plants.
+    Every datapoint is compared with the previous one of the same plant by a window function, so that only
+    the gaps found are sent back from the database.
+    :param plant_ids: Plant IDs
+    :return: List of gaps, sorted by plant and time
+    """
+    gaps = [gap for shard_gaps in map_shards(_find_shard_gaps, list(plant_ids)) for gap in shard_gaps]
+    return sorted(gaps, key=lambda gap: (gap.plant_id, gap.start))
+
+
+def _find_shard_gaps(alias: str, plant_ids: List[int]) -> List[Gap]:
+    epoch = Epoch('timestamp')
+    queryset = Datapoint.objects.using(alias).filter(
+        plant_id__in=plant_ids
+    ).annotate(
+        epoch=epoch,
+        previous_epoch=Window(
+            expression=Lag(epoch),
+            partition_by=[F('plant_id')],
+            order_by=F('timestamp').asc()
+        )
+    ).values_list('plant_id', 'previous_epoch', 'epoch')
+    sql, params = queryset.query.get_compiler(using=alias).as_sql()
+
+    interval = int(DATAPOINT_INTERVAL.total_seconds())
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f'SELECT plant_id, previous_epoch, epoch FROM ({sql}) series '
+            f'WHERE epoch - previous_epoch > %s '
+            f'ORDER BY plant_id, epoch',
+            (*params, interval)
+        )
+        rows = cursor.fetchall()
+
+    return [
+        Gap(
+            plant_id=plant_id,
+            start=datetime.datetime.fromtimestamp(previous_epoch + interval, tz=datetime.timezone.utc),
+            end=datetime.datetime.fromtimestamp(epoch - interval, tz=datetime.timezone.utc),
+        )
+        for plant_id, previous_epoch, epoch in rows
+    ]
+
+
+def get_gap_date_ranges(gaps: Iterable[Gap]) -> Dict[int, List[Tuple[datetime.date, datetime.date]]]:
+    """
+    Get the minimal date ranges to request from the monitoring service in order to fill the given gaps.
+    :param gaps: List of gaps, sorted by plant and time
+    :return: Dictionary with the list of (start date, end date) ranges for each plant ID
+    """
+    ranges = defaultdict(list)
+    for gap in gaps:
+        date_from = timezone.localtime(gap.start).date()
+        date_to = timezone.localtime(gap.end).date() + datetime.timedelta(days=1)
+        plant_ranges = ranges[gap.plant_id]
+        if plant_ranges and plant_ranges[-1][1] >= date_from:
+            # Overlaps or is adjacent to the previous range. Merge them!
+            plant_ranges[-1] = (plant_ranges[-1][0], max(plant_ranges[-1][1], date_to))
+        else:
+            plant_ranges.append((date_from, date_to))
+    return dict(ranges)
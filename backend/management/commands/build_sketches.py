@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from backend.models import Plant
+from backend.pulls import hold_write_lock
+from backend.sketches import rebuild_sketches
+
+
+class Command(BaseCommand):
+    help = 'Build the quantile sketches of every day of the given plants, or of all of them, out of their datapoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('plant_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        plant_ids = options['plant_ids'] or list(Plant.objects.order_by('id').values_list('id', flat=True))
+        missing = set(plant_ids) - set(Plant.objects.filter(id__in=plant_ids).values_list('id', flat=True))
+        if missing:
+            raise CommandError(f'Invalid IDs: {", ".join(map(str, sorted(missing)))}')
+        for plant_id in plant_ids:
+            # Polling tasks don't write the plant's datapoints meanwhile
+            with hold_write_lock(plant_id), transaction.atomic():
+                rebuild_sketches(plant_id)
+            self.stdout.write(f'Plant {plant_id}: sketches built')
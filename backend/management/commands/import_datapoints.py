@@ -0,0 +1,193 @@
+import csv
+import io
+import json
+import logging
+import mmap
+import os
+import time
+from itertools import islice
+from typing import Iterator, List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from backend.fragments import get_day
+from backend.models import Plant, Datapoint
+from backend.pulls import hold_write_lock
+from backend.sharding import get_shard
+from backend.signals import datapoints_saved
+from backend.sketches import rebuild_sketches
+from backend.tasks import PollPlantMonitoringData
+
+FORMATS = ('csv', 'ndjson')
+
+FIELDS = ['energy_expected', 'energy_observed', 'irradiation_expected', 'irradiation_observed']
+COLUMNS = ['plant_id', 'timestamp'] + FIELDS
+
+
+def _read_lines(path: str) -> Iterator[bytes]:
+    """
+    Iterate over the lines of a file through a memory map.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from iter(data.readline, b'')
+
+
+def _read_ndjson(path: str) -> Iterator[dict]:
+    for line in _read_lines(path):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            logging.error({
+                'message': 'Unable to parse datapoint line',
+                'line': line
+            })
+
+
+def _read_csv(path: str) -> Iterator[dict]:
+    """
+    Read a CSV file with the monitoring service schema, using dotted column names for nested values
+    (i.e. `datetime,expected.energy,expected.irradiation,observed.energy,observed.irradiation`).
+    """
+    lines = (line.decode() for line in _read_lines(path))
+    for row in csv.DictReader(lines):
+        item = {}
+        for key, value in row.items():
+            *parents, name = key.strip().split('.')
+            node = item
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[name] = value
+        yield item
+
+
+class Command(BaseCommand):
+    help = 'Import the datapoints of a plant from CSV or NDJSON files with the monitoring service schema.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('plant_id', type=int, help='Plant ID')
+        parser.add_argument('files', nargs='+', help='CSV (.csv) or NDJSON (.ndjson, .jsonl) files')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Files format. Guessed from the file extensions by default.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Number of datapoints written per transaction.'
+        )
+
+    @staticmethod
+    def _get_format(path: str) -> str:
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.ndjson', '.jsonl'):
+            return 'ndjson'
+        raise CommandError(f"Unable to guess the format of '{path}'. Use --format.")
+
+    @staticmethod
+    def _copy_upsert(connection, cursor, rows: List[tuple]):
+        """
+        Load the rows into a temporary table using COPY, then upsert them into the datapoints table.
+        """
+        table = connection.ops.quote_name(Datapoint._meta.db_table)
+        columns = ', '.join(map(connection.ops.quote_name, COLUMNS))
+        cursor.execute(
+            'CREATE TEMPORARY TABLE datapoint_import ('
+            'plant_id bigint, timestamp timestamp with time zone, energy_expected double precision, '
+            'energy_observed double precision, irradiation_expected double precision, '
+            'irradiation_observed double precision'
+            ') ON COMMIT DROP'
+        )
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f'COPY datapoint_import ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM datapoint_import '
+            f'ON CONFLICT (plant_id, timestamp) DO UPDATE SET '
+            + ', '.join(f'{field} = EXCLUDED.{field}' for field in FIELDS)
+        )
+
+    @staticmethod
+    def _executemany_upsert(connection, cursor, rows: List[tuple]):
+        table = connection.ops.quote_name(Datapoint._meta.db_table)
+        columns = ', '.join(map(connection.ops.quote_name, COLUMNS))
+        cursor.executemany(
+            f'INSERT INTO {table} ({columns}) VALUES ({", ".join(["%s"] * len(COLUMNS))}) '
+            f'ON CONFLICT (plant_id, timestamp) DO UPDATE SET '
+            + ', '.join(f'{field} = excluded.{field}' for field in FIELDS),
+            rows
+        )
+
+    def _write(self, plant_id, datapoints: List[dict]):
+        """
+        Create or update the given datapoints, using the bulk loading path of the database.
+        """
+        # A row can't be upserted twice by the same statement, so keep the last datapoint for each timestamp
+        datapoints = list({datapoint['timestamp']: datapoint for datapoint in datapoints}.values())
+        shard = get_shard(plant_id)
+        connection = connections[shard]
+        # Datapoints are committed to their shard before the plant data version, kept in the default database.
+        # Polling tasks don't write the plant's datapoints meanwhile
+        with hold_write_lock(plant_id), transaction.atomic(), transaction.atomic(using=shard, savepoint=False):
+            if connection.vendor in ('postgresql', 'sqlite'):
+                rows = [
+                    (
+                        plant_id,
+                        connection.ops.adapt_datetimefield_value(datapoint['timestamp']),
+                        *(datapoint[field] for field in FIELDS)
+                    )
+                    for datapoint in datapoints
+                ]
+                with connection.cursor() as cursor:
+                    if connection.vendor == 'postgresql':
+                        self._copy_upsert(connection, cursor, rows)
+                    else:
+                        self._executemany_upsert(connection, cursor, rows)
+            else:
+                datapoints_to_create, datapoints_to_update = PollPlantMonitoringData._split_datapoints(
+                    plant_id, datapoints
+                )
+                Datapoint.objects.using(shard).bulk_create(datapoints_to_create)
+                Datapoint.objects.using(shard).bulk_update(objs=datapoints_to_update, fields=FIELDS)
+            # Upserts don't tell the values they replace, so the sketches of the days written are built again
+            rebuild_sketches(plant_id, {get_day(datapoint['timestamp']) for datapoint in datapoints})
+            datapoints_saved.send(
+                sender=Datapoint,
+                plant_id=plant_id,
+                timestamps=[datapoint['timestamp'] for datapoint in datapoints]
+            )
+
+    def handle(self, *args, **options):
+        plant_id = options['plant_id']
+        if not Plant.objects.filter(id=plant_id).exists():
+            raise CommandError(f'Invalid ID: {plant_id}')
+
+        readers = {'csv': _read_csv, 'ndjson': _read_ndjson}
+        total, start = 0, time.monotonic()
+        for path in options['files']:
+            items = readers[options['format'] or self._get_format(path)](path)
+            imported = 0
+            while batch := list(islice(items, options['batch_size'])):
+                datapoints = PollPlantMonitoringData._parse_datapoints(batch)
+                if datapoints:
+                    self._write(plant_id, datapoints)
+                imported += len(datapoints)
+                total += len(datapoints)
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f'{path}: {imported} datapoints imported '
+                    f'({total / elapsed if elapsed else 0:.0f} datapoints/s)'
+                )
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} datapoints in {elapsed:.2f} s '
+            f'({total / elapsed if elapsed else 0:.0f} datapoints/s)'
+        ))
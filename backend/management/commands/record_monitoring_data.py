@@ -0,0 +1,63 @@
+import datetime
+import time
+from http import HTTPStatus
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.replay import Recording
+
+
+def _parse_date(value: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: '{value}'.")
+
+
+class Command(BaseCommand):
+    help = 'Record the responses of the monitoring service, to be replayed by `replay_monitoring_data`.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory the recordings are written to, one file per plant')
+        parser.add_argument('plant_ids', nargs='+', type=int, help='Plant IDs, as known by the monitoring service')
+        parser.add_argument('--from', dest='date_from', required=True, help='Start date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', required=True, help='End date (YYYY-MM-DD), excluded')
+        parser.add_argument(
+            '--window-days', type=int, default=30,
+            help='Days requested at once. Latencies are recorded for requests of this size.'
+        )
+        parser.add_argument('--attempts', type=int, default=3, help='Attempts made for each request.')
+
+    def handle(self, *args, **options):
+        date_from, date_to = _parse_date(options['date_from']), _parse_date(options['date_to'])
+        window = datetime.timedelta(days=options['window_days'])
+        for plant_id in options['plant_ids']:
+            recording = Recording(plant_id)
+            cursor, attempts = date_from, 0
+            while cursor < date_to:
+                attempts += 1
+                start = time.monotonic()
+                response = requests.get(
+                    settings.MONITORING_SERVICE_URL,
+                    params={
+                        'plant-id': plant_id,
+                        'from': cursor,
+                        'to': min(date_to, cursor + window)
+                    }
+                )
+                latency = time.monotonic() - start
+                items = response.json() if response.status_code == HTTPStatus.OK else None
+                if isinstance(items, list):
+                    recording.add_response(items, latency)
+                    cursor, attempts = cursor + window, 0
+                elif attempts >= options['attempts']:
+                    raise CommandError(f'Plant {plant_id}: unable to get the datapoints from {cursor}')
+                else:
+                    # Errors are not recorded, since the replay error rate is configured separately
+                    self.stderr.write(f'Plant {plant_id}: {response.status_code} response from {cursor}, retrying')
+            recording.save(options['directory'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Recorded {sum(len(rows) for rows in recording.days.values())} datapoints of plant {plant_id}'
+            ))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.replay import Replayer, load_recordings, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve the responses recorded by `record_monitoring_data`, standing in for the monitoring service. '
+        'Point MONITORING_SERVICE_URL to it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory with the recordings')
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=5000)
+        parser.add_argument(
+            '--latency', type=float,
+            help='Seconds each response takes. Defaults to the latencies recorded.'
+        )
+        parser.add_argument(
+            '--error-rate', type=float, default=0.0,
+            help='Fraction of requests answered with a 503 error.'
+        )
+        parser.add_argument(
+            '--scale', type=int, default=1,
+            help='Number of datapoints served for each one recorded, spread evenly until the next one.'
+        )
+        parser.add_argument('--seed', default='', help='Seed of the random latencies and errors.')
+        parser.add_argument('--verbose', action='store_true', help='Log every request.')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError('Error rate must be between 0 and 1')
+        if options['scale'] < 1:
+            raise CommandError('Scale must be a positive integer')
+        try:
+            replayer = Replayer(
+                load_recordings(options['directory']),
+                latency=options['latency'],
+                error_rate=options['error_rate'],
+                scale=options['scale'],
+                seed=options['seed']
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Unable to load recordings: {e}')
+
+        server = make_server(replayer, options['host'], options['port'], options['verbose'])
+        self.stdout.write(f'Replaying {len(replayer.recordings)} plants on {options["host"]}:{options["port"]}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
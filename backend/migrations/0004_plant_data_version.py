@@ -0,0 +1,43 @@
+# Generated by Django 3.2.16 on 2026-10-19 14:20
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def set_last_datapoint_timestamp(apps, schema_editor):
+    Plant = apps.get_model('backend', 'Plant')
+    Datapoint = apps.get_model('backend', 'Datapoint')
+    Plant.objects.update(
+        last_datapoint_timestamp=Subquery(
+            Datapoint.objects.filter(
+                plant_id=OuterRef('id')
+            ).values('plant_id').annotate(
+                last_timestamp=Max('timestamp')
+            ).values('last_timestamp')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('backend', '0003_alter_plant_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plant',
+            name='datapoints_modified',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='plant',
+            name='datapoints_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='plant',
+            name='last_datapoint_timestamp',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(set_last_datapoint_timestamp, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.16 on 2026-10-19 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('backend', '0004_plant_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatapointSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('path', models.CharField(max_length=512)),
+                ('count', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('plant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='backend.plant')),
+            ],
+            options={
+                'unique_together': {('plant', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-19 14:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('backend', '0005_datapointsnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='datapoint',
+            name='plant',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='datapoints', to='backend.plant'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.16 on 2026-10-19 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('backend', '0006_datapoint_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('request_key', models.CharField(db_index=True, max_length=64)),
+                ('plant_ids', models.JSONField()),
+                ('date_from', models.DateTimeField(null=True)),
+                ('date_to', models.DateTimeField(null=True)),
+                ('format', models.CharField(choices=[('csv', 'CSV'), ('json', 'JSON')], max_length=8)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('progress', models.FloatField(default=0)),
+                ('path', models.CharField(blank=True, max_length=512)),
+                ('size', models.PositiveBigIntegerField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
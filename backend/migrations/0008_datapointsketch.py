@@ -0,0 +1,26 @@
+# Generated by Django 3.2.16 on 2026-10-19 15:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('backend', '0007_reportexport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatapointSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField()),
+                ('sketches', models.JSONField()),
+                ('plant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sketches', to='backend.plant')),
+            ],
+            options={
+                'unique_together': {('plant', 'day')},
+            },
+        ),
+    ]
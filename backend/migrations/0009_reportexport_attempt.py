@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-19 15:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('backend', '0008_datapointsketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportexport',
+            name='attempt',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -1,12 +1,42 @@
+import datetime
+
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+
+class PlantQuerySet(models.QuerySet):
+    def register_datapoints_write(self, last_timestamp: datetime.datetime) -> int:
+        """
+        Update the data version of the plants after writing some of their datapoints.
+        :param last_timestamp: Latest timestamp among the datapoints written
+        :return: Number of plants updated
+        """
+        return self.update(
+            datapoints_version=F('datapoints_version') + 1,
+            datapoints_modified=timezone.now(),
+            last_datapoint_timestamp=Greatest(
+                Coalesce('last_datapoint_timestamp', last_timestamp),
+                last_timestamp
+            )
+        )
 
 
 class Plant(models.Model):
     name = models.CharField(max_length=256, unique=True)
 
+    # Data version, maintained whenever datapoints are written
+    datapoints_version = models.PositiveIntegerField(default=0)
+    datapoints_modified = models.DateTimeField(null=True)
+    last_datapoint_timestamp = models.DateTimeField(null=True)
+
+    objects = PlantQuerySet.as_manager()
+
 
 class Datapoint(models.Model):
-    plant = models.ForeignKey('Plant', on_delete=models.CASCADE, related_name='datapoints')
+    # Datapoints may be stored in a different database than their plant, see `backend.sharding`
+    plant = models.ForeignKey('Plant', on_delete=models.CASCADE, related_name='datapoints', db_constraint=False)
     timestamp = models.DateTimeField(db_index=True)
 
     energy_expected = models.FloatField()
@@ -16,3 +46,61 @@ class Datapoint(models.Model):
 
     class Meta:
         unique_together = ('plant', 'timestamp')
+
+
+class DatapointSnapshot(models.Model):
+    """
+    Index entry of the immutable snapshot file holding the datapoints of a plant for a closed month.
+    """
+    plant = models.ForeignKey('Plant', on_delete=models.CASCADE, related_name='snapshots')
+    month = models.DateField()  # First day of the month
+    path = models.CharField(max_length=512)
+    count = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('plant', 'month')
+
+
+class DatapointSketch(models.Model):
+    """
+    Quantile sketches of the observed values of the datapoints of a plant for a day, see `backend.sketches`.
+    """
+    plant = models.ForeignKey('Plant', on_delete=models.CASCADE, related_name='sketches')
+    day = models.DateField()
+    count = models.PositiveIntegerField()
+    sketches = models.JSONField()  # Serialized sketch of each field
+
+    class Meta:
+        unique_together = ('plant', 'day')
+
+
+class ReportExport(models.Model):
+    """
+    Report exported asynchronously into a compressed file.
+    Identical requests share the same export, until the data of any of its plants changes.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    CSV = 'csv'
+    JSON = 'json'
+    FORMATS = [(CSV, 'CSV'), (JSON, 'JSON')]
+
+    key = models.CharField(max_length=64, unique=True)  # Hash of the request and the data versions of its plants
+    request_key = models.CharField(max_length=64, db_index=True)  # Hash of the request alone
+    plant_ids = models.JSONField()
+    date_from = models.DateTimeField(null=True)
+    date_to = models.DateTimeField(null=True)
+    format = models.CharField(max_length=8, choices=FORMATS)
+
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    progress = models.FloatField(default=0)  # Fraction of the plants exported
+    path = models.CharField(max_length=512, blank=True)
+    size = models.PositiveBigIntegerField(null=True)
+    attempt = models.CharField(max_length=32, blank=True)  # Token of the task attempt writing the file
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
@@ -0,0 +1,239 @@
+"""
+Opt-in profiling of requests and Celery tasks.
+
+A profile records the number of SQL queries run and the time spent on them, along with the time spent on each of the
+named stages the code goes through. Stages are timed with `stage`, which does nothing unless a profile is active.
+"""
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+_current_profile: ContextVar[Optional['Profile']] = ContextVar('profile', default=None)
+
+
+class Profile:
+    """
+    Timings of a request or task. Used as a context manager, it is the active profile while the context lasts.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.duration = None
+        self._start = None
+        self._token = None
+        self._exit_stack = ExitStack()
+
+    def __enter__(self) -> 'Profile':
+        self._start = time.perf_counter()
+        self._token = _current_profile.set(self)
+        self._exit_stack.enter_context(self.track_queries())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._exit_stack.close()
+        _current_profile.reset(self._token)
+        self.duration = time.perf_counter() - self._start
+
+    @contextmanager
+    def track_queries(self):
+        """
+        Record the queries run through the database connections of the current thread.
+        """
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self._execute_wrapper))
+            yield
+
+    def _execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_count += 1
+            self.sql_time += time.perf_counter() - start
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'duration': round(self.duration * 1000, 3),
+            'queries': self.query_count,
+            'sql': round(self.sql_time * 1000, 3),
+            'stages': {name: round(duration * 1000, 3) for name, duration in self.stages.items()},
+        }
+
+    def get_server_timing(self) -> str:
+        """
+        Get the value of the `Server-Timing` header with the timings recorded, in milliseconds.
+        """
+        metrics = [f'db;dur={self.sql_time * 1000:.3f};desc="{self.query_count} queries"']
+        metrics.extend(f'{name};dur={duration * 1000:.3f}' for name, duration in self.stages.items())
+        metrics.append(f'total;dur={self.duration * 1000:.3f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a stage of the active profile, if any.
+    Stages entered several times add up.
+    :param name: Stage name
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.stages[name] += time.perf_counter() - start
+
+
+@contextmanager
+def track_queries():
+    """
+    Record the queries run in the current thread into the active profile, if any.
+    Meant for worker threads serving a request, whose connections are not those of the thread it was received in.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.track_queries():
+        yield
+
+
+def is_sampled(sample_rate: float) -> bool:
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def log_profile(profile: Profile, threshold: float, profiler: Optional[cProfile.Profile] = None, **extra):
+    """
+    Write a profile to the slow log if it took longer than a threshold, along with its cProfile dump if any.
+    :param profile: Finished profile
+    :param threshold: Minimum duration logged, in seconds
+    :param profiler: Profiler run alongside the profile
+    :param extra: Additional fields logged
+    """
+    if profile.duration < threshold:
+        return
+    entry = {'message': 'Slow execution', **profile.as_dict(), **extra}
+    if profiler is not None and settings.PROFILING_CPROFILE_DIR:
+        os.makedirs(settings.PROFILING_CPROFILE_DIR, exist_ok=True)
+        slug = re.sub(r'[^\w.-]+', '-', profile.name).strip('-')
+        path = os.path.join(settings.PROFILING_CPROFILE_DIR, f'{timezone.now():%Y%m%dT%H%M%S.%f}-{slug}.prof')
+        profiler.dump_stats(path)
+        entry['cprofile'] = path
+    logger.warning(json.dumps(entry, default=str))
+
+
+def is_profiling_requested(request: HttpRequest) -> bool:
+    return bool(request.headers.get(settings.PROFILING_HEADER)) or is_sampled(settings.PROFILING_SAMPLE_RATE)
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests with the profiling header set, along with a sample of the rest.
+    Timings are returned in the `Server-Timing` header, and requests slower than a threshold are written to the slow
+    log, optionally with a cProfile dump.
+    Supports both sync and async chains, so that async views are not serialized into a single thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function, as Django's own middleware does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request: HttpRequest):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not is_profiling_requested(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile() if settings.PROFILING_CPROFILE_DIR else None
+        with Profile(f'{request.method} {request.path}') as profile:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        return self._process_response(request, response, profile, profiler)
+
+    async def __acall__(self, request: HttpRequest):
+        if not is_profiling_requested(request):
+            return await self.get_response(request)
+
+        # cProfile would record whatever else the event loop runs meanwhile, so it is not used here
+        with Profile(f'{request.method} {request.path}') as profile:
+            response = await self.get_response(request)
+        return self._process_response(request, response, profile)
+
+    @staticmethod
+    def _process_response(request: HttpRequest, response, profile: Profile, profiler: cProfile.Profile = None):
+        response['Server-Timing'] = profile.get_server_timing()
+        log_profile(
+            profile,
+            settings.PROFILING_SLOW_THRESHOLD,
+            profiler,
+            method=request.method,
+            path=request.get_full_path(),
+            status=response.status_code
+        )
+        return response
+
+
+class ProfiledJSONRenderer(JSONRenderer):
+    """
+    JSON renderer timing the rendering stage.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with stage('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+_task_profiles: Dict[str, Profile] = {}
+
+
+def start_task_profile(task_id: str, task_name: str):
+    """
+    Start profiling a Celery task, if sampled.
+    """
+    if is_sampled(settings.PROFILING_TASK_SAMPLE_RATE):
+        _task_profiles[task_id] = Profile(task_name).__enter__()
+
+
+def finish_task_profile(task_id: str, **extra):
+    """
+    Finish profiling a Celery task, if it was profiled, and log its timings.
+    """
+    profile = _task_profiles.pop(task_id, None)
+    if profile is None:
+        return
+    profile.__exit__(None, None, None)
+    log_profile(profile, settings.PROFILING_SLOW_TASK_THRESHOLD, **extra)
@@ -0,0 +1,236 @@
+"""
+Registry of the datapoint pulls requested for each plant, kept in Redis.
+
+Each plant has a hash of pulls, pending or running, identified by the ID passed to the task performing them.
+Ranges already being pulled, or pending in the same queue with the same priority, are not requested again, so pulls
+never grow past the range they were registered with. Cursor pulls only write the datapoints after the last one stored,
+so they stop being so when a regular request overlaps them.
+Each entry expires on its own, so a pull whose task was lost doesn't keep its range from being requested again.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from redis.lock import Lock
+
+from backend.streams import get_redis
+
+DateRange = Tuple[datetime.date, datetime.date]
+
+
+class Pull(NamedTuple):
+    date_from: datetime.date
+    date_to: datetime.date
+    expires: float  # Unix time the entry is dropped at
+    running: bool = False
+    cursor: bool = False
+    queue: Optional[str] = None
+    priority: Optional[int] = None
+
+    def dumps(self) -> str:
+        return json.dumps([
+            self.date_from.isoformat(), self.date_to.isoformat(), self.expires, self.running, self.cursor,
+            self.queue, self.priority
+        ])
+
+    @classmethod
+    def loads(cls, value) -> 'Pull':
+        """
+        Parse a registry entry.
+        :raise ValueError: If the entry is malformed
+        """
+        try:
+            date_from, date_to, expires, running, cursor, queue, priority = json.loads(value)
+            pull = cls(
+                datetime.date.fromisoformat(date_from), datetime.date.fromisoformat(date_to), expires,
+                running, cursor, queue, priority
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'Invalid pull: {value!r}') from e
+        if not (
+                isinstance(expires, (int, float)) and not isinstance(expires, bool)
+                and isinstance(running, bool) and isinstance(cursor, bool)
+                and (queue is None or isinstance(queue, str))
+                and (priority is None or (isinstance(priority, int) and not isinstance(priority, bool)))
+        ):
+            raise ValueError(f'Invalid pull: {value!r}')
+        return pull
+
+    def is_expired(self) -> bool:
+        return self.expires <= time.time()
+
+
+def _get_expiry() -> float:
+    return time.time() + settings.PULL_REGISTRY_TIMEOUT
+
+
+def get_registry_key(plant_id) -> str:
+    return f'plants:{plant_id}:pulls'
+
+
+def get_write_lock(plant_id) -> Lock:
+    """
+    Get the lock held while writing the datapoints of a given Plant.
+    Its token isn't thread-local, so it can be renewed from another thread.
+    """
+    return get_redis().lock(
+        f'plants:{plant_id}:write',
+        timeout=settings.DATAPOINTS_WRITE_LOCK_TIMEOUT,
+        thread_local=False
+    )
+
+
+@contextmanager
+def hold_write_lock(plant_id):
+    """
+    Hold the write lock of a given Plant, renewing it in the background however long the write takes.
+    """
+    lock = get_write_lock(plant_id)
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(settings.DATAPOINTS_WRITE_LOCK_TIMEOUT / 3):
+            try:
+                lock.reacquire()
+            except Exception as e:
+                logging.error({
+                    'message': 'Unable to renew write lock',
+                    'plant_id': plant_id,
+                    'error': str(e)
+                })
+
+    with lock:
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+
+def _get_registry_lock(plant_id) -> Lock:
+    return get_redis().lock(f'{get_registry_key(plant_id)}:lock', timeout=10)
+
+
+def _load_pulls(plant_id) -> Dict[str, Pull]:
+    """
+    Load the pulls registered for a plant, dropping the expired and malformed ones. Meant to be called holding the
+    registry lock.
+    """
+    pulls = {}
+    for pull_id, value in get_redis().hgetall(get_registry_key(plant_id)).items():
+        pull_id = pull_id.decode() if isinstance(pull_id, bytes) else pull_id
+        try:
+            pull = Pull.loads(value)
+        except ValueError as e:
+            logging.error({
+                'message': 'Invalid pull registered',
+                'plant_id': plant_id,
+                'error': str(e)
+            })
+            get_redis().hdel(get_registry_key(plant_id), pull_id)
+            continue
+        if pull.is_expired():
+            get_redis().hdel(get_registry_key(plant_id), pull_id)
+            continue
+        pulls[pull_id] = pull
+    return pulls
+
+
+def _save_pull(plant_id, pull_id: str, pull: Pull):
+    key = get_registry_key(plant_id)
+    get_redis().hset(key, pull_id, pull.dumps())
+    # Entries expire on their own. The key expiring as well only cleans up plants no longer pulled
+    get_redis().expire(key, settings.PULL_REGISTRY_TIMEOUT)
+
+
+def subtract_date_ranges(date_from: datetime.date, date_to: datetime.date, ranges: List[DateRange]) -> List[DateRange]:
+    """
+    Get the parts of a range of dates not covered by some other ranges.
+    :param date_from: Start date
+    :param date_to: End date (excluded)
+    :param ranges: List of (start date, end date) ranges to subtract
+    :return: List of (start date, end date) ranges left, sorted
+    """
+    pieces = []
+    cursor = date_from
+    for range_from, range_to in sorted(ranges):
+        if range_to <= cursor or range_from >= date_to:
+            continue
+        if range_from > cursor:
+            pieces.append((cursor, range_from))
+        cursor = max(cursor, range_to)
+    if cursor < date_to:
+        pieces.append((cursor, date_to))
+    return pieces
+
+
+def register_pull(
+        plant_id,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        cursor: bool = False,
+        queue: Optional[str] = None,
+        priority: Optional[int] = None
+) -> List[Tuple[str, DateRange]]:
+    """
+    Register a request to pull a range of dates for a given Plant.
+    Parts already being pulled, or pending in the same queue with the same priority, are skipped. Pending pulls never
+    take over the rest, so a request is never delayed behind a task in another queue.
+    :param plant_id: Plant ID
+    :param date_from: Start date
+    :param date_to: End date (excluded)
+    :param cursor: Whether only the datapoints after the last one stored are requested
+    :param queue: Queue the tasks performing the pulls are sent to
+    :param priority: Priority of those tasks
+    :return: List of (pull ID, (start date, end date)) of the new pulls, which need a task to perform them
+    """
+    new_pulls = []
+    with _get_registry_lock(plant_id):
+        pulls = _load_pulls(plant_id)
+        covered = []
+        for pull_id, pull in pulls.items():
+            if pull.running:
+                covered.append((pull.date_from, pull.date_to))
+            elif pull.queue == queue and pull.priority == priority:
+                covered.append((pull.date_from, pull.date_to))
+                if pull.cursor and not cursor and pull.date_from < date_to and date_from < pull.date_to:
+                    # Pending cursor pulls write everything in their range once a regular request overlaps them
+                    _save_pull(plant_id, pull_id, pull._replace(cursor=False))
+
+        for piece_from, piece_to in subtract_date_ranges(date_from, date_to, covered):
+            pull_id = uuid.uuid4().hex
+            pull = Pull(piece_from, piece_to, _get_expiry(), cursor=cursor, queue=queue, priority=priority)
+            _save_pull(plant_id, pull_id, pull)
+            new_pulls.append((pull_id, (piece_from, piece_to)))
+    return new_pulls
+
+
+def start_pull(plant_id, pull_id: str) -> Optional[Pull]:
+    """
+    Mark a pending pull as running.
+    :param plant_id: Plant ID
+    :param pull_id: Pull ID
+    :return: Pull to perform, or None if the pull expired or is already running
+    """
+    with _get_registry_lock(plant_id):
+        pull = _load_pulls(plant_id).get(pull_id)
+        if pull is None or pull.running:
+            return None
+        pull = pull._replace(running=True, expires=_get_expiry())
+        _save_pull(plant_id, pull_id, pull)
+    return pull
+
+
+def finish_pull(plant_id, pull_id: str):
+    """
+    Remove a finished pull from the registry.
+    """
+    get_redis().hdel(get_registry_key(plant_id), pull_id)
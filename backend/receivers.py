@@ -0,0 +1,78 @@
+from functools import partial
+
+from celery.signals import task_postrun, task_prerun
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from backend import fragments, profiling, streams
+from backend.models import Plant, Datapoint, DatapointSnapshot
+from backend.sharding import get_shard
+from backend.signals import datapoints_saved
+from backend.snapshots import delete_snapshot_files, get_month
+
+
+@receiver(datapoints_saved)
+def update_data_version(sender, plant_id, timestamps, **kwargs):
+    """
+    Bump the data version of the plant within the same transaction the datapoints are written.
+    """
+    Plant.objects.filter(id=plant_id).register_datapoints_write(max(timestamps))
+
+
+@receiver(datapoints_saved)
+def publish_datapoints_change(sender, plant_id, timestamps, **kwargs):
+    """
+    Notify the datapoint stream subscribers once the written datapoints are committed.
+    """
+    transaction.on_commit(partial(streams.publish_datapoints_change, plant_id, timestamps))
+
+
+@receiver(datapoints_saved)
+def invalidate_snapshots(sender, plant_id, timestamps, **kwargs):
+    """
+    Drop the snapshots of the archived months the datapoints were written into.
+    Their files are removed once the transaction is committed.
+    """
+    snapshots = DatapointSnapshot.objects.filter(
+        plant_id=plant_id,
+        month__in={get_month(timestamp) for timestamp in timestamps}
+    )
+    paths = list(snapshots.values_list('path', flat=True))
+    if paths:
+        snapshots.delete()
+        transaction.on_commit(partial(delete_snapshot_files, paths))
+
+
+@receiver(datapoints_saved)
+def invalidate_report_fragments(sender, plant_id, timestamps, **kwargs):
+    """
+    Drop the cached report fragments of the days the datapoints were written into, once the transaction is committed.
+    """
+    days = {fragments.get_day(timestamp) for timestamp in timestamps}
+    transaction.on_commit(partial(fragments.delete_fragments, plant_id, days))
+
+
+@receiver(post_delete, sender=Plant)
+def delete_report_fragments(sender, instance, **kwargs):
+    transaction.on_commit(partial(fragments.delete_plant_fragments, instance.id))
+
+
+@receiver(post_delete, sender=Plant)
+def delete_sharded_datapoints(sender, instance, using, **kwargs):
+    """
+    Delete the datapoints of a deleted plant when they are stored in a shard, out of reach of the cascade.
+    """
+    shard = get_shard(instance.id)
+    if shard != using:
+        Datapoint.objects.using(shard).filter(plant_id=instance.id).delete()
+
+
+@task_prerun.connect
+def start_task_profile(task_id, task, **kwargs):
+    profiling.start_task_profile(task_id, task.name)
+
+
+@task_postrun.connect
+def finish_task_profile(task_id, task, state=None, **kwargs):
+    profiling.finish_task_profile(task_id, state=state, arguments=kwargs.get('kwargs'))
@@ -0,0 +1,254 @@
+"""
+Stand-in for the monitoring service, replaying responses recorded from the real one.
+
+Recordings hold the datapoints received for a plant grouped by day, each one as a compact row of
+`[time, expected energy, observed energy, expected irradiation, observed irradiation]`, along with the latency of the
+requests recorded. Items not matching the monitoring service schema are kept as they were received. Each plant is
+stored in its own gzip-compressed JSON file.
+
+Any range of dates can be replayed out of them: requested days are mapped cyclically onto the recorded ones, and
+plants not recorded onto the recorded plants. Latency, error rate and payload size are configurable, and random
+choices are seeded by request, so replays are deterministic regardless of the order requests arrive in.
+"""
+import datetime
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+FIELDS = [('expected', 'energy'), ('observed', 'energy'), ('expected', 'irradiation'), ('observed', 'irradiation')]
+
+# Interval between datapoints assumed for days with a single one, in seconds
+DEFAULT_INTERVAL = 60 * 60
+
+
+def _compact_item(item) -> Optional[Tuple[str, list]]:
+    """
+    Get the day and compact row of an item with the monitoring service schema, or None if it doesn't match it.
+    """
+    try:
+        day, time_suffix = item['datetime'][:10], item['datetime'][10:]
+        datetime.date.fromisoformat(day)
+        datetime.time.fromisoformat(time_suffix[1:9])
+        values = [item[group][name] for group, name in FIELDS]
+    except (KeyError, TypeError, ValueError):
+        return None
+    numeric = all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+    if set(item) != {'datetime', 'expected', 'observed'} or not numeric:
+        return None
+    return day, [time_suffix, *values]
+
+
+def _expand_row(day: str, row: list) -> dict:
+    item = {'datetime': day + row[0], 'expected': {}, 'observed': {}}
+    for (group, name), value in zip(FIELDS, row[1:]):
+        item[group][name] = value
+    return item
+
+
+class Recording:
+    """
+    Responses of the monitoring service recorded for a plant.
+    """
+
+    def __init__(self, plant_id: int, days: Optional[Dict[str, list]] = None, latencies: Optional[List[float]] = None):
+        self.plant_id = plant_id
+        self.days: Dict[str, list] = days or {}
+        self.latencies: List[float] = latencies or []
+
+    def add_response(self, items: list, latency: float):
+        """
+        Add the items of a response to the recording.
+        :param items: Items received
+        :param latency: Seconds the response took
+        """
+        self.latencies.append(latency)
+        days = defaultdict(list)
+        for item in items:
+            compact = _compact_item(item)
+            if compact is None:
+                # Kept as received, under the day of its timestamp if it has any
+                day = str(item.get('datetime', ''))[:10] if isinstance(item, dict) else ''
+                days[day].append(item)
+            else:
+                days[compact[0]].append(compact[1])
+        self.days.update(days)
+
+    @staticmethod
+    def get_path(directory: str, plant_id: int) -> str:
+        return os.path.join(directory, f'{plant_id}.json.gz')
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.get_path(directory, self.plant_id), 'wt') as file:
+            json.dump({
+                'plant_id': self.plant_id,
+                'latencies': self.latencies,
+                'days': dict(sorted(self.days.items())),
+            }, file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str) -> 'Recording':
+        with gzip.open(path, 'rt') as file:
+            data = json.load(file)
+        return cls(data['plant_id'], data['days'], data['latencies'])
+
+
+def load_recordings(directory: str) -> Dict[int, Recording]:
+    recordings = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json.gz'):
+            recording = Recording.load(os.path.join(directory, name))
+            recordings[recording.plant_id] = recording
+    return recordings
+
+
+def _scale_rows(day: str, rows: list, scale: int) -> List[dict]:
+    """
+    Expand the rows of a day into items, spreading `scale` copies of each row evenly until the next one.
+    """
+    items, previous_interval = [], DEFAULT_INTERVAL
+    times = [
+        datetime.datetime.combine(datetime.date.fromisoformat(day), datetime.time.fromisoformat(row[0][1:9]))
+        if isinstance(row, list) else None
+        for row in rows
+    ]
+    for index, row in enumerate(rows):
+        if times[index] is None:
+            items.append(row)
+            continue
+        following = next((timestamp for timestamp in times[index + 1:] if timestamp is not None), None)
+        interval = (following - times[index]).total_seconds() if following else previous_interval
+        previous_interval = interval
+        for copy in range(scale):
+            timestamp = times[index] + datetime.timedelta(seconds=int(interval * copy / scale))
+            items.append(_expand_row(
+                timestamp.date().isoformat(),
+                [f'T{timestamp:%H:%M:%S}{row[0][9:]}', *row[1:]]
+            ))
+    return items
+
+
+class Replayer:
+    """
+    Responses of the stand-in monitoring service.
+    """
+
+    def __init__(
+            self,
+            recordings: Dict[int, Recording],
+            latency: Optional[float] = None,
+            error_rate: float = 0.0,
+            scale: int = 1,
+            seed: str = ''
+    ):
+        """
+        :param recordings: Recordings by plant ID
+        :param latency: Seconds each response takes. Defaults to the latencies recorded.
+        :param error_rate: Fraction of requests answered with an error
+        :param scale: Number of datapoints served for each one recorded
+        :param seed: Seed of the random choices
+        """
+        if not recordings:
+            raise ValueError('No recordings to replay')
+        self.recordings = recordings
+        self.latency = latency
+        self.error_rate = error_rate
+        self.scale = scale
+        self.seed = seed
+        self.plant_ids = sorted(recordings)
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def _get_recording(self, plant_id: int) -> Recording:
+        return self.recordings.get(plant_id) or self.recordings[self.plant_ids[plant_id % len(self.plant_ids)]]
+
+    def get_items(self, plant_id: int, date_from: datetime.date, date_to: datetime.date) -> List[dict]:
+        """
+        Get the datapoints served for a plant within a range of dates.
+        :param plant_id: Plant ID
+        :param date_from: Start date
+        :param date_to: End date (excluded)
+        :return: List of items with the monitoring service schema
+        """
+        recording = self._get_recording(plant_id)
+        recorded_days = sorted(day for day in recording.days if day)
+        if not recorded_days:
+            return []
+        items = []
+        day = date_from
+        while day < date_to:
+            recorded_day = day.isoformat()
+            if recorded_day not in recording.days:
+                recorded_day = recorded_days[day.toordinal() % len(recorded_days)]
+            items.extend(_scale_rows(day.isoformat(), recording.days[recorded_day], self.scale))
+            day += datetime.timedelta(days=1)
+        return items
+
+    def respond(self, plant_id: int, date_from: datetime.date, date_to: datetime.date) -> Tuple[int, bytes, float]:
+        """
+        Get the response to a request.
+        :return: Tuple with the status code, body and seconds the response is delayed
+        """
+        key = (plant_id, date_from, date_to)
+        with self._lock:
+            self.requests[key] += 1
+            attempt = self.requests[key]
+        # Seeded by request and attempt, so retries of a failed request may succeed
+        rng = random.Random(f'{self.seed}:{plant_id}:{date_from}:{date_to}:{attempt}')
+        recording = self._get_recording(plant_id)
+        if self.latency is not None:
+            delay = self.latency
+        else:
+            delay = rng.choice(recording.latencies) if recording.latencies else 0.0
+        if rng.random() < self.error_rate:
+            return HTTPStatus.SERVICE_UNAVAILABLE, b'Service Unavailable', delay
+        body = json.dumps(self.get_items(plant_id, date_from, date_to), separators=(',', ':')).encode()
+        return HTTPStatus.OK, body, delay
+
+
+def make_server(replayer: Replayer, host: str = '0.0.0.0', port: int = 5000, verbose: bool = False):
+    """
+    Create the HTTP server of the stand-in monitoring service, serving each request in its own thread.
+    :param replayer: Replayer producing the responses
+    :param host: Host to listen on
+    :param port: Port to listen on. Use 0 for any free one.
+    :param verbose: Whether requests are logged
+    :return: Server, whose `serve_forever` method starts serving
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            try:
+                plant_id = int(params['plant-id'][0])
+                date_from = datetime.date.fromisoformat(params['from'][0][:10])
+                date_to = datetime.date.fromisoformat(params['to'][0][:10])
+            except (KeyError, ValueError):
+                self._send(HTTPStatus.BAD_REQUEST, b'Bad Request')
+                return
+            status, body, delay = replayer.respond(plant_id, date_from, date_to)
+            time.sleep(delay)
+            self._send(status, body)
+
+        def _send(self, status: int, body: bytes):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json' if status == HTTPStatus.OK else 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if verbose:
+                super().log_message(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,109 @@
+import datetime
+from bisect import bisect_left
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import Q
+
+from backend.models import Plant, Datapoint, DatapointSnapshot
+from backend.sharding import map_shards
+from backend.snapshots import get_month, get_month_bounds, get_next_month, read_snapshot
+
+
+def _get_snapshot_runs(
+        plant_ids: List[int],
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime]
+) -> Dict[int, List[DatapointSnapshot]]:
+    """
+    Get, for each plant, the longest run of consecutive archived months overlapping the given range.
+    """
+    snapshots = DatapointSnapshot.objects.filter(plant_id__in=plant_ids).order_by('plant_id', 'month')
+    if date_from:
+        snapshots = snapshots.filter(month__gte=get_month(date_from))
+    if date_to:
+        snapshots = snapshots.filter(month__lte=get_month(date_to))
+
+    runs, current = {}, {}
+    for snapshot in snapshots:
+        run = current.get(snapshot.plant_id)
+        if run and get_next_month(run[-1].month) == snapshot.month:
+            run.append(snapshot)
+        else:
+            run = current[snapshot.plant_id] = [snapshot]
+        if len(run) > len(runs.get(snapshot.plant_id, [])):
+            runs[snapshot.plant_id] = run
+    return runs
+
+
+def get_report_datapoints(
+        plants: Iterable[Plant],
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None
+) -> Dict[int, List[Datapoint]]:
+    """
+    Get the datapoints of the given plants within a range of dates.
+    Archived months are read from their snapshots, while the rest of the range is read from the database, querying
+    the shards holding the plants in parallel. Runs whose snapshot files were deleted after their index was read are
+    read from the database too.
+    :param plants: Plants
+    :param date_from: Start timestamp (included)
+    :param date_to: End timestamp (excluded)
+    :return: Dictionary with the list of datapoints of each plant ID, sorted by timestamp
+    """
+    plant_ids = [plant.id for plant in plants]
+    if not plant_ids:
+        return {}
+    runs = _get_snapshot_runs(plant_ids, date_from, date_to)
+    archived_by_plant = {}
+    for plant_id, run in list(runs.items()):
+        try:
+            archived_by_plant[plant_id] = [
+                datapoint
+                for snapshot in run
+                for datapoint in read_snapshot(snapshot, date_from, date_to)
+            ]
+        except FileNotFoundError:
+            # Invalidated by a write meanwhile, which is in the database already
+            del runs[plant_id]
+
+    conditions = {}
+    if date_from:
+        conditions['timestamp__gte'] = date_from
+    if date_to:
+        conditions['timestamp__lt'] = date_to
+
+    # Read from the database every datapoint out of the archived runs
+    archived_bounds: Dict[int, Tuple[datetime.datetime, datetime.datetime]] = {
+        plant_id: (get_month_bounds(run[0].month)[0], get_month_bounds(run[-1].month)[1])
+        for plant_id, run in runs.items()
+    }
+
+    def read_shard(alias: str, shard_plant_ids: List[int]) -> List[Datapoint]:
+        plant_conditions = [Q(plant_id__in=[plant_id for plant_id in shard_plant_ids if plant_id not in runs])]
+        for plant_id in shard_plant_ids:
+            if plant_id in archived_bounds:
+                start, end = archived_bounds[plant_id]
+                plant_conditions.append(
+                    Q(plant_id=plant_id) & (Q(timestamp__lt=start) | Q(timestamp__gte=end))
+                )
+        return list(Datapoint.objects.using(alias).filter(
+            reduce(or_, plant_conditions),
+            **conditions
+        ).order_by('timestamp'))
+
+    # Plants are never split across shards, so the datapoints of each one come ordered from a single query
+    datapoints_by_plant = defaultdict(list)
+    for datapoints in map_shards(read_shard, plant_ids):
+        for datapoint in datapoints:
+            datapoints_by_plant[datapoint.plant_id].append(datapoint)
+
+    # Splice in the archived datapoints
+    for plant_id, archived in archived_by_plant.items():
+        plant_datapoints = datapoints_by_plant[plant_id]
+        index = bisect_left(plant_datapoints, archived_bounds[plant_id][1], key=lambda datapoint: datapoint.timestamp)
+        plant_datapoints[index:index] = archived
+
+    return {plant_id: datapoints_by_plant[plant_id] for plant_id in plant_ids}
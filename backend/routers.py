@@ -0,0 +1,115 @@
+"""
+Routing of datapoint queries to their shards, and of read queries to the replicas of the default database.
+
+Reads are only sent to a replica within `replica_reads`, which views heavy on reads enter. Everything else, including
+ingestion and plant writes, goes to the primary. Clients which just wrote something get a cookie pinning their reads to
+the primary for a while, so they read their own writes despite the replication lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpRequest
+
+PIN_PRIMARY_COOKIE = 'pin_primary'
+
+_replica: ContextVar[Optional[str]] = ContextVar('replica', default=None)
+
+
+def is_pinned_to_primary(request: HttpRequest) -> bool:
+    return PIN_PRIMARY_COOKIE in request.COOKIES or bool(request.headers.get(settings.READ_PRIMARY_HEADER))
+
+
+def pin_to_primary(response):
+    """
+    Pin the reads of the client receiving a response to the primary database for a while.
+    """
+    response.set_cookie(PIN_PRIMARY_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+
+
+@contextmanager
+def replica_reads(request: HttpRequest):
+    """
+    Send the read queries made within this context to one of the replicas, unless the client is pinned to the primary.
+    A single replica is used for the whole context, so reads are consistent with each other.
+    :param request: Request served
+    """
+    if not settings.REPLICA_DATABASES or is_pinned_to_primary(request):
+        yield
+        return
+    token = _replica.set(random.choice(settings.REPLICA_DATABASES))
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def get_read_alias(alias: str) -> str:
+    """
+    Get the alias of the database to read from instead of a given one, which is a replica within `replica_reads`.
+    Meant for querysets sent to a database explicitly.
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        return _replica.get() or alias
+    return alias
+
+
+def read_from_replicas(view):
+    """
+    Decorate a view method so that its read queries are sent to the replicas.
+    """
+
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        with replica_reads(request):
+            return view(self, request, *args, **kwargs)
+
+    return wrapper
+
+
+class ShardRouter:
+    """
+    Send the queries on datapoints to the shard of their plant, when it is known from the instances involved.
+    Querysets on datapoints are sent to their shard explicitly, see `backend.sharding`.
+    Only the datapoints table is created in the shards.
+    """
+
+    def _db_for_datapoints(self, model, **hints):
+        if model._meta.label != 'backend.Datapoint' or not settings.DATAPOINT_SHARDS:
+            return None
+        # Imported here, as routers are loaded along with the database connections
+        from backend.sharding import get_shard
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        plant_id = instance.plant_id if instance._meta.label == 'backend.Datapoint' else instance.pk
+        return get_shard(plant_id)
+
+    db_for_read = _db_for_datapoints
+    db_for_write = _db_for_datapoints
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards only hold datapoints, while the default database holds every model even when it is a shard too
+        if db not in settings.DATAPOINT_SHARDS or db == DEFAULT_DB_ALIAS:
+            return None
+        return app_label == 'backend' and model_name == 'datapoint'
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _replica.get() or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db not in settings.REPLICA_DATABASES
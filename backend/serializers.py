@@ -1,8 +1,9 @@
 import arrow
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
 
-from backend.models import Plant, Datapoint
+from backend.models import Plant, Datapoint, ReportExport
 
 
 class PlantSerializer(serializers.ModelSerializer):
@@ -18,12 +19,36 @@ class DatapointSerializer(serializers.ModelSerializer):
 
 
 class PlantReportSerializer(PlantSerializer):
-    datapoints = DatapointSerializer(many=True, read_only=True)
+    # Datapoints within the report range, attached to each plant already encoded when building the report
+    datapoints = serializers.ReadOnlyField(source='report_datapoints')
 
     class Meta(PlantSerializer.Meta):
         fields = PlantSerializer.Meta.fields + ['datapoints']
 
 
+class PlantPercentilesSerializer(PlantSerializer):
+    # Percentiles of the observed values within the report range, attached to each plant when building the report
+    percentiles = serializers.ReadOnlyField(source='report_percentiles')
+
+    class Meta(PlantSerializer.Meta):
+        fields = PlantSerializer.Meta.fields + ['percentiles']
+
+
+class ReportExportSerializer(serializers.ModelSerializer):
+    # URL to download the file from, once written
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportExport
+        fields = ['id', 'plant_ids', 'date_from', 'date_to', 'format', 'status', 'progress', 'size', 'created',
+                  'updated', 'download']
+
+    def get_download(self, export: ReportExport):
+        if export.status != ReportExport.DONE:
+            return None
+        return reverse('reportexport-download', args=[export.id], request=self.context.get('request'))
+
+
 class DatapointImportSerializer(DatapointSerializer):
     def to_internal_value(self, data):
         try:
@@ -0,0 +1,87 @@
+"""
+Sharding of datapoints by plant across several databases.
+
+The datapoints of each plant are stored in a single shard, given by the shard map: the plant's entry in
+`DATAPOINT_SHARD_MAP` if any, or its ID modulo the number of shards otherwise. Plants and the rest of models are kept
+in the default database, which also stores the datapoints when no shards are configured.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, Dict, Iterable, List, Optional, TypeVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import QuerySet
+
+from backend.models import Datapoint
+from backend.profiling import track_queries
+from backend.routers import get_read_alias
+
+T = TypeVar('T')
+
+
+def get_shards() -> List[str]:
+    return settings.DATAPOINT_SHARDS or [DEFAULT_DB_ALIAS]
+
+
+def get_shard(plant_id) -> str:
+    """
+    Get the alias of the database storing the datapoints of a given Plant.
+    """
+    shards = get_shards()
+    return settings.DATAPOINT_SHARD_MAP.get(int(plant_id)) or shards[int(plant_id) % len(shards)]
+
+
+def group_by_shard(plant_ids: Iterable[int]) -> Dict[str, List[int]]:
+    """
+    Group plant IDs by the shard storing their datapoints.
+    """
+    groups = defaultdict(list)
+    for plant_id in plant_ids:
+        groups[get_shard(plant_id)].append(plant_id)
+    return dict(groups)
+
+
+def get_datapoints(plant_id) -> QuerySet:
+    """
+    Get the datapoints of a given Plant, from its shard.
+    """
+    return Datapoint.objects.using(get_read_alias(get_shard(plant_id))).filter(plant_id=plant_id)
+
+
+def _run_on_shard(func: Callable[[str, Optional[List[int]]], T], alias: str, plant_ids: Optional[List[int]]) -> T:
+    try:
+        with track_queries():
+            return func(alias, plant_ids)
+    finally:
+        # Connections opened by worker threads are not reused
+        for connection in connections.all():
+            connection.close()
+
+
+def map_shards(
+        func: Callable[[str, Optional[List[int]]], T],
+        plant_ids: Optional[Iterable[int]] = None
+) -> List[T]:
+    """
+    Run a function reading from each shard, in parallel when several of them are involved.
+    :param func: Callable receiving the alias to read the shard from and the IDs of its plants, or None for all of them
+    :param plant_ids: Plant IDs. Defaults to all plants, in every shard.
+    :return: List with the result of each shard
+    """
+    if plant_ids is None:
+        groups = {alias: None for alias in get_shards()}
+    else:
+        groups = group_by_shard(plant_ids)
+    groups = {get_read_alias(alias): ids for alias, ids in groups.items()}
+    if len(groups) <= 1:
+        return [func(alias, ids) for alias, ids in groups.items()]
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        futures = [
+            # Each worker runs in a copy of the current context, so profiling and routing state carry over
+            executor.submit(copy_context().run, _run_on_shard, func, alias, ids)
+            for alias, ids in groups.items()
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent within the writing transaction whenever datapoints of a plant are created or updated.
+# Arguments: `plant_id` and `timestamps` (list with the timestamps of the datapoints written).
+datapoints_saved = Signal()
@@ -0,0 +1,274 @@
+"""
+Mergeable quantile sketches of the observed values of each plant-day.
+
+Each day of a plant keeps a DDSketch of every field in `FIELDS`: values are counted in buckets whose bounds grow
+geometrically, so any quantile is estimated within `RELATIVE_ACCURACY` of its actual value, and sketches of different
+days are merged by adding up their bucket counts. Sketches are updated incrementally as datapoints are written,
+removing the previous values of the datapoints updated, so percentiles over any range of days are answered by merging
+the sketches of those days instead of reading every datapoint.
+"""
+import datetime
+import math
+from collections import defaultdict
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import Q
+
+from backend.fragments import get_day, get_day_bounds
+from backend.models import Plant, Datapoint, DatapointSketch
+from backend.sharding import get_datapoints, map_shards
+
+FIELDS = ['energy_observed', 'irradiation_observed']
+
+# Changing it invalidates the sketches stored, which need to be built again
+RELATIVE_ACCURACY = 0.01
+
+# Values closer to zero than this are counted as zero
+MIN_VALUE = 1e-9
+
+
+class DDSketch:
+    """
+    Quantile sketch with relative accuracy guarantees, as described in "DDSketch: A Fast and Fully-Mergeable Quantile
+    Sketch with Relative-Error Guarantees" (Masson et al., 2019).
+    Buckets are never collapsed, as the values of a single field span a limited number of them.
+    """
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self):
+        self.positive: Dict[int, int] = defaultdict(int)
+        self.negative: Dict[int, int] = defaultdict(int)
+        self.zero = 0
+
+    @property
+    def count(self) -> int:
+        return self.zero + sum(self.positive.values()) + sum(self.negative.values())
+
+    def _get_index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _get_value(self, index: int) -> float:
+        # Midpoint of the bucket bounds in relative terms, within the relative accuracy of any value in it
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1):
+        """
+        Add a value to the sketch.
+        :param value: Value. Non-finite values are ignored.
+        :param count: Times the value is added, negative to remove it
+        """
+        if not math.isfinite(value):
+            return
+        if abs(value) < MIN_VALUE:
+            self.zero = max(self.zero + count, 0)
+            return
+        buckets = self.positive if value > 0 else self.negative
+        index = self._get_index(abs(value))
+        buckets[index] += count
+        if buckets[index] <= 0:
+            # Values removed which were never added are ignored
+            del buckets[index]
+
+    def merge(self, other: 'DDSketch'):
+        """
+        Add the values of another sketch to this one.
+        """
+        for index, count in other.positive.items():
+            self.positive[index] += count
+        for index, count in other.negative.items():
+            self.negative[index] += count
+        self.zero += other.zero
+
+    def get_quantile(self, quantile: float) -> Optional[float]:
+        """
+        Estimate a quantile of the values added.
+        :param quantile: Quantile, between 0 and 1
+        :return: Estimated value, or None if the sketch is empty
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = quantile * (count - 1)
+        buckets = [(-self._get_value(index), self.negative[index]) for index in sorted(self.negative, reverse=True)]
+        buckets.append((0.0, self.zero))
+        buckets.extend((self._get_value(index), self.positive[index]) for index in sorted(self.positive))
+        seen = 0
+        for value, bucket_count in buckets:
+            seen += bucket_count
+            if seen > rank:
+                return value
+        return buckets[-1][0]
+
+    def to_dict(self) -> dict:
+        return {
+            'zero': self.zero,
+            'positive': {str(index): count for index, count in self.positive.items()},
+            'negative': {str(index): count for index, count in self.negative.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'DDSketch':
+        sketch = cls()
+        if data:
+            sketch.zero = data['zero']
+            sketch.positive.update((int(index), count) for index, count in data['positive'].items())
+            sketch.negative.update((int(index), count) for index, count in data['negative'].items())
+        return sketch
+
+
+def _get_values(datapoint: Datapoint) -> dict:
+    return {field: getattr(datapoint, field) for field in FIELDS}
+
+
+def _save_day_sketches(plant_id, sketches: Dict[datetime.date, Dict[str, DDSketch]], existing: Dict):
+    to_create, to_update = [], []
+    for day, day_sketches in sketches.items():
+        sketch = existing.get(day) or DatapointSketch(plant_id=plant_id, day=day)
+        sketch.count = day_sketches[FIELDS[0]].count
+        sketch.sketches = {field: day_sketches[field].to_dict() for field in FIELDS}
+        (to_update if sketch.pk else to_create).append(sketch)
+    DatapointSketch.objects.bulk_create(to_create)
+    DatapointSketch.objects.bulk_update(to_update, fields=['count', 'sketches'])
+
+
+def update_sketches(plant_id, created: List[Datapoint], updated: List[Datapoint]):
+    """
+    Update the sketches of a plant with the datapoints written, within the writing transaction.
+    :param plant_id: Plant ID
+    :param created: Datapoints created
+    :param updated: Datapoints updated, with the values they replaced in `previous_values`
+    """
+    changes = defaultdict(list)
+    for datapoint in created:
+        changes[get_day(datapoint.timestamp)].append((_get_values(datapoint), 1))
+    for datapoint in updated:
+        day = get_day(datapoint.timestamp)
+        changes[day].append((datapoint.previous_values, -1))
+        changes[day].append((_get_values(datapoint), 1))
+    if not changes:
+        return
+
+    existing = {
+        sketch.day: sketch
+        for sketch in DatapointSketch.objects.select_for_update().filter(plant_id=plant_id, day__in=changes)
+    }
+    sketches = {}
+    for day, day_changes in changes.items():
+        stored = existing[day].sketches if day in existing else {}
+        sketches[day] = {field: DDSketch.from_dict(stored.get(field)) for field in FIELDS}
+        for values, count in day_changes:
+            for field in FIELDS:
+                sketches[day][field].add(values[field], count)
+    _save_day_sketches(plant_id, sketches, existing)
+
+
+def rebuild_sketches(plant_id, days: Optional[Iterable[datetime.date]] = None):
+    """
+    Build the sketches of a plant again out of its datapoints, for writes not tracking the values they replace.
+    :param plant_id: Plant ID
+    :param days: Days to build. Defaults to every day of the plant.
+    """
+    sketches_to_delete = DatapointSketch.objects.filter(plant_id=plant_id)
+    datapoints = get_datapoints(plant_id)
+    if days is not None:
+        days = set(days)
+        if not days:
+            return
+        sketches_to_delete = sketches_to_delete.filter(day__in=days)
+        datapoints = datapoints.filter(
+            timestamp__gte=get_day_bounds(min(days))[0],
+            timestamp__lt=get_day_bounds(max(days))[1]
+        )
+    sketches_to_delete.delete()
+
+    sketches = {}
+    rows = datapoints.order_by('timestamp').values_list('timestamp', *FIELDS).iterator()
+    for day, day_rows in groupby(rows, key=lambda row: get_day(row[0])):
+        if days is not None and day not in days:
+            continue
+        sketches[day] = {field: DDSketch() for field in FIELDS}
+        for row in day_rows:
+            for field, value in zip(FIELDS, row[1:]):
+                sketches[day][field].add(value)
+    _save_day_sketches(plant_id, sketches, {})
+
+
+def _split_range(
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime]
+) -> Tuple[Optional[datetime.date], Optional[datetime.date], List[Tuple[datetime.datetime, datetime.datetime]]]:
+    """
+    Split a range of timestamps into the days fully within it and the partial days at its ends.
+    :return: Tuple with the first and last full days (None when unbounded), and the timestamp ranges of partial days
+    """
+    first_day = last_day = None
+    partial_ranges = []
+    if date_from:
+        first_day = get_day(date_from)
+        start, end = get_day_bounds(first_day)
+        if date_from > start:
+            partial_ranges.append((date_from, min(end, date_to) if date_to else end))
+            first_day += datetime.timedelta(days=1)
+    if date_to:
+        last_day = get_day(date_to)
+        start, _ = get_day_bounds(last_day)
+        # Unless both ends fall within the same day, which is covered by the range above
+        if date_to > start and not (partial_ranges and partial_ranges[0][0] >= start):
+            partial_ranges.append((max(start, date_from) if date_from else start, date_to))
+        last_day -= datetime.timedelta(days=1)
+    return first_day, last_day, partial_ranges
+
+
+def get_report_percentiles(
+        plants: List[Plant],
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        percentiles: List[float]
+) -> Dict[int, Dict[str, Dict[str, Optional[float]]]]:
+    """
+    Estimate percentiles of the observed values of the given plants within a range of dates.
+    The sketches of the days fully within the range are merged, and only the datapoints of the partial days at its
+    ends are read.
+    :param plants: Plants
+    :param date_from: Start timestamp (included)
+    :param date_to: End timestamp (excluded)
+    :param percentiles: Percentiles, between 0 and 100
+    :return: Dictionary with the estimate of each percentile (e.g. `p95`) of each field, for each plant ID
+    """
+    plant_ids = [plant.id for plant in plants]
+    sketches = {plant_id: {field: DDSketch() for field in FIELDS} for plant_id in plant_ids}
+    first_day, last_day, partial_ranges = _split_range(date_from, date_to)
+
+    stored = DatapointSketch.objects.filter(plant_id__in=plant_ids)
+    if first_day:
+        stored = stored.filter(day__gte=first_day)
+    if last_day:
+        stored = stored.filter(day__lte=last_day)
+    for plant_id, day_sketches in stored.values_list('plant_id', 'sketches').iterator():
+        for field in FIELDS:
+            sketches[plant_id][field].merge(DDSketch.from_dict(day_sketches.get(field)))
+
+    if partial_ranges:
+        def read_shard(alias: str, shard_plant_ids: List[int]) -> list:
+            ranges = Q()
+            for start, end in partial_ranges:
+                ranges |= Q(timestamp__gte=start, timestamp__lt=end)
+            return list(Datapoint.objects.using(alias).filter(
+                ranges,
+                plant_id__in=shard_plant_ids
+            ).values_list('plant_id', *FIELDS))
+
+        for rows in map_shards(read_shard, plant_ids):
+            for plant_id, *values in rows:
+                for field, value in zip(FIELDS, values):
+                    sketches[plant_id][field].add(value)
+
+    return {
+        plant_id: {
+            field: {f'p{percentile:g}': sketch.get_quantile(percentile / 100) for percentile in percentiles}
+            for field, sketch in plant_sketches.items()
+        }
+        for plant_id, plant_sketches in sketches.items()
+    }
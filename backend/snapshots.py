@@ -0,0 +1,198 @@
+"""
+Immutable snapshots of the datapoints of closed months.
+
+Each snapshot is a columnar file with a header followed by the timestamps (int64 seconds since the Unix epoch)
+and the values of every datapoint field (float64), one column after the other, in native byte order.
+Columns are memory-mapped and read in place when serving them.
+"""
+import datetime
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from backend.models import Plant, Datapoint, DatapointSnapshot
+from backend.sharding import get_datapoints, map_shards
+
+MAGIC = b'PFSNAP01'
+HEADER = struct.Struct('=8sQ')  # Magic, number of rows
+
+FIELDS = ['energy_expected', 'energy_observed', 'irradiation_expected', 'irradiation_observed']
+
+
+def get_month(timestamp: datetime.datetime) -> datetime.date:
+    """
+    Get the first day of the month of a given timestamp.
+    """
+    return timezone.localtime(timestamp).date().replace(day=1)
+
+
+def get_next_month(month: datetime.date) -> datetime.date:
+    """
+    Get the first day of the month following a given one.
+    """
+    return (month.replace(day=1) + datetime.timedelta(days=31)).replace(day=1)
+
+
+def get_month_bounds(month: datetime.date) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    Get the first timestamp of a month and the first one of the next month.
+    """
+    time_zone = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.datetime.combine(month, datetime.time()), time_zone)
+    end = timezone.make_aware(datetime.datetime.combine(get_next_month(month), datetime.time()), time_zone)
+    return start, end
+
+
+def write_snapshot(plant_id, month: datetime.date, version: int) -> Optional[DatapointSnapshot]:
+    """
+    Write the snapshot of the datapoints of a plant for a given month, and register it in the index.
+    :param plant_id: Plant ID
+    :param month: First day of the month
+    :param version: Plant data version the snapshot is taken at
+    :return: Snapshot created, if there were datapoints for that month and they didn't change meanwhile
+    """
+    start, end = get_month_bounds(month)
+    rows = list(get_datapoints(plant_id).filter(
+        timestamp__gte=start,
+        timestamp__lt=end
+    ).order_by('timestamp').values_list('timestamp', *FIELDS))
+    if not rows:
+        return None
+
+    directory = settings.SNAPSHOTS_DIR / str(plant_id)
+    os.makedirs(directory, exist_ok=True)
+    path = directory / f'{month:%Y-%m}.{version}.snapshot'
+    temporary_path = path.with_suffix('.tmp')
+    with open(temporary_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(rows)))
+        array('q', (int(row[0].timestamp()) for row in rows)).tofile(file)
+        for column in range(1, len(FIELDS) + 1):
+            array('d', (row[column] for row in rows)).tofile(file)
+    # Files are never modified once in place
+    os.replace(temporary_path, path)
+
+    # The plant row is locked until the snapshot is registered, as writers bump its data version before dropping the
+    # snapshots of the months they write into. Otherwise a write could commit between the check and the registration
+    with transaction.atomic():
+        if Plant.objects.select_for_update().filter(id=plant_id, datapoints_version=version).exists():
+            return DatapointSnapshot.objects.create(
+                plant_id=plant_id,
+                month=month,
+                path=str(path),
+                count=len(rows)
+            )
+    # Datapoints were written meanwhile, so the snapshot may be stale already
+    delete_snapshot_files([str(path)])
+    return None
+
+
+def read_snapshot(
+        snapshot: DatapointSnapshot,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None
+) -> List[Datapoint]:
+    """
+    Read the datapoints of a snapshot.
+    :param snapshot: Snapshot
+    :param date_from: Start timestamp (included)
+    :param date_to: End timestamp (excluded)
+    :return: List of (unsaved) Datapoint instances, sorted by timestamp
+    """
+    with open(snapshot.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f'Invalid snapshot file: {snapshot.path}')
+        with memoryview(data) as view:
+            offset = HEADER.size
+            timestamps = view[offset:offset + 8 * count].cast('q')
+            columns = [
+                view[offset + 8 * count * column:offset + 8 * count * (column + 1)].cast('d')
+                for column in range(1, len(FIELDS) + 1)
+            ]
+            first = bisect_left(timestamps, date_from.timestamp()) if date_from else 0
+            last = bisect_left(timestamps, date_to.timestamp()) if date_to else count
+            datapoints = [
+                Datapoint(
+                    plant_id=snapshot.plant_id,
+                    timestamp=datetime.datetime.fromtimestamp(timestamps[i], tz=datetime.timezone.utc),
+                    **{field: column[i] for field, column in zip(FIELDS, columns)}
+                )
+                for i in range(first, last)
+            ]
+            # Views must be released before the memory map is closed
+            for column in (timestamps, *columns):
+                column.release()
+    return datapoints
+
+
+def delete_snapshot_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _get_unarchived_ranges(
+        months: List[datetime.date],
+        end: datetime.date
+) -> List[Tuple[Optional[datetime.date], datetime.date]]:
+    """
+    Get the ranges of months before a given one which are out of the archived ones.
+    :param months: Archived months, sorted
+    :param end: First month out of the ranges
+    :return: List of (first month, month after the last one) ranges, with None as first month when unbounded
+    """
+    ranges = []
+    range_from = None
+    for month in months:
+        if range_from != month:
+            ranges.append((range_from, min(month, end)))
+        range_from = get_next_month(month)
+    ranges.append((range_from, end))
+    return [(range_from, range_to) for range_from, range_to in ranges if range_from is None or range_from < range_to]
+
+
+def get_unarchived_months() -> List[dict]:
+    """
+    Get the closed months with datapoints which have no snapshot yet.
+    Only the datapoints of each plant out of its archived months are scanned: before its first snapshot, between its
+    snapshots (months invalidated or without datapoints) and after its last one. So the cost grows with the datapoints
+    not archived yet, rather than with the whole history.
+    :return: List of dictionaries with `plant_id` and `month` keys
+    """
+    current_month = get_month(timezone.now())
+    archived = defaultdict(list)
+    for plant_id, month in DatapointSnapshot.objects.order_by('plant_id', 'month').values_list('plant_id', 'month'):
+        archived[plant_id].append(month)
+    plant_ids = list(Plant.objects.order_by('id').values_list('id', flat=True))
+
+    def read_shard_months(alias: str, shard_plant_ids: List[int]) -> List[dict]:
+        months = []
+        for plant_id in shard_plant_ids:
+            # A query for each range, as each one is searched through the (plant, timestamp) index
+            for range_from, range_to in _get_unarchived_ranges(archived[plant_id], current_month):
+                datapoints = Datapoint.objects.using(alias).filter(
+                    plant_id=plant_id,
+                    timestamp__lt=get_month_bounds(range_to)[0]
+                )
+                if range_from:
+                    datapoints = datapoints.filter(timestamp__gte=get_month_bounds(range_from)[0])
+                months.extend(datapoints.annotate(
+                    month=TruncMonth('timestamp')
+                ).values('plant_id', 'month').distinct().order_by('month'))
+        return months
+
+    return sorted(
+        (item for shard_months in map_shards(read_shard_months, plant_ids) for item in shard_months),
+        key=lambda item: (item['plant_id'], item['month'])
+    )
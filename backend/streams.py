@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import re
+from functools import lru_cache
+from typing import List
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.renderers import JSONRenderer
+
+from backend.models import Plant
+from backend.serializers import DatapointSerializer
+from backend.sharding import get_datapoints
+
+STREAM_PATH = re.compile(r'^/plants/(?P<plant_id>\d+)/stream/$')
+
+
+@lru_cache()
+def get_redis() -> redis.Redis:
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+def get_async_redis() -> redis.asyncio.Redis:
+    return redis.asyncio.Redis.from_url(settings.REDIS_URL)
+
+
+def get_channel(plant_id) -> str:
+    return f'plants:{plant_id}:datapoints'
+
+
+def publish_datapoints_change(plant_id, timestamps: List):
+    """
+    Publish a notification about datapoints written for a given Plant.
+    The notification only carries the range of timestamps changed, subscribers fetch the datapoints themselves.
+    :param plant_id: Plant ID
+    :param timestamps: Timestamps of the datapoints written
+    """
+    message = {
+        'plant_id': plant_id,
+        'from': min(timestamps).isoformat(),
+        'to': max(timestamps).isoformat(),
+        'count': len(timestamps),
+    }
+    try:
+        get_redis().publish(get_channel(plant_id), json.dumps(message))
+    except redis.RedisError as e:
+        logging.error({
+            'message': 'Unable to publish datapoints change',
+            'change': message,
+            'error': str(e)
+        })
+
+
+def _get_changed_datapoints(plant_id, change: dict) -> bytes:
+    """
+    Get the datapoints within the range of a change notification, rendered as JSON.
+    """
+    try:
+        datapoints = get_datapoints(plant_id).filter(
+            timestamp__gte=change['from'],
+            timestamp__lte=change['to']
+        ).order_by('timestamp')
+        return JSONRenderer().render(DatapointSerializer(datapoints, many=True).data)
+    finally:
+        close_old_connections()
+
+
+def _plant_exists(plant_id) -> bool:
+    try:
+        return Plant.objects.filter(id=plant_id).exists()
+    finally:
+        close_old_connections()
+
+
+class DatapointStreamRouter:
+    """
+    ASGI application serving the datapoint streams as Server-Sent Events, and passing any other request on.
+    Streams are served here rather than by a Django view, because this Django version consumes streaming
+    responses synchronously, which would block the event loop for as long as the stream remains open.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        match = STREAM_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None:
+            return await self.application(scope, receive, send)
+        return await self.stream(int(match['plant_id']), receive, send)
+
+    @staticmethod
+    async def _wait_for_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def stream(self, plant_id, receive, send):
+        """
+        Push the datapoints of a given Plant to the client as they are created or updated.
+        :param plant_id: Plant ID
+        :param receive: ASGI receive callable
+        :param send: ASGI send callable
+        """
+        if not await sync_to_async(_plant_exists, thread_sensitive=False)(plant_id):
+            await send({
+                'type': 'http.response.start',
+                'status': 404,
+                'headers': [(b'content-type', b'application/json')],
+            })
+            await send({'type': 'http.response.body', 'body': b'{"detail":"Not found."}'})
+            return
+
+        client = get_async_redis()
+        pubsub = client.pubsub()
+        await pubsub.subscribe(get_channel(plant_id))
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        try:
+            while True:
+                next_message = asyncio.ensure_future(pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=settings.DATAPOINT_STREAM_KEEPALIVE
+                ))
+                await asyncio.wait({disconnected, next_message}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    next_message.cancel()
+                    break
+
+                message = next_message.result()
+                if message is None:
+                    # Nothing new. Keep the connection alive!
+                    event = b': keepalive\n\n'
+                else:
+                    change = json.loads(message['data'])
+                    datapoints = await sync_to_async(_get_changed_datapoints, thread_sensitive=False)(
+                        plant_id, change
+                    )
+                    event = b'event: datapoints\nid: %s\ndata: %s\n\n' % (change['to'].encode(), datapoints)
+                await send({'type': 'http.response.body', 'body': event, 'more_body': True})
+        finally:
+            disconnected.cancel()
+            await pubsub.unsubscribe()
+            await pubsub.close()
+            await client.close()
@@ -1,16 +1,25 @@
 import datetime
 import logging
 from http import HTTPStatus
-from typing import List, Tuple, Optional
+from typing import Iterable, List, Tuple, Optional
 
 import pytz
 import requests
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
+from backend.exports import write_export
+from backend.gaps import find_gaps, get_gap_date_ranges
 from backend.models import Plant, Datapoint
+from backend.profiling import stage
+from backend.pulls import finish_pull, hold_write_lock, register_pull, start_pull
 from backend.serializers import DatapointImportSerializer
-from power_factors.celery import app
+from backend.sharding import get_datapoints, get_shard
+from backend.signals import datapoints_saved
+from backend.sketches import update_sketches
+from backend.snapshots import get_month, get_unarchived_months, write_snapshot
+from power_factors.celery import app, BACKFILL_QUEUE, HIGH_PRIORITY, INCREMENTAL_QUEUE, LOW_PRIORITY
 
 
 @app.task(ignore_result=True)
@@ -18,8 +27,173 @@ def poll_monitoring_data():
     """
     Launch a polling task for each Plant.
     """
-    for plant_id in Plant.objects.all().values_list('id', flat=True):
-        PollPlantMonitoringData.delay(plant_id)
+    schedule_polling(Plant.objects.all().values_list('id', flat=True))
+
+
+@app.task(ignore_result=True)
+def poll_intraday_monitoring_data():
+    """
+    Launch an intraday polling task for each Plant, pulling the datapoints after the last one stored.
+    """
+    schedule_intraday_polling(Plant.objects.all().values_list('id', flat=True))
+
+
+@app.task(ignore_result=True)
+def repair_datapoint_gaps(plant_ids: Optional[List[int]] = None):
+    """
+    Launch a polling task for each range of dates with missing datapoints.
+    :param plant_ids: Plant IDs. Defaults to all plants.
+    """
+    if plant_ids is None:
+        plant_ids = Plant.objects.all().values_list('id', flat=True)
+    for plant_id, date_ranges in get_gap_date_ranges(find_gaps(plant_ids)).items():
+        for date_from, date_to in date_ranges:
+            schedule_backfill(plant_id, date_from, date_to)
+
+
+@app.task(ignore_result=True)
+def archive_closed_months():
+    """
+    Write a snapshot for each closed month with datapoints not archived yet.
+    """
+    versions = dict(Plant.objects.values_list('id', 'datapoints_version'))
+    for item in get_unarchived_months():
+        write_snapshot(
+            plant_id=item['plant_id'],
+            month=get_month(item['month']),
+            version=versions[item['plant_id']]
+        )
+
+
+@app.task(ignore_result=True)
+def export_report(export_id):
+    """
+    Write the file of a report export.
+    :param export_id: Export ID
+    """
+    write_export(export_id)
+
+
+def split_date_range(
+        date_from: datetime.date,
+        date_to: datetime.date,
+        days: int
+) -> List[Tuple[datetime.date, datetime.date]]:
+    """
+    Split a range of dates into consecutive windows.
+    :param date_from: Start date
+    :param date_to: End date
+    :param days: Maximum number of days of each window
+    :return: List of (start date, end date) windows
+    """
+    windows = []
+    cursor = date_from
+    while cursor < date_to:
+        windows.append((cursor, min(date_to, cursor + datetime.timedelta(days=days))))
+        cursor += datetime.timedelta(days=days)
+    return windows
+
+
+def enqueue_pull(
+        plant_id,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        queue: str,
+        priority: int,
+        cursor: bool = False
+):
+    """
+    Register a pull of a range of dates for a given Plant, and enqueue the polling tasks needed to perform it.
+    Nothing is enqueued for parts of the range already requested.
+    :param plant_id: Plant ID
+    :param date_from: Start date
+    :param date_to: End date
+    :param queue: Queue the tasks are sent to
+    :param priority: Priority of the tasks
+    :param cursor: Whether only the datapoints after the last one stored are pulled
+    """
+    new_pulls = register_pull(plant_id, date_from, date_to, cursor, queue, priority)
+    for index, (pull_id, (pull_from, pull_to)) in enumerate(new_pulls):
+        try:
+            PollPlantMonitoringData.apply_async(
+                kwargs={
+                    'plant_id': plant_id,
+                    'date_from': pull_from,
+                    'date_to': pull_to,
+                    'pull_id': pull_id
+                },
+                queue=queue,
+                priority=priority
+            )
+        except Exception:
+            # Pulls without a task would keep their ranges from being requested again until they expire
+            for unsent_pull_id, _ in new_pulls[index:]:
+                finish_pull(plant_id, unsent_pull_id)
+            raise
+
+
+def schedule_backfill(plant_id, date_from: datetime.date, date_to: datetime.date):
+    """
+    Enqueue the polling subtasks needed to pull a range of dates for a given Plant into the backfill queue.
+    :param plant_id: Plant ID
+    :param date_from: Start date
+    :param date_to: End date
+    """
+    for window_from, window_to in split_date_range(date_from, date_to, settings.BACKFILL_WINDOW_DAYS):
+        enqueue_pull(plant_id, window_from, window_to, queue=BACKFILL_QUEUE, priority=LOW_PRIORITY)
+
+
+def schedule_polling(
+        plant_ids: Iterable[int],
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None
+):
+    """
+    Enqueue the polling tasks for the given Plants.
+    Pulling from the next date with no records yet is an incremental update, while pulling a given range of dates is
+    a backfill. Backfills are split into subtasks, enqueued alternating between plants.
+    :param plant_ids: Plant IDs
+    :param date_from: Start date. Defaults to next date with no records yet for each plant.
+    :param date_to: End date. Defaults to today.
+    """
+    plant_ids = list(plant_ids)
+    date_to = date_to or timezone.now().date()
+    if date_from is None:
+        last_timestamps = dict(Plant.objects.filter(id__in=plant_ids).values_list('id', 'last_datapoint_timestamp'))
+        for plant_id in plant_ids:
+            enqueue_pull(
+                plant_id,
+                PollPlantMonitoringData.get_next_unregistered_date(last_timestamps.get(plant_id)),
+                date_to,
+                queue=INCREMENTAL_QUEUE,
+                priority=HIGH_PRIORITY
+            )
+        return
+
+    for window_from, window_to in split_date_range(date_from, date_to, settings.BACKFILL_WINDOW_DAYS):
+        for plant_id in plant_ids:
+            schedule_backfill(plant_id, window_from, window_to)
+
+
+def schedule_intraday_polling(plant_ids: Iterable[int]):
+    """
+    Enqueue the intraday polling tasks for the given Plants.
+    Each one pulls from the date of the last datapoint stored up to the current one, both included, but only writes
+    the datapoints after it, so that partly ingested days are completed and data is refreshed within the day.
+    :param plant_ids: Plant IDs
+    """
+    plant_ids = list(plant_ids)
+    date_to = timezone.now().date() + datetime.timedelta(days=1)
+    last_timestamps = dict(Plant.objects.filter(id__in=plant_ids).values_list('id', 'last_datapoint_timestamp'))
+    for plant_id in plant_ids:
+        enqueue_pull(
+            plant_id,
+            PollPlantMonitoringData.get_cursor_date(last_timestamps.get(plant_id)),
+            date_to,
+            queue=INCREMENTAL_QUEUE,
+            priority=HIGH_PRIORITY,
+            cursor=True
+        )
 
 
 class PollPlantMonitoringData(app.Task):
@@ -29,27 +203,49 @@ class PollPlantMonitoringData(app.Task):
     ignore_result = True
     serializer = 'pickle'
 
-    MONITORING_SERVICE_ADDRESS = 'http://monitoring:5000'
     DEFAULT_POLLING_FROM_DATE = datetime.datetime(
         2022, 1, 1,
         tzinfo=pytz.timezone(settings.TIME_ZONE)
     )
     MAX_POLLING_ATTEMPTS = 3
 
-    def _get_next_unregistered_date(self, plant_id) -> datetime.date:
+    @classmethod
+    def get_next_unregistered_date(cls, last_timestamp: Optional[datetime.datetime]) -> datetime.date:
         """
-        Get the next date for which there are no Datapoints registered for a given Plant.
-        :param plant_id: Plant ID
+        Get the next date for which there are no Datapoints registered, given the timestamp of the last one.
+        :param last_timestamp: Timestamp of the last Datapoint registered, if any
         :return: Next date with unregistered Datapoints
         """
-        last_timestamp = Datapoint.objects.filter(
-            plant_id=plant_id
-        ).order_by(
+        last_timestamp = last_timestamp or cls.DEFAULT_POLLING_FROM_DATE
+        return last_timestamp.date() + datetime.timedelta(days=1)
+
+    @classmethod
+    def get_cursor_date(cls, last_timestamp: Optional[datetime.datetime]) -> datetime.date:
+        """
+        Get the date a cursor pull starts from, given the timestamp of the last Datapoint registered.
+        :param last_timestamp: Timestamp of the last Datapoint registered, if any
+        :return: Date of the last Datapoint registered, which may be only partly ingested
+        """
+        return (last_timestamp or cls.DEFAULT_POLLING_FROM_DATE).date()
+
+    @staticmethod
+    def _get_last_timestamp(plant_id) -> Optional[datetime.datetime]:
+        """
+        Get the timestamp of the last Datapoint registered for a given Plant.
+        :param plant_id: Plant ID
+        :return: Timestamp of the last Datapoint registered, if any
+        """
+        return get_datapoints(plant_id).order_by(
             'timestamp'
         ).values_list('timestamp', flat=True).last()
 
-        last_timestamp = last_timestamp or self.DEFAULT_POLLING_FROM_DATE
-        return last_timestamp.date() + datetime.timedelta(days=1)
+    def _get_next_unregistered_date(self, plant_id) -> datetime.date:
+        """
+        Get the next date for which there are no Datapoints registered for a given Plant.
+        :param plant_id: Plant ID
+        :return: Next date with unregistered Datapoints
+        """
+        return self.get_next_unregistered_date(self._get_last_timestamp(plant_id))
 
     def _request_monitoring_data(
             self,
@@ -69,7 +265,7 @@ class PollPlantMonitoringData(app.Task):
         while attempts < self.MAX_POLLING_ATTEMPTS:
             attempts += 1
             response = requests.get(
-                self.MONITORING_SERVICE_ADDRESS,
+                settings.MONITORING_SERVICE_URL,
                 params={
                     'plant-id': plant_id,
                     'from': date_from,
@@ -103,6 +299,20 @@ class PollPlantMonitoringData(app.Task):
                 })
         return valid_datapoints
 
+    @staticmethod
+    def _filter_after_cursor(data: List[dict], last_timestamp: Optional[datetime.datetime]) -> List[dict]:
+        """
+        Keep the parsed datapoints after the cursor of a plant, discarding those from the future.
+        :param data: List of datapoints
+        :param last_timestamp: Timestamp of the last Datapoint registered, if any
+        :return: Datapoints after the cursor
+        """
+        now = timezone.now()
+        return [
+            item for item in data
+            if (last_timestamp is None or item['timestamp'] > last_timestamp) and item['timestamp'] <= now
+        ]
+
     @staticmethod
     def _split_datapoints(plant_id, data: List[dict]) -> Tuple[List[Datapoint], List[Datapoint]]:
         """
@@ -111,11 +321,11 @@ class PollPlantMonitoringData(app.Task):
         :param data: List of datapoints
         :return: Tuple with two elements:
             - datapoints to create: List of Datapoint instances ready for creation in DB.
-            - datapoints to update: List of Datapoint instances ready for updating in DB.
+            - datapoints to update: List of Datapoint instances ready for updating in DB, with the values they replace
+              in `previous_values`.
         """
         # Get Datapoints from DB that match the parsed list
-        datapoints = Datapoint.objects.filter(
-            plant_id=plant_id,
+        datapoints = get_datapoints(plant_id).filter(
             timestamp__in=map(lambda dp: dp['timestamp'], data)
         )
         datapoints_by_timestamp = {
@@ -129,6 +339,7 @@ class PollPlantMonitoringData(app.Task):
             if dp:
                 # Found an item corresponding to the same plant and timestamp
                 # Update it!
+                dp.previous_values = {key: getattr(dp, key) for key in item}
                 for key, value in item.items():
                     setattr(dp, key, value)
                 datapoints_to_update.append(dp)
@@ -146,36 +357,84 @@ class PollPlantMonitoringData(app.Task):
             self,
             plant_id,
             date_from: Optional[datetime.date] = None,
-            date_to: Optional[datetime.date] = None
+            date_to: Optional[datetime.date] = None,
+            pull_id: Optional[str] = None,
+            cursor: bool = False
     ):
         """
         Given a plant id and a dates range, pull datapoints from the monitoring service.
         :param plant_id: Plant ID
-        :param date_from: Start date. Defaults to next date with no records yet.
-        :param date_to: End date. Defaults to today.
+        :param date_from: Start date. Defaults to next date with no records yet, or to the date of the last record for
+            cursor pulls.
+        :param date_to: End date. Defaults to today, or to tomorrow for cursor pulls.
+        :param pull_id: ID of the registered pull performed. Its cursor flag, which regular requests overlapping it
+            clear, overrides the given one.
+        :param cursor: Only write the datapoints after the last one stored, up to the current time
         """
+        if pull_id is not None:
+            pull = start_pull(plant_id, pull_id)
+            if pull is None:
+                # Expired, or already performed by another task
+                return
+            try:
+                self._pull(plant_id, pull.date_from, pull.date_to, pull.cursor)
+            finally:
+                finish_pull(plant_id, pull_id)
+        else:
+            self._pull(plant_id, date_from, date_to, cursor)
+
+    def _pull(
+            self,
+            plant_id,
+            date_from: Optional[datetime.date] = None,
+            date_to: Optional[datetime.date] = None,
+            cursor: bool = False
+    ):
+        last_timestamp = None
+        if cursor:
+            # The cursor is read when the task runs, as other pulls may have moved it since this one was requested
+            last_timestamp = self._get_last_timestamp(plant_id)
+            cursor_date = self.get_cursor_date(last_timestamp)
+            date_from = max(date_from, cursor_date) if date_from else cursor_date
+            date_to = date_to or timezone.now().date() + datetime.timedelta(days=1)
         date_from = date_from or self._get_next_unregistered_date(plant_id)
         date_to = date_to or timezone.now().date()
 
         # Process data in batches of 1 year
-        cursor = date_from
-        while cursor < date_to:
+        window_from = date_from
+        while window_from < date_to:
             # Get datapoints from monitoring service
-            data = self._request_monitoring_data(
-                plant_id=plant_id,
-                date_from=cursor,
-                date_to=min(date_to, cursor + datetime.timedelta(days=365))
-            )
+            with stage('request'):
+                data = self._request_monitoring_data(
+                    plant_id=plant_id,
+                    date_from=window_from,
+                    date_to=min(date_to, window_from + datetime.timedelta(days=365))
+                )
             # Parse datapoints
-            valid_datapoints = self._parse_datapoints(data)
+            with stage('parse'):
+                valid_datapoints = self._parse_datapoints(data)
+                if cursor:
+                    valid_datapoints = self._filter_after_cursor(valid_datapoints, last_timestamp)
             # Create or update as corresponds
-            datapoints_to_create, datapoints_to_update = self._split_datapoints(plant_id, valid_datapoints)
-            Datapoint.objects.bulk_create(datapoints_to_create)
-            Datapoint.objects.bulk_update(
-                objs=datapoints_to_update,
-                fields=['energy_expected', 'energy_observed', 'irradiation_expected', 'irradiation_observed']
-            )
-            cursor += datetime.timedelta(days=365)
+            if valid_datapoints:
+                # A single task writes the datapoints of a plant at a time.
+                # Datapoints are committed to their shard before the plant data version, kept in the default database
+                shard = get_shard(plant_id)
+                with stage('write'), hold_write_lock(plant_id), \
+                        transaction.atomic(), transaction.atomic(using=shard, savepoint=False):
+                    datapoints_to_create, datapoints_to_update = self._split_datapoints(plant_id, valid_datapoints)
+                    Datapoint.objects.using(shard).bulk_create(datapoints_to_create)
+                    Datapoint.objects.using(shard).bulk_update(
+                        objs=datapoints_to_update,
+                        fields=['energy_expected', 'energy_observed', 'irradiation_expected', 'irradiation_observed']
+                    )
+                    update_sketches(plant_id, datapoints_to_create, datapoints_to_update)
+                    datapoints_saved.send(
+                        sender=Datapoint,
+                        plant_id=plant_id,
+                        timestamps=[dp['timestamp'] for dp in valid_datapoints]
+                    )
+            window_from += datetime.timedelta(days=365)
 
 
 PollPlantMonitoringData = app.register_task(PollPlantMonitoringData())
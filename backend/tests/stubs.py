@@ -0,0 +1,95 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class InMemoryPubSub:
+    """
+    In-memory stand-in for the asyncio Redis pub/sub client.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.queue = asyncio.Queue()
+        self.channels = set()
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self.redis.subscribers[channel].append(self.queue)
+            self.channels.add(channel)
+
+    async def unsubscribe(self, *channels):
+        for channel in channels or list(self.channels):
+            self.redis.subscribers[channel].remove(self.queue)
+            self.channels.discard(channel)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        pass
+
+
+class InMemoryLock:
+    """
+    In-memory stand-in for the Redis lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.renewals = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+    def reacquire(self):
+        self.renewals += 1
+
+
+class InMemoryRedis:
+    """
+    In-memory stand-in for the subset of the Redis client used by the application.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+        self.published = []
+        self.hashes = defaultdict(dict)
+        self.locks = defaultdict(InMemoryLock)
+        self.acquired_locks = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        for queue in self.subscribers[channel]:
+            queue.put_nowait({'type': 'message', 'channel': channel, 'data': message})
+        return len(self.subscribers[channel])
+
+    def hgetall(self, name):
+        return {key.encode(): value.encode() for key, value in self.hashes[name].items()}
+
+    def hset(self, name, key, value):
+        self.hashes[name][key] = value
+
+    def hdel(self, name, *keys):
+        for key in keys:
+            self.hashes[name].pop(key, None)
+
+    def expire(self, name, time):
+        pass
+
+    def lock(self, name, timeout=None, thread_local=True):
+        self.acquired_locks.append(name)
+        return self.locks[name]
+
+    def pubsub(self):
+        return InMemoryPubSub(self)
+
+    async def close(self):
+        pass
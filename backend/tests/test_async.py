@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import time
+from http import HTTPStatus
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+import pytz
+from django.conf import settings
+from django.test import AsyncClient, TransactionTestCase
+
+from backend import views
+from backend.models import Plant, Datapoint
+
+
+class AsyncEndpointsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        Datapoint.objects.bulk_create([
+            Datapoint(
+                plant=self.existent_plant,
+                timestamp=datetime.datetime(2020, 1, 1, hour=hour, tzinfo=time_zone),
+                energy_expected=hour,
+                energy_observed=hour,
+                irradiation_expected=hour,
+                irradiation_observed=hour,
+            )
+            for hour in range(24)
+        ])
+        self.async_client = AsyncClient()
+
+    def test_profiled_async_report(self):
+        """Queries run in the worker threads of async views are recorded in their profile"""
+        response = asyncio.run(self.async_client.get('/async/plants/report/', **{'X-Profile': '1'}))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        timing = response['Server-Timing']
+        self.assertNotIn('desc="0 queries"', timing)
+        for name in ('parse', 'paginate', 'datapoints', 'serialize', 'render'):
+            self.assertIn(f'{name};dur=', timing)
+
+    def test_async_report(self):
+        """The async report produces the same response as the synchronous one"""
+        params = {'from': '2020-01-01T06:00:00', 'to': '2020-01-01T12:00:00'}
+        response = asyncio.run(self.async_client.get(f'/async/plants/report/?{urlencode(params)}'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json(),
+            self.client.get('/plants/report/', params).json()
+        )
+
+    def test_async_report_invalid_plant(self):
+        """The async report fails to generate for invalid plants"""
+        response = asyncio.run(self.async_client.get(
+            f'/async/plants/report/?plant_ids={self.existent_plant.id + 1}'
+        ))
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_async_report_concurrency(self):
+        """Slow reports are served concurrently by a single process"""
+        delay, concurrency = 0.5, 8
+
+        def slow_serialize(*args, **kwargs):
+            time.sleep(delay)
+            return views.serialize_report(*args, **kwargs)
+
+        async def load():
+            return await asyncio.gather(*(
+                self.async_client.get('/async/plants/report/')
+                for _ in range(concurrency)
+            ))
+
+        with patch('backend.async_views.serialize_report', side_effect=slow_serialize):
+            start = time.monotonic()
+            responses = asyncio.run(load())
+            elapsed = time.monotonic() - start
+
+        self.assertTrue(all(response.status_code == HTTPStatus.OK for response in responses))
+        self.assertLess(elapsed, delay * concurrency / 2)
+
+    @patch('backend.async_views.schedule_polling')
+    def test_async_pull_datapoints(self, mock_schedule):
+        """Pulling datapoints through the async endpoint enqueues the polling tasks"""
+        response = asyncio.run(self.async_client.post(
+            '/async/plants/pull_datapoints/',
+            {'plant_ids': [self.existent_plant.id], 'from': '2020-01-01'},
+            content_type='application/json'
+        ))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        mock_schedule.assert_called_once_with(
+            [self.existent_plant.id], datetime.date(2020, 1, 1), None
+        )
@@ -0,0 +1,118 @@
+import datetime
+from http import HTTPStatus
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backend.models import Plant
+from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
+
+
+class ConditionalRequestsTestCase(TestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.poll('2019-01-01T00:00:00')
+
+    @patch('backend.pulls.get_redis', return_value=InMemoryRedis())
+    @patch('backend.tasks.requests.get')
+    def poll(self, timestamp, mock_get, mock_redis):
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": timestamp,
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+        ]
+        PollPlantMonitoringData(
+            plant_id=self.existent_plant.id,
+            date_from=datetime.date(2019, 1, 1),
+            date_to=datetime.date(2019, 1, 2)
+        )
+
+    def test_data_version(self):
+        """Writing datapoints bumps the plant data version"""
+        self.poll('2019-01-01T05:00:00')
+        self.existent_plant.refresh_from_db()
+        self.assertEqual(self.existent_plant.datapoints_version, 2)
+        self.assertEqual(
+            self.existent_plant.last_datapoint_timestamp,
+            datetime.datetime(2019, 1, 1, hour=5, tzinfo=datetime.timezone.utc)
+        )
+        self.assertIsNotNone(self.existent_plant.datapoints_modified)
+
+    def test_report_validators(self):
+        """Reports include the ETag header only"""
+        response = self.client.get('/plants/report/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        # Modification dates can't be validated
+        response = self.client.get('/plants/report/', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_report_plants_modified(self):
+        """Reports are produced again once their plants are renamed, added or deleted"""
+        etag = self.client.get('/plants/report/')['ETag']
+        Plant.objects.filter(id=self.existent_plant.id).update(name='renamed-plant')
+        response = self.client.get('/plants/report/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['results'][0]['name'], 'renamed-plant')
+
+        etag = response['ETag']
+        other_plant = Plant.objects.create(name='other-plant')
+        response = self.client.get('/plants/report/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()['results']), 2)
+
+        etag = response['ETag']
+        other_plant.delete()
+        response = self.client.get('/plants/report/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_report_not_modified(self):
+        """Unchanged reports are not produced again"""
+        etag = self.client.get('/plants/report/')['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/plants/report/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertFalse(any('backend_datapoint' in query['sql'] for query in queries))
+
+    def test_report_modified(self):
+        """Reports are produced again once new datapoints are written"""
+        etag = self.client.get('/plants/report/')['ETag']
+        self.poll('2019-01-01T05:00:00')
+        response = self.client.get('/plants/report/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['results'][0]['datapoints']), 2)
+
+    def test_report_parameters(self):
+        """Reports with different parameters have different ETags"""
+        etag = self.client.get('/plants/report/')['ETag']
+        response = self.client.get('/plants/report/', {'from': '2019-01-01'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_retrieve_not_modified(self):
+        """Unchanged plant details are not produced again"""
+        etag = self.client.get(f'/plants/{self.existent_plant.id}/')['ETag']
+        response = self.client.get(f'/plants/{self.existent_plant.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_retrieve_modified(self):
+        """Plant details are produced again once the plant is updated"""
+        etag = self.client.get(f'/plants/{self.existent_plant.id}/')['ETag']
+        self.client.patch(
+            path=f'/plants/{self.existent_plant.id}/',
+            data={'name': 'updated-plant'},
+            content_type='application/json'
+        )
+        response = self.client.get(f'/plants/{self.existent_plant.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['name'], 'updated-plant')
@@ -0,0 +1,212 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from http import HTTPStatus
+from pathlib import Path
+from unittest.mock import patch
+
+import pytz
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from backend import exports
+from backend.models import Plant, Datapoint, ReportExport
+from backend.tasks import export_report
+
+
+@patch('backend.views.export_report.delay')
+class ExportsTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(EXPORTS_DIR=Path(directory.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.other_plant = Plant.objects.create(
+            name='other-plant'
+        )
+        datapoints = []
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        timestamp = datetime.datetime(2020, 1, 1, tzinfo=time_zone)
+        while timestamp < datetime.datetime(2020, 1, 4, tzinfo=time_zone):
+            for plant in (self.existent_plant, self.other_plant):
+                datapoints.append(Datapoint(
+                    plant=plant,
+                    timestamp=timestamp,
+                    energy_expected=random.random() * 100,
+                    energy_observed=random.random() * 100,
+                    irradiation_expected=random.random() * 100,
+                    irradiation_observed=random.random() * 100,
+                ))
+            timestamp += datetime.timedelta(hours=1)
+        Datapoint.objects.bulk_create(datapoints)
+
+    def request_export(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/exports/', data, content_type='application/json')
+
+    def run_export(self, mock_delay):
+        for call_args in mock_delay.call_args_list:
+            export_report(**call_args.kwargs)
+        mock_delay.reset_mock()
+
+    def download(self, export_id) -> bytes:
+        response = self.client.get(f'/exports/{export_id}/download/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        return gzip.decompress(b''.join(response.streaming_content))
+
+    def test_json_export(self, mock_delay):
+        """JSON exports hold the same results as the report"""
+        response = self.request_export(format='json', **{'from': '2020-01-01T12:00:00', 'to': '2020-01-03'})
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+        self.assertEqual(response.json()['status'], ReportExport.PENDING)
+        self.assertIsNone(response.json()['download'])
+        export_id = response.json()['id']
+        self.run_export(mock_delay)
+
+        response = self.client.get(f'/exports/{export_id}/')
+        self.assertEqual(response.json()['status'], ReportExport.DONE)
+        self.assertEqual(response.json()['progress'], 1)
+        self.assertTrue(response.json()['download'].endswith(f'/exports/{export_id}/download/'))
+
+        report = self.client.get('/plants/report/', {'from': '2020-01-01T12:00:00', 'to': '2020-01-03'}).json()
+        self.assertEqual(json.loads(self.download(export_id)), report['results'])
+
+    def test_csv_export(self, mock_delay):
+        """CSV exports hold a row for each datapoint"""
+        export_id = self.request_export(plant_ids=[self.other_plant.id], to='2020-01-02').json()['id']
+        self.run_export(mock_delay)
+
+        rows = list(csv.reader(io.StringIO(self.download(export_id).decode())))
+        self.assertEqual(rows[0][:3], ['plant_id', 'plant_name', 'timestamp'])
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[1][:3], [str(self.other_plant.id), 'other-plant', '2020-01-01T00:00:00Z'])
+        datapoint = Datapoint.objects.get(plant=self.other_plant, timestamp=datetime.datetime(2020, 1, 1, tzinfo=pytz.utc))
+        self.assertEqual(float(rows[1][3]), datapoint.energy_expected)
+
+    def test_deduplicate(self, mock_delay):
+        """Identical requests share the same export and its file, until the data of its plants changes"""
+        first = self.request_export(plant_ids=[self.existent_plant.id]).json()
+        self.assertEqual(self.request_export(plant_ids=[self.existent_plant.id]).json()['id'], first['id'])
+        self.assertEqual(mock_delay.call_count, 1)
+        self.run_export(mock_delay)
+
+        response = self.request_export(plant_ids=[self.existent_plant.id])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['id'], first['id'])
+        mock_delay.assert_not_called()
+        path = ReportExport.objects.get(id=first['id']).path
+
+        # Data of other plants doesn't affect the export
+        Plant.objects.filter(id=self.other_plant.id).register_datapoints_write(timezone.now())
+        self.assertEqual(self.request_export(plant_ids=[self.existent_plant.id]).json()['id'], first['id'])
+
+        Plant.objects.filter(id=self.existent_plant.id).register_datapoints_write(timezone.now())
+        second = self.request_export(plant_ids=[self.existent_plant.id]).json()
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertEqual(mock_delay.call_count, 1)
+        # The superseded export is deleted along with its file
+        self.assertFalse(ReportExport.objects.filter(id=first['id']).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_renamed_plant(self, mock_delay):
+        """Exports are written again once any of their plants is renamed"""
+        first = self.request_export(plant_ids=[self.existent_plant.id]).json()
+        self.run_export(mock_delay)
+
+        Plant.objects.filter(id=self.existent_plant.id).update(name='renamed-plant')
+        second = self.request_export(plant_ids=[self.existent_plant.id]).json()
+        self.assertNotEqual(second['id'], first['id'])
+        self.run_export(mock_delay)
+        rows = list(csv.reader(io.StringIO(self.download(second['id']).decode())))
+        self.assertEqual({row[1] for row in rows[1:]}, {'renamed-plant'})
+
+    def test_restart_failed_export(self, mock_delay):
+        """Failed exports are restarted when requested again"""
+        export_id = self.request_export().json()['id']
+        with patch('backend.exports.get_report_datapoints', side_effect=ValueError('Broken')):
+            self.run_export(mock_delay)
+        self.assertEqual(self.client.get(f'/exports/{export_id}/').json()['status'], ReportExport.FAILED)
+        self.assertEqual(os.listdir(settings.EXPORTS_DIR), [])
+
+        self.assertEqual(self.request_export().json()['id'], export_id)
+        self.run_export(mock_delay)
+        self.assertEqual(self.client.get(f'/exports/{export_id}/').json()['status'], ReportExport.DONE)
+
+    def test_duplicate_task(self, mock_delay):
+        """Exports are only written by the first task taking them"""
+        export_id = self.request_export().json()['id']
+        export_report(export_id=export_id)
+        with patch('backend.exports.get_report_datapoints') as mock_get_report_datapoints:
+            export_report(export_id=export_id)
+        mock_get_report_datapoints.assert_not_called()
+
+    def test_stale_export(self, mock_delay):
+        """Stale exports are written again, and the attempt superseded meanwhile doesn't finish them"""
+        export_id = self.request_export(plant_ids=[self.existent_plant.id]).json()['id']
+        mock_delay.reset_mock()
+        get_report_datapoints = exports.get_report_datapoints
+        finished = {}
+
+        def restart(*args):
+            # The first attempt is taken as stale while writing, and written by another task
+            mock_get_report_datapoints.side_effect = get_report_datapoints
+            stale = timezone.now() - datetime.timedelta(seconds=settings.EXPORT_STALE_TIMEOUT + 1)
+            ReportExport.objects.filter(id=export_id).update(updated=stale)
+            self.assertEqual(self.request_export(plant_ids=[self.existent_plant.id]).json()['id'], export_id)
+            self.run_export(mock_delay)
+            finished.update(ReportExport.objects.filter(id=export_id).values('attempt', 'updated', 'size').get())
+            return get_report_datapoints(*args)
+
+        with patch('backend.exports.get_report_datapoints', side_effect=restart) as mock_get_report_datapoints:
+            export_report(export_id=export_id)
+
+        export = ReportExport.objects.get(id=export_id)
+        self.assertEqual(export.status, ReportExport.DONE)
+        self.assertEqual(
+            {'attempt': export.attempt, 'updated': export.updated, 'size': export.size},
+            finished
+        )
+        self.assertEqual(os.listdir(settings.EXPORTS_DIR), [os.path.basename(export.path)])
+        self.assertEqual(len(list(csv.reader(io.StringIO(self.download(export_id).decode())))), 73)
+
+    @override_settings(EXPORT_STALE_TIMEOUT=0.04)
+    def test_refresh_export(self, mock_delay):
+        """Exports are refreshed while written, however long a single plant takes"""
+        export_id = self.request_export(plant_ids=[self.existent_plant.id]).json()['id']
+        get_report_datapoints = exports.get_report_datapoints
+
+        def slow(*args):
+            time.sleep(0.1)
+            return get_report_datapoints(*args)
+
+        with patch('backend.exports.get_report_datapoints', side_effect=slow), \
+                patch('backend.exports._touch_export') as mock_touch_export:
+            self.run_export(mock_delay)
+        self.assertGreater(mock_touch_export.call_count, 1)
+        attempt = ReportExport.objects.get(id=export_id).attempt
+        mock_touch_export.assert_called_with(export_id, attempt)
+
+    def test_download_pending_export(self, mock_delay):
+        """Exports can't be downloaded until written"""
+        export_id = self.request_export().json()['id']
+        response = self.client.get(f'/exports/{export_id}/download/')
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+
+    def test_invalid_request(self, mock_delay):
+        """Invalid export requests are rejected"""
+        self.assertEqual(self.request_export(format='xlsx').status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(self.request_export(plant_ids=[0]).status_code, HTTPStatus.BAD_REQUEST)
+        mock_delay.assert_not_called()
@@ -0,0 +1,97 @@
+import datetime
+from http import HTTPStatus
+
+import pytz
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backend.models import Plant, Datapoint
+
+
+class FleetTestCase(TestCase):
+    def setUp(self):
+        # Plant i observes (10 - i) / 10 of the expected energy, and i / 10 of the expected irradiation
+        self.plants = [Plant.objects.create(name=f'plant-{i}') for i in range(5)]
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        Datapoint.objects.bulk_create([
+            Datapoint(
+                plant=plant,
+                timestamp=datetime.datetime(2020, 1, day, hour=hour, tzinfo=time_zone),
+                energy_expected=10 * (i + 1),
+                energy_observed=(10 - i) * (i + 1),
+                irradiation_expected=10,
+                irradiation_observed=i,
+            )
+            for i, plant in enumerate(self.plants)
+            for day in (1, 2)
+            for hour in range(24)
+        ])
+
+    def get_fleet(self, **params):
+        response = self.client.get('/plants/fleet/', params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.json()
+
+    def test_fleet_ratio(self):
+        """Plants are ranked by their observed/expected energy ratio, worst first"""
+        with CaptureQueriesContext(connection) as context:
+            data = self.get_fleet(limit=2)
+        self.assertEqual(
+            data[0],
+            {
+                'id': self.plants[4].id,
+                'name': 'plant-4',
+                'datapoints': 48,
+                'energy_expected': 2400.0,
+                'energy_observed': 1440.0,
+                'energy_ratio': 0.6,
+                'energy_deficit': 960.0,
+                'irradiation_expected': 480.0,
+                'irradiation_observed': 192.0,
+                'irradiation_ratio': 0.4,
+            }
+        )
+        self.assertEqual([item['id'] for item in data], [self.plants[4].id, self.plants[3].id])
+        # Validators, the names of the plants and the grouped aggregate
+        self.assertEqual(len(context), 3)
+
+    def test_fleet_deficit(self):
+        """Plants are ranked by their energy deficit, largest first"""
+        data = self.get_fleet(order='deficit')
+        self.assertEqual([item['id'] for item in data], [plant.id for plant in reversed(self.plants)])
+
+    def test_fleet_irradiation(self):
+        """Plants are ranked by their observed/expected irradiation ratio, worst first"""
+        data = self.get_fleet(order='irradiation', plant_ids=[self.plants[2].id, self.plants[1].id])
+        self.assertEqual([item['id'] for item in data], [self.plants[1].id, self.plants[2].id])
+
+    def test_fleet_range(self):
+        """Only datapoints within the requested range are aggregated"""
+        data = self.get_fleet(**{'from': '2020-01-02', 'to': '2020-01-02T12:00:00'})
+        self.assertEqual({item['datapoints'] for item in data}, {12})
+
+    def test_fleet_deleted_plant(self):
+        """Datapoints left behind by deleted plants are not ranked"""
+        Plant.objects.filter(id=self.plants[4].id).delete()
+        # As left in a shard, out of reach of the cascade
+        Datapoint.objects.bulk_create([
+            Datapoint(
+                plant_id=self.plants[4].id,
+                timestamp=datetime.datetime(2020, 1, 1, hour=hour, tzinfo=datetime.timezone.utc),
+                energy_expected=10,
+                energy_observed=0,
+                irradiation_expected=10,
+                irradiation_observed=0,
+            )
+            for hour in range(24)
+        ])
+        data = self.get_fleet(limit=2)
+        self.assertEqual([item['id'] for item in data], [self.plants[3].id, self.plants[2].id])
+
+    def test_fleet_invalid_parameters(self):
+        """Fleet analytics fail for invalid parameters"""
+        for params in ({'order': 'name'}, {'limit': 0}, {'limit': 'all'}, {'plant_ids': [self.plants[-1].id + 1]}):
+            response = self.client.get('/plants/fleet/', params)
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
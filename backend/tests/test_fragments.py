@@ -0,0 +1,173 @@
+import datetime
+import os
+import random
+import tempfile
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytz
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from backend.fragments import encode_report_datapoints, get_day, get_fragment_path
+from backend.models import Plant, Datapoint
+from backend.serializers import DatapointSerializer
+from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
+
+
+class FragmentsTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(REPORT_FRAGMENTS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for patcher in (
+                patch('backend.streams.get_redis', return_value=InMemoryRedis()),
+                patch('backend.pulls.get_redis', return_value=InMemoryRedis()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.other_plant = Plant.objects.create(
+            name='other-plant'
+        )
+        datapoints = []
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        timestamp = datetime.datetime(2020, 1, 1, tzinfo=time_zone)
+        while timestamp < datetime.datetime(2020, 1, 6, tzinfo=time_zone):
+            for plant in (self.existent_plant, self.other_plant):
+                datapoints.append(Datapoint(
+                    plant=plant,
+                    timestamp=timestamp,
+                    energy_expected=random.random() * 100,
+                    energy_observed=random.random() * 100,
+                    irradiation_expected=random.random() * 100,
+                    irradiation_observed=random.random() * 100,
+                ))
+            timestamp += datetime.timedelta(hours=1)
+        # Datapoints of the current day are never cached
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        datapoints.append(Datapoint(
+            plant=self.existent_plant,
+            timestamp=now,
+            energy_expected=1.5,
+            energy_observed=2.5,
+            irradiation_expected=3.5,
+            irradiation_observed=4.5,
+        ))
+        Datapoint.objects.bulk_create(datapoints)
+        self.today = get_day(now)
+
+    def get_reports(self, **extra):
+        return [
+            self.client.get('/plants/report/', params, **extra).content
+            for params in (
+                {},
+                {'from': '2020-01-02T12:00:00', 'to': '2020-01-04'},
+                {'from': '2020-01-02', 'to': '2020-01-03T05:00:00'},
+                {'plant_ids': [self.other_plant.id], 'to': '2020-01-01T05:00:00'},
+            )
+        ]
+
+    def get_cached_days(self, plant: Plant):
+        return sorted(os.listdir(os.path.join(self.directory, str(plant.id))))
+
+    def test_identical_responses(self):
+        """Reports spliced from cached fragments are identical to the ones serialized from scratch"""
+        with override_settings(REPORT_FRAGMENTS_DIR=None):
+            expected = self.get_reports()
+        self.assertEqual(self.get_reports(), expected)
+        # Served from the fragments written by the previous reports
+        self.assertEqual(self.get_reports(), expected)
+
+    def test_identical_indented_responses(self):
+        """Indented reports are identical to the ones serialized from scratch"""
+        accept = {'HTTP_ACCEPT': 'application/json; indent=2'}
+        with override_settings(REPORT_FRAGMENTS_DIR=None):
+            expected = self.get_reports(**accept)
+        self.get_reports()
+        self.assertEqual(self.get_reports(**accept), expected)
+
+    def test_serialized_report(self):
+        """Spliced reports match the datapoints serialized along with the rest of the report"""
+        self.get_reports()
+        response = self.client.get('/plants/report/', {'plant_ids': [self.other_plant.id]})
+        datapoints = Datapoint.objects.filter(plant=self.other_plant).order_by('timestamp')
+        self.assertEqual(response.content, JSONRenderer().render({
+            'count': 1,
+            'next': None,
+            'previous': None,
+            'results': [{
+                'id': self.other_plant.id,
+                'name': self.other_plant.name,
+                'datapoints': DatapointSerializer(datapoints, many=True).data
+            }]
+        }))
+
+    def test_cached_days(self):
+        """Only closed days fully within the report range are cached"""
+        self.client.get('/plants/report/', {'from': '2020-01-02T12:00:00', 'to': '2020-01-05'})
+        self.assertEqual(self.get_cached_days(self.existent_plant), ['2020-01-03.json', '2020-01-04.json'])
+
+        self.client.get('/plants/report/')
+        self.assertEqual(
+            self.get_cached_days(self.existent_plant),
+            [f'2020-01-0{day}.json' for day in range(1, 6)]
+        )
+        self.assertFalse(get_fragment_path(self.existent_plant.id, self.today).exists())
+
+    @patch('backend.tasks.requests.get')
+    def test_invalidation(self, mock_get):
+        """Fragments are deleted when datapoints are written into their day"""
+        self.client.get('/plants/report/')
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": "2020-01-03T05:00:00",
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            PollPlantMonitoringData(
+                plant_id=self.existent_plant.id,
+                date_from=datetime.date(2020, 1, 3),
+                date_to=datetime.date(2020, 1, 4)
+            )
+        self.assertNotIn('2020-01-03.json', self.get_cached_days(self.existent_plant))
+        self.assertIn('2020-01-02.json', self.get_cached_days(self.existent_plant))
+
+        response = self.client.get('/plants/report/', {
+            'plant_ids': [self.existent_plant.id],
+            'from': '2020-01-03T05:00:00',
+            'to': '2020-01-03T06:00:00'
+        })
+        self.assertEqual(response.json()['results'][0]['datapoints'][0]['energy_observed'], 3.0)
+        with override_settings(REPORT_FRAGMENTS_DIR=None):
+            expected = self.get_reports()
+        self.assertEqual(self.get_reports(), expected)
+
+    def test_stale_fragments(self):
+        """Fragments are discarded when the datapoints changed while being serialized"""
+        plant = Plant.objects.get(id=self.existent_plant.id)
+        datapoints = {plant.id: list(Datapoint.objects.filter(plant=plant).order_by('timestamp'))}
+        Plant.objects.filter(id=plant.id).register_datapoints_write(timezone.now())
+        encoded = encode_report_datapoints([plant], datapoints, None, None)
+        self.assertTrue(encoded[plant.id].content.startswith(b'[{'))
+        self.assertEqual(self.get_cached_days(plant), [])
+
+    def test_delete_plant(self):
+        """Fragments of deleted plants are removed"""
+        self.client.get('/plants/report/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/plants/{self.other_plant.id}/')
+        self.assertFalse(os.path.exists(os.path.join(self.directory, str(self.other_plant.id))))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, str(self.existent_plant.id))))
@@ -0,0 +1,149 @@
+import datetime
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytz
+from django.conf import settings
+from django.test import TestCase
+
+from backend.gaps import find_gaps, get_gap_date_ranges
+from backend.models import Plant, Datapoint
+from backend.tasks import repair_datapoint_gaps
+from backend.tests.stubs import InMemoryRedis
+
+
+class GapsTestCase(TestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.complete_plant = Plant.objects.create(
+            name='complete-plant'
+        )
+
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        self.missing = {
+            # A few hours in the middle of a day
+            *(datetime.datetime(2020, 1, 2, hour=hour, tzinfo=time_zone) for hour in range(5, 8)),
+            # Two whole days
+            *(datetime.datetime(2020, 1, day, hour=hour, tzinfo=time_zone) for day in (5, 6) for hour in range(24)),
+            # A single hour in the next day
+            datetime.datetime(2020, 1, 7, hour=3, tzinfo=time_zone),
+        }
+        datapoints = []
+        timestamp = datetime.datetime(2020, 1, 1, tzinfo=time_zone)
+        while timestamp < datetime.datetime(2020, 1, 10, tzinfo=time_zone):
+            for plant in (self.existent_plant, self.complete_plant):
+                if plant == self.existent_plant and timestamp in self.missing:
+                    continue
+                datapoints.append(Datapoint(
+                    plant=plant,
+                    timestamp=timestamp,
+                    energy_expected=0,
+                    energy_observed=0,
+                    irradiation_expected=0,
+                    irradiation_observed=0,
+                ))
+            timestamp += datetime.timedelta(hours=1)
+        Datapoint.objects.bulk_create(datapoints)
+
+    def test_find_gaps(self):
+        """Holes in the datapoints history are found"""
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        gaps = find_gaps([self.existent_plant.id, self.complete_plant.id])
+        self.assertEqual(
+            [(gap.plant_id, gap.start, gap.end, gap.missing) for gap in gaps],
+            [
+                (
+                    self.existent_plant.id,
+                    datetime.datetime(2020, 1, 2, hour=5, tzinfo=time_zone),
+                    datetime.datetime(2020, 1, 2, hour=7, tzinfo=time_zone),
+                    3
+                ),
+                (
+                    self.existent_plant.id,
+                    datetime.datetime(2020, 1, 5, tzinfo=time_zone),
+                    datetime.datetime(2020, 1, 6, hour=23, tzinfo=time_zone),
+                    48
+                ),
+                (
+                    self.existent_plant.id,
+                    datetime.datetime(2020, 1, 7, hour=3, tzinfo=time_zone),
+                    datetime.datetime(2020, 1, 7, hour=3, tzinfo=time_zone),
+                    1
+                ),
+            ]
+        )
+
+    def test_gap_date_ranges(self):
+        """Adjacent gaps are merged into the minimal date ranges covering them"""
+        ranges = get_gap_date_ranges(find_gaps([self.existent_plant.id]))
+        self.assertEqual(
+            ranges,
+            {
+                self.existent_plant.id: [
+                    (datetime.date(2020, 1, 2), datetime.date(2020, 1, 3)),
+                    (datetime.date(2020, 1, 5), datetime.date(2020, 1, 8)),
+                ]
+            }
+        )
+
+    def test_gaps_statistics(self):
+        """Gap statistics are reported for every plant"""
+        response = self.client.get('/plants/gaps/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        data = response.json()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['id'], self.existent_plant.id)
+        self.assertEqual(data[0]['gaps'], 3)
+        self.assertEqual(data[0]['missing_datapoints'], len(self.missing))
+        self.assertEqual(
+            data[0]['ranges'][0],
+            {
+                'from': '2020-01-02T05:00:00Z',
+                'to': '2020-01-02T07:00:00Z',
+                'missing_datapoints': 3
+            }
+        )
+        self.assertEqual(
+            data[1],
+            {
+                'id': self.complete_plant.id,
+                'gaps': 0,
+                'missing_datapoints': 0,
+                'ranges': []
+            }
+        )
+
+    def test_invalid_plant_gaps(self):
+        """Gap statistics fail to generate for invalid plants"""
+        response = self.client.get(
+            '/plants/gaps/',
+            data={
+                'plant_ids': [self.complete_plant.id + 1]
+            }
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    @patch('backend.pulls.get_redis', return_value=InMemoryRedis())
+    @patch('backend.tasks.PollPlantMonitoringData.apply_async')
+    def test_repair_gaps_task(self, mock_apply_async, mock_redis):
+        """Only the date ranges covering the gaps are requested to the monitoring service"""
+        repair_datapoint_gaps()
+        self.assertEqual(
+            [call_args.kwargs['kwargs'] for call_args in mock_apply_async.call_args_list],
+            [
+                {
+                    'plant_id': self.existent_plant.id,
+                    'date_from': datetime.date(2020, 1, 2),
+                    'date_to': datetime.date(2020, 1, 3),
+                    'pull_id': mock_apply_async.call_args_list[0].kwargs['kwargs']['pull_id']
+                },
+                {
+                    'plant_id': self.existent_plant.id,
+                    'date_from': datetime.date(2020, 1, 5),
+                    'date_to': datetime.date(2020, 1, 8),
+                    'pull_id': mock_apply_async.call_args_list[1].kwargs['kwargs']['pull_id']
+                },
+            ]
+        )
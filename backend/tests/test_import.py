@@ -0,0 +1,130 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytz
+from django.conf import settings
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from backend.models import Plant, Datapoint
+from backend.tests.stubs import InMemoryRedis
+
+
+class ImportDatapointsTestCase(TestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.redis = InMemoryRedis()
+        patcher = patch('backend.pulls.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def import_datapoints(self, *args, **kwargs):
+        out = io.StringIO()
+        call_command('import_datapoints', self.existent_plant.id, *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_import_ndjson(self):
+        """Datapoints are imported from NDJSON files"""
+        path = self.write_file('datapoints.ndjson', '\n'.join(
+            json.dumps({
+                "datetime": f"2019-01-01T{hour:02}:00:00",
+                "expected": {"energy": hour, "irradiation": 1.0},
+                "observed": {"energy": 2.0, "irradiation": 3.0}
+            })
+            for hour in range(24)
+        ))
+        output = self.import_datapoints(path, batch_size=10)
+        self.assertIn('Imported 24 datapoints', output)
+        # Each batch is written holding the plant's write lock
+        self.assertEqual(
+            self.redis.acquired_locks,
+            [f'plants:{self.existent_plant.id}:write'] * 3
+        )
+        self.assertEqual(Datapoint.objects.filter(plant=self.existent_plant).count(), 24)
+
+        datapoint = Datapoint.objects.get(
+            timestamp=datetime.datetime(2019, 1, 1, hour=5, tzinfo=pytz.timezone(settings.TIME_ZONE))
+        )
+        self.assertEqual(datapoint.energy_expected, 5.0)
+        self.assertEqual(datapoint.irradiation_observed, 3.0)
+
+    def test_import_csv(self):
+        """Datapoints are imported from CSV files"""
+        path = self.write_file(
+            'datapoints.csv',
+            'datetime,expected.energy,expected.irradiation,observed.energy,observed.irradiation\n'
+            '2019-01-01T00:00:00,1.5,2.5,3.5,4.5\n'
+            '2019-01-01T01:00:00,1.5,2.5,3.5,4.5\n'
+        )
+        self.import_datapoints(path)
+        self.assertEqual(
+            list(Datapoint.objects.order_by('timestamp').values_list(
+                'energy_expected', 'irradiation_expected', 'energy_observed', 'irradiation_observed'
+            )),
+            [(1.5, 2.5, 3.5, 4.5)] * 2
+        )
+
+    def test_import_upsert(self):
+        """Existing datapoints are updated"""
+        timestamp = datetime.datetime(2019, 1, 1, hour=1, tzinfo=pytz.timezone(settings.TIME_ZONE))
+        Datapoint.objects.create(
+            plant=self.existent_plant,
+            timestamp=timestamp,
+            energy_expected=0,
+            energy_observed=0,
+            irradiation_expected=0,
+            irradiation_observed=0
+        )
+        path = self.write_file(
+            'datapoints.csv',
+            'datetime,expected.energy,expected.irradiation,observed.energy,observed.irradiation\n'
+            '2019-01-01T01:00:00,1,2,3,4\n'
+            '2019-01-01T02:00:00,1,2,3,4\n'
+        )
+        self.import_datapoints(path)
+        self.assertEqual(Datapoint.objects.count(), 2)
+        self.assertEqual(Datapoint.objects.get(timestamp=timestamp).energy_observed, 3.0)
+
+        self.existent_plant.refresh_from_db()
+        self.assertEqual(self.existent_plant.datapoints_version, 1)
+        self.assertEqual(
+            self.existent_plant.last_datapoint_timestamp,
+            datetime.datetime(2019, 1, 1, hour=2, tzinfo=pytz.timezone(settings.TIME_ZONE))
+        )
+
+    def test_import_corrupt_data(self):
+        """Only valid datapoints are imported"""
+        path = self.write_file('datapoints.jsonl', '\n'.join([
+            '{"datetime": "2019-01-01T00:00:00", "expected": {"energy": 1, "irradiation": 2}}',
+            'not json',
+            '{"datetime": "2019-01-01T01:00:00", "expected": {"energy": 1, "irradiation": 2}, '
+            '"observed": {"energy": 3, "irradiation": 4}}',
+        ]))
+        self.import_datapoints(path)
+        self.assertEqual(Datapoint.objects.count(), 1)
+
+    def test_import_invalid_plant(self):
+        """Importing datapoints for an invalid plant fails"""
+        path = self.write_file('datapoints.csv', '')
+        with self.assertRaises(CommandError):
+            call_command('import_datapoints', self.existent_plant.id + 1, path, stdout=io.StringIO())
+
+    def test_import_unknown_format(self):
+        """Importing datapoints from files of unknown format fails"""
+        path = self.write_file('datapoints.txt', '')
+        with self.assertRaises(CommandError):
+            self.import_datapoints(path)
@@ -0,0 +1,87 @@
+import datetime
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from backend.models import Plant, Datapoint
+from backend.profiling import Profile, finish_task_profile, stage, start_task_profile
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        Datapoint.objects.create(
+            plant=self.existent_plant,
+            timestamp=datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc),
+            energy_expected=1,
+            energy_observed=2,
+            irradiation_expected=3,
+            irradiation_observed=4
+        )
+
+    def get_server_timing(self, response) -> dict:
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_unprofiled_request(self):
+        """Requests are not profiled unless requested"""
+        response = self.client.get('/plants/report/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_profiled_request(self):
+        """Profiled requests return their timings in the Server-Timing header"""
+        response = self.client.get('/plants/report/', HTTP_X_PROFILE='1')
+        metrics = self.get_server_timing(response)
+        self.assertEqual(
+            set(metrics),
+            {'db', 'validators', 'parse', 'paginate', 'datapoints', 'serialize', 'render', 'total'}
+        )
+        self.assertGreater(int(metrics['db']['desc'].strip('"').split()[0]), 0)
+        self.assertGreater(float(metrics['total']['dur']), 0)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_request(self):
+        """Sampled requests are profiled"""
+        response = self.client.get('/plants/')
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(PROFILING_SLOW_THRESHOLD=0)
+    def test_slow_log(self):
+        """Profiled requests slower than the threshold are written to the slow log along with their cProfile dump"""
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILING_CPROFILE_DIR=directory):
+            with self.assertLogs('backend.profiling', 'WARNING') as logs:
+                self.client.get('/plants/report/', HTTP_X_PROFILE='1')
+            self.assertEqual(len(logs.records), 1)
+            self.assertIn('"path": "/plants/report/"', logs.output[0])
+            self.assertIn('"serialize"', logs.output[0])
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_stages(self):
+        """Stages entered several times add up, and are ignored with no active profile"""
+        with stage('ignored'):
+            pass
+        with Profile('test') as profile:
+            for _ in range(2):
+                with stage('stage'):
+                    Plant.objects.count()
+        self.assertEqual(list(profile.stages), ['stage'])
+        self.assertEqual(profile.query_count, 2)
+
+    @override_settings(PROFILING_TASK_SAMPLE_RATE=1, PROFILING_SLOW_TASK_THRESHOLD=0)
+    def test_task_profile(self):
+        """Sampled tasks are profiled and written to the slow log"""
+        start_task_profile('task-id', 'backend.tasks.PollPlantMonitoringData')
+        with stage('request'):
+            Plant.objects.count()
+        with self.assertLogs('backend.profiling', 'WARNING') as logs:
+            finish_task_profile('task-id', state='SUCCESS')
+        self.assertIn('"name": "backend.tasks.PollPlantMonitoringData"', logs.output[0])
+        self.assertIn('"queries": 1', logs.output[0])
+        self.assertIn('"request"', logs.output[0])
+
@@ -5,9 +5,11 @@ from unittest.mock import patch
 import pytz
 from django.conf import settings
 from django.test import TestCase
+from django.utils import timezone
 
 from backend.models import Plant, Datapoint
 from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
 
 
 class PollMonitoringTestCase(TestCase):
@@ -15,6 +17,9 @@ class PollMonitoringTestCase(TestCase):
         self.existent_plant = Plant.objects.create(
             name='existent-plant'
         )
+        patcher = patch('backend.pulls.get_redis', return_value=InMemoryRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @patch('backend.tasks.requests.get')
     def test_poll_task(self, mock_get):
@@ -176,3 +181,68 @@ class PollMonitoringTestCase(TestCase):
         mock_get.return_value.json.return_value = []
         PollPlantMonitoringData(plant_id=self.existent_plant.id)
         self.assertEqual(Datapoint.objects.count(), 0)
+
+    @patch('backend.tasks.requests.get')
+    def test_cursor_poll(self, mock_get):
+        """Cursor polls pull the date of the last datapoint and only write the datapoints after it, up to now"""
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        for hour in range(6):
+            Datapoint.objects.create(
+                plant=self.existent_plant,
+                timestamp=datetime.datetime(2020, 1, 1, hour, tzinfo=time_zone),
+                energy_expected=0,
+                energy_observed=0,
+                irradiation_expected=0,
+                irradiation_observed=0,
+            )
+        future = timezone.now() + datetime.timedelta(hours=2)
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": timestamp,
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+            for timestamp in [f"2020-01-01T0{hour}:00:00" for hour in range(9)] + [future.isoformat()]
+        ]
+        PollPlantMonitoringData(plant_id=self.existent_plant.id, date_to=datetime.date(2020, 1, 2), cursor=True)
+
+        self.assertEqual(mock_get.call_args.kwargs['params']['from'], datetime.date(2020, 1, 1))
+        self.assertEqual(
+            list(Datapoint.objects.filter(energy_observed=3.0).values_list('timestamp', flat=True)),
+            [datetime.datetime(2020, 1, 1, hour, tzinfo=time_zone) for hour in range(6, 9)]
+        )
+        # Stored datapoints are left as they were
+        self.assertEqual(Datapoint.objects.filter(energy_observed=0).count(), 6)
+        self.assertEqual(Datapoint.objects.count(), 9)
+
+    @patch('backend.tasks.requests.get')
+    def test_non_cursor_poll_unfiltered(self, mock_get):
+        """Non-cursor polls write every datapoint received, whatever the datapoints stored and their timestamps"""
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        Datapoint.objects.create(
+            plant=self.existent_plant,
+            timestamp=datetime.datetime(2020, 1, 1, 5, tzinfo=time_zone),
+            energy_expected=0,
+            energy_observed=0,
+            irradiation_expected=0,
+            irradiation_observed=0,
+        )
+        future = (timezone.now() + datetime.timedelta(hours=2)).replace(microsecond=0)
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": timestamp,
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+            for timestamp in [f"2020-01-01T0{hour}:00:00" for hour in range(9)] + [future.isoformat()]
+        ]
+        PollPlantMonitoringData(
+            plant_id=self.existent_plant.id,
+            date_from=datetime.date(2020, 1, 1),
+            date_to=datetime.date(2020, 1, 2)
+        )
+
+        self.assertEqual(Datapoint.objects.filter(energy_observed=3.0).count(), 10)
+        self.assertTrue(Datapoint.objects.filter(timestamp=future).exists())
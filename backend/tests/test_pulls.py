@@ -0,0 +1,239 @@
+import datetime
+import time
+from http import HTTPStatus
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from backend.models import Plant
+from backend.pulls import Pull, finish_pull, get_registry_key, hold_write_lock, register_pull, start_pull, \
+    subtract_date_ranges
+from backend.tasks import PollPlantMonitoringData, schedule_polling
+from backend.tests.stubs import InMemoryRedis
+from power_factors.celery import BACKFILL_QUEUE, HIGH_PRIORITY, INCREMENTAL_QUEUE, LOW_PRIORITY
+
+
+class PullsTestCase(TestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.redis = InMemoryRedis()
+        patcher = patch('backend.pulls.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_registered_ranges(self):
+        return sorted(
+            value for value in self.redis.hashes[get_registry_key(self.existent_plant.id)].values()
+        )
+
+    def test_subtract_date_ranges(self):
+        """Parts of a range not covered by others are found"""
+        self.assertEqual(
+            subtract_date_ranges(
+                datetime.date(2020, 1, 1),
+                datetime.date(2020, 1, 31),
+                [
+                    (datetime.date(2020, 1, 10), datetime.date(2020, 1, 15)),
+                    (datetime.date(2019, 12, 1), datetime.date(2020, 1, 5)),
+                    (datetime.date(2020, 1, 12), datetime.date(2020, 1, 20)),
+                ]
+            ),
+            [
+                (datetime.date(2020, 1, 5), datetime.date(2020, 1, 10)),
+                (datetime.date(2020, 1, 20), datetime.date(2020, 1, 31)),
+            ]
+        )
+
+    def get_registered_pulls(self):
+        return sorted(
+            Pull.loads(value)
+            for value in self.redis.hashes[get_registry_key(self.existent_plant.id)].values()
+        )
+
+    def test_skip_pending_pulls(self):
+        """Requests overlapping a pending pull of the same queue and priority only register the rest of their range"""
+        new_pulls = register_pull(self.existent_plant.id, datetime.date(2020, 1, 1), datetime.date(2020, 1, 10))
+        self.assertEqual(len(new_pulls), 1)
+        pull_id = new_pulls[0][0]
+
+        [(_, date_range)] = register_pull(
+            self.existent_plant.id,
+            datetime.date(2020, 1, 5),
+            datetime.date(2020, 1, 20)
+        )
+        self.assertEqual(date_range, (datetime.date(2020, 1, 10), datetime.date(2020, 1, 20)))
+        # Pending pulls are never widened
+        pull = start_pull(self.existent_plant.id, pull_id)
+        self.assertEqual(
+            (pull.date_from, pull.date_to, pull.running),
+            (datetime.date(2020, 1, 1), datetime.date(2020, 1, 10), True)
+        )
+        # A pull is only started once
+        self.assertIsNone(start_pull(self.existent_plant.id, pull_id))
+
+    def test_pulls_by_queue(self):
+        """Pending pulls only cover requests sent to the same queue with the same priority"""
+        windows = []
+        # A backfill of 2020 in 30-day windows, followed by the same backfill shifted by one day
+        for shift in (0, 1):
+            for month in range(13):
+                date_from = datetime.date(2020, 1, 1) + datetime.timedelta(days=30 * month + shift)
+                windows += register_pull(
+                    self.existent_plant.id, date_from, date_from + datetime.timedelta(days=30),
+                    queue=BACKFILL_QUEUE, priority=LOW_PRIORITY
+                )
+        # Only the day after the first backfill is new
+        self.assertEqual(len(windows), 14)
+        self.assertEqual(windows[-1][1], (datetime.date(2021, 1, 25), datetime.date(2021, 1, 26)))
+        self.assertTrue(all(
+            pull.date_to - pull.date_from <= datetime.timedelta(days=30) for pull in self.get_registered_pulls()
+        ))
+
+        [(_, date_range)] = register_pull(
+            self.existent_plant.id, datetime.date(2020, 6, 1), datetime.date(2020, 6, 2),
+            queue=INCREMENTAL_QUEUE, priority=HIGH_PRIORITY
+        )
+        self.assertEqual(date_range, (datetime.date(2020, 6, 1), datetime.date(2020, 6, 2)))
+
+    def test_expired_pulls(self):
+        """Expired pulls no longer cover new requests, nor are performed"""
+        [(pull_id, _)] = register_pull(self.existent_plant.id, datetime.date(2020, 1, 1), datetime.date(2020, 1, 10))
+        with patch('backend.pulls.time.time', return_value=time.time() + settings.PULL_REGISTRY_TIMEOUT + 1):
+            self.assertEqual(
+                len(register_pull(self.existent_plant.id, datetime.date(2020, 1, 1), datetime.date(2020, 1, 10))),
+                1
+            )
+            self.assertIsNone(start_pull(self.existent_plant.id, pull_id))
+        self.assertNotIn(pull_id, self.redis.hashes[get_registry_key(self.existent_plant.id)])
+
+    @patch('backend.tasks.PollPlantMonitoringData.apply_async', side_effect=ConnectionError)
+    def test_failed_enqueue(self, mock_apply_async):
+        """Pulls whose task couldn't be enqueued are removed from the registry"""
+        with self.assertRaises(ConnectionError):
+            schedule_polling(
+                [self.existent_plant.id],
+                date_from=datetime.date(2020, 1, 1),
+                date_to=datetime.date(2020, 1, 10)
+            )
+        self.assertEqual(self.get_registered_ranges(), [])
+
+    def test_skip_running_pulls(self):
+        """Ranges already being pulled are not requested again"""
+        [(pull_id, _)] = register_pull(self.existent_plant.id, datetime.date(2020, 1, 1), datetime.date(2020, 1, 10))
+        start_pull(self.existent_plant.id, pull_id)
+
+        self.assertEqual(
+            register_pull(self.existent_plant.id, datetime.date(2020, 1, 2), datetime.date(2020, 1, 5)),
+            []
+        )
+        [(_, date_range)] = register_pull(
+            self.existent_plant.id,
+            datetime.date(2020, 1, 5),
+            datetime.date(2020, 1, 15)
+        )
+        self.assertEqual(date_range, (datetime.date(2020, 1, 10), datetime.date(2020, 1, 15)))
+
+        # Once finished, the range can be requested again
+        finish_pull(self.existent_plant.id, pull_id)
+        self.assertEqual(
+            len(register_pull(self.existent_plant.id, datetime.date(2020, 1, 2), datetime.date(2020, 1, 5))),
+            1
+        )
+
+    def test_cursor_pulls(self):
+        """Pending cursor pulls stop being so once a regular request overlaps them"""
+        [(pull_id, _)] = register_pull(
+            self.existent_plant.id,
+            datetime.date(2020, 1, 1),
+            datetime.date(2020, 1, 3),
+            cursor=True
+        )
+        register_pull(self.existent_plant.id, datetime.date(2020, 1, 2), datetime.date(2020, 1, 4), cursor=True)
+        self.assertTrue(
+            Pull.loads(self.redis.hashes[get_registry_key(self.existent_plant.id)][pull_id]).cursor
+        )
+
+        register_pull(self.existent_plant.id, datetime.date(2020, 1, 2), datetime.date(2020, 1, 5))
+        self.assertFalse(start_pull(self.existent_plant.id, pull_id).cursor)
+
+    @override_settings(DATAPOINTS_WRITE_LOCK_TIMEOUT=0.03)
+    def test_renew_write_lock(self):
+        """The write lock is renewed while held, however long the write takes"""
+        with hold_write_lock(self.existent_plant.id):
+            time.sleep(0.1)
+        lock = self.redis.locks[f'plants:{self.existent_plant.id}:write']
+        self.assertGreater(lock.renewals, 0)
+        renewals = lock.renewals
+        time.sleep(0.05)
+        # Renewals stop once released
+        self.assertEqual(lock.renewals, renewals)
+
+    def test_load_pull(self):
+        """Pulls are loaded as they were saved"""
+        pull = Pull(datetime.date(2020, 1, 1), datetime.date(2020, 1, 5), 1.5, True, True, INCREMENTAL_QUEUE, 9)
+        self.assertEqual(Pull.loads(pull.dumps()), pull)
+
+    def test_malformed_pulls(self):
+        """Malformed entries are rejected, and dropped from the registry"""
+        for value in (
+                'invalid',
+                '["2020-01-01", "2020-01-05", true]',
+                '["2020-01-01", "2020-01-05", 1.5, false, false, null, null, null]',
+                '["2020-01-01", null, 1.5, false, false, null, null]',
+                '["2020-01-01", "2020-01-05", null, false, false, null, null]',
+                '["2020-01-01", "2020-01-05", 1.5, "false", false, null, null]',
+                '["2020-01-01", "2020-01-05", 1.5, false, false, 1, null]',
+                '{"date_from": "2020-01-01"}',
+        ):
+            with self.assertRaises(ValueError):
+                Pull.loads(value)
+
+        self.redis.hset(get_registry_key(self.existent_plant.id), 'invalid', '["2020-01-01", "2020-01-05", true]')
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(
+                len(register_pull(self.existent_plant.id, datetime.date(2020, 1, 1), datetime.date(2020, 1, 5))),
+                1
+            )
+        self.assertNotIn('invalid', self.redis.hashes[get_registry_key(self.existent_plant.id)])
+
+    @patch('backend.tasks.PollPlantMonitoringData.apply_async')
+    def test_duplicate_polling(self, mock_apply_async):
+        """Requesting the same pull twice enqueues a single task"""
+        for _ in range(2):
+            schedule_polling(
+                [self.existent_plant.id],
+                date_from=datetime.date(2020, 1, 1),
+                date_to=datetime.date(2020, 1, 10)
+            )
+        self.assertEqual(mock_apply_async.call_count, 1)
+
+    @patch('backend.tasks.requests.get')
+    def test_pull_task(self, mock_get):
+        """Pull tasks pull their registered range holding the lock, once"""
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": "2020-01-01T00:00:00",
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+        ]
+        [(first_id, _)] = register_pull(self.existent_plant.id, datetime.date(2020, 1, 1), datetime.date(2020, 1, 5))
+        [(second_id, _)] = register_pull(self.existent_plant.id, datetime.date(2020, 1, 3), datetime.date(2020, 1, 9))
+
+        PollPlantMonitoringData(plant_id=self.existent_plant.id, pull_id=first_id)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(mock_get.call_args.kwargs['params']['from'], datetime.date(2020, 1, 1))
+        self.assertEqual(mock_get.call_args.kwargs['params']['to'], datetime.date(2020, 1, 5))
+        self.assertEqual(self.redis.acquired_locks[-1], f'plants:{self.existent_plant.id}:write')
+
+        PollPlantMonitoringData(plant_id=self.existent_plant.id, pull_id=second_id)
+        self.assertEqual(mock_get.call_args.kwargs['params']['from'], datetime.date(2020, 1, 5))
+        # Tasks of pulls already performed do nothing
+        PollPlantMonitoringData(plant_id=self.existent_plant.id, pull_id=second_id)
+        self.assertEqual(mock_get.call_count, 2)
+        # Finished pulls are removed from the registry
+        self.assertEqual(self.get_registered_ranges(), [])
@@ -0,0 +1,187 @@
+import datetime
+import math
+from http import HTTPStatus
+from typing import List
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backend.models import Plant, Datapoint, DatapointSketch, DatapointSnapshot
+from backend.snapshots import get_unarchived_months
+from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
+
+PLANTS = 20
+DAYS = 180
+MAX_REPORT_QUERIES = 6
+# Besides the statements writing datapoints and their daily sketches in bulk
+MAX_POLL_QUERIES = 6
+
+
+def explain(sql: str) -> List[str]:
+    """
+    Get the lines of the query plan of a statement.
+    """
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def get_unique_index_name() -> str:
+    """
+    Get the name of the (plant, timestamp) unique index of datapoints.
+    """
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, Datapoint._meta.db_table)
+    return next(
+        name for name, constraint in constraints.items()
+        if constraint['unique'] and constraint['columns'] == ['plant_id', 'timestamp']
+    )
+
+
+class QueryPlansTestCase(TestCase):
+    """
+    Regression tests for the plans of the queries reading datapoints, run on a large synthetic dataset.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plants = [Plant.objects.create(name=f'plant-{i}') for i in range(PLANTS)]
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        Datapoint.objects.bulk_create(
+            (
+                Datapoint(
+                    plant=plant,
+                    timestamp=start + datetime.timedelta(hours=hour),
+                    energy_expected=hour,
+                    energy_observed=hour,
+                    irradiation_expected=hour,
+                    irradiation_observed=hour,
+                )
+                for plant in cls.plants
+                for hour in range(DAYS * 24)
+            ),
+            batch_size=5000
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.unique_index = get_unique_index_name()
+
+    def assertIndexSearch(self, sql: str, index: str = None):
+        """
+        Assert the datapoints table is searched through an index instead of being scanned in full.
+        """
+        plan = explain(sql)
+        table = Datapoint._meta.db_table
+        if connection.vendor == 'sqlite':
+            lines = [line for line in plan if f' {table} ' in f'{line} ']
+            self.assertTrue(lines, plan)
+            for line in lines:
+                self.assertTrue(line.startswith('SEARCH') and 'INDEX' in line, plan)
+        else:
+            self.assertFalse([line for line in plan if f'Seq Scan on {table}' in line], plan)
+        if index:
+            self.assertTrue([line for line in plan if index in line], plan)
+
+    def capture_datapoint_queries(self, func) -> List[str]:
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return [query['sql'] for query in context.captured_queries if f'"{Datapoint._meta.db_table}"' in query['sql']]
+
+    def get_report(self, params):
+        response = self.client.get('/plants/report/', params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_report_query_plan(self):
+        """Reports of some plants within a range of dates search datapoints through an index"""
+        params = {'plant_ids': [self.plants[3].id], 'from': '2020-03-01', 'to': '2020-03-08'}
+        queries = self.capture_datapoint_queries(lambda: self.get_report(params))
+        self.assertEqual(len(queries), 1)
+        self.assertIndexSearch(queries[0])
+
+    def test_report_max_queries(self):
+        """The number of queries of a report is bounded, whatever the number of plants"""
+        for plant_ids in ([self.plants[0].id], [plant.id for plant in self.plants]):
+            with CaptureQueriesContext(connection) as context:
+                self.get_report({'plant_ids': plant_ids, 'from': '2020-03-01', 'to': '2020-03-02'})
+            self.assertLessEqual(len(context), MAX_REPORT_QUERIES)
+
+    def test_fleet_query_plan(self):
+        """Fleet analytics aggregate a range of dates in a single query searching datapoints through an index"""
+        params = {'from': '2020-03-01', 'to': '2020-03-08', 'order': 'deficit'}
+        queries = self.capture_datapoint_queries(lambda: self.client.get('/plants/fleet/', params))
+        self.assertEqual(len(queries), 1)
+        self.assertIndexSearch(queries[0])
+
+    def test_unarchived_months_query_plan(self):
+        """Months not archived are looked up out of the archived ones, through the (plant, timestamp) unique index"""
+        DatapointSnapshot.objects.bulk_create(
+            DatapointSnapshot(plant=plant, month=datetime.date(2020, month, 1), path='', count=0)
+            for plant in self.plants
+            for month in range(1, 6)
+        )
+        queries = self.capture_datapoint_queries(get_unarchived_months)
+        # Before the first snapshot and after the last one, for each plant
+        self.assertEqual(len(queries), 2 * PLANTS)
+        for sql in queries:
+            self.assertIndexSearch(sql, self.unique_index)
+
+    def test_split_datapoints_query_plan(self):
+        """Existing datapoints are looked up through the (plant, timestamp) unique index"""
+        start = datetime.datetime(2020, 2, 1, tzinfo=datetime.timezone.utc)
+        data = [{'timestamp': start + datetime.timedelta(hours=hour)} for hour in range(48)]
+        queries = self.capture_datapoint_queries(
+            lambda: PollPlantMonitoringData._split_datapoints(self.plants[0].id, data)
+        )
+        self.assertEqual(len(queries), 1)
+        self.assertIndexSearch(queries[0], self.unique_index)
+
+    def test_last_timestamp_query_plan(self):
+        """The last datapoint of a plant is looked up through the (plant, timestamp) unique index"""
+        queries = self.capture_datapoint_queries(
+            lambda: PollPlantMonitoringData._get_next_unregistered_date(self.plants[0].id)
+        )
+        self.assertEqual(len(queries), 1)
+        self.assertIndexSearch(queries[0], self.unique_index)
+        self.assertFalse([line for line in explain(queries[0]) if 'TEMP B-TREE' in line or 'Sort' in line])
+
+    @patch('backend.pulls.get_redis', return_value=InMemoryRedis())
+    @patch('backend.tasks.requests.get')
+    def test_poll_max_queries(self, mock_get, mock_redis):
+        """The number of queries of a polling batch is bounded, whatever the number of datapoints"""
+        mock_get.return_value.status_code = HTTPStatus.OK
+        datapoints = [
+            {
+                "datetime": (datetime.datetime(2020, 6, 1) + datetime.timedelta(hours=hour)).isoformat(),
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+            for hour in range(24 * 60)
+        ]
+        mock_get.return_value.json.return_value = datapoints
+        with CaptureQueriesContext(connection) as context:
+            PollPlantMonitoringData(
+                plant_id=self.plants[0].id,
+                date_from=datetime.date(2020, 6, 1),
+                date_to=datetime.date(2020, 7, 31)
+            )
+        queries = [query['sql'] for query in context.captured_queries]
+        writes = [
+            sql for sql in queries
+            if sql.startswith((f'INSERT INTO "{Datapoint._meta.db_table}"', f'UPDATE "{Datapoint._meta.db_table}"'))
+        ]
+        sketch_writes = [
+            sql for sql in queries
+            if sql.startswith((f'INSERT INTO "{DatapointSketch._meta.db_table}"',
+                               f'UPDATE "{DatapointSketch._meta.db_table}"'))
+        ]
+        self.assertLessEqual(len(queries) - len(writes) - len(sketch_writes), MAX_POLL_QUERIES)
+        # Datapoints are created and updated with as many rows per statement as the database allows
+        batch_size = connection.ops.bulk_batch_size(Datapoint._meta.concrete_fields, datapoints)
+        self.assertLessEqual(len(writes), 2 * math.ceil(len(datapoints) / batch_size))
+        # And so are the sketches, one per day
+        sketch_batch_size = connection.ops.bulk_batch_size(DatapointSketch._meta.concrete_fields, range(60))
+        self.assertLessEqual(len(sketch_writes), 2 * math.ceil(60 / sketch_batch_size))
@@ -0,0 +1,87 @@
+import datetime
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from backend.models import Plant
+from backend.tasks import poll_intraday_monitoring_data, poll_monitoring_data, schedule_polling, split_date_range
+from backend.tests.stubs import InMemoryRedis
+from power_factors.celery import BACKFILL_QUEUE, HIGH_PRIORITY, INCREMENTAL_QUEUE, LOW_PRIORITY
+
+
+@patch('backend.tasks.PollPlantMonitoringData.apply_async')
+class QueuesTestCase(TestCase):
+    def setUp(self):
+        self.plants = [
+            Plant.objects.create(name='plant-1'),
+            Plant.objects.create(name='plant-2'),
+        ]
+        patcher = patch('backend.pulls.get_redis', return_value=InMemoryRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_split_date_range(self, mock_apply_async):
+        """Ranges of dates are split into windows"""
+        self.assertEqual(
+            split_date_range(datetime.date(2020, 1, 1), datetime.date(2020, 1, 25), days=10),
+            [
+                (datetime.date(2020, 1, 1), datetime.date(2020, 1, 11)),
+                (datetime.date(2020, 1, 11), datetime.date(2020, 1, 21)),
+                (datetime.date(2020, 1, 21), datetime.date(2020, 1, 25)),
+            ]
+        )
+
+    def test_incremental_polling(self, mock_apply_async):
+        """The nightly polling is enqueued in the incremental queue with high priority"""
+        poll_monitoring_data()
+        self.assertEqual(mock_apply_async.call_count, len(self.plants))
+        for plant, call_args in zip(self.plants, mock_apply_async.call_args_list):
+            self.assertEqual(call_args.kwargs['kwargs']['plant_id'], plant.id)
+            self.assertEqual(call_args.kwargs['kwargs']['date_from'], datetime.date(2022, 1, 2))
+            self.assertEqual(call_args.kwargs['queue'], INCREMENTAL_QUEUE)
+            self.assertEqual(call_args.kwargs['priority'], HIGH_PRIORITY)
+
+    def test_intraday_polling(self, mock_apply_async):
+        """Intraday polling is enqueued as cursor pulls from the date of the last datapoint up to today"""
+        last_timestamp = datetime.datetime(2022, 3, 1, 12, tzinfo=datetime.timezone.utc)
+        Plant.objects.filter(id=self.plants[0].id).update(last_datapoint_timestamp=last_timestamp)
+        poll_intraday_monitoring_data()
+        self.assertEqual(
+            [
+                (call_args.kwargs['kwargs']['plant_id'], call_args.kwargs['kwargs']['date_from'])
+                for call_args in mock_apply_async.call_args_list
+            ],
+            [
+                (self.plants[0].id, datetime.date(2022, 3, 1)),
+                (self.plants[1].id, datetime.date(2022, 1, 1)),
+            ]
+        )
+        for call_args in mock_apply_async.call_args_list:
+            self.assertEqual(call_args.kwargs['kwargs']['date_to'], timezone.now().date() + datetime.timedelta(days=1))
+            self.assertEqual(call_args.kwargs['queue'], INCREMENTAL_QUEUE)
+            self.assertEqual(call_args.kwargs['priority'], HIGH_PRIORITY)
+
+    @override_settings(BACKFILL_WINDOW_DAYS=30)
+    def test_backfill_polling(self, mock_apply_async):
+        """Backfills are split into subtasks, enqueued in the backfill queue with low priority alternating plants"""
+        schedule_polling(
+            [plant.id for plant in self.plants],
+            date_from=datetime.date(2020, 1, 1),
+            date_to=datetime.date(2020, 3, 1)
+        )
+        self.assertEqual(
+            [
+                (call_args.kwargs['kwargs']['plant_id'], call_args.kwargs['kwargs']['date_from'])
+                for call_args in mock_apply_async.call_args_list
+            ],
+            [
+                (self.plants[0].id, datetime.date(2020, 1, 1)),
+                (self.plants[1].id, datetime.date(2020, 1, 1)),
+                (self.plants[0].id, datetime.date(2020, 1, 31)),
+                (self.plants[1].id, datetime.date(2020, 1, 31)),
+            ]
+        )
+        for call_args in mock_apply_async.call_args_list:
+            self.assertEqual(call_args.kwargs['queue'], BACKFILL_QUEUE)
+            self.assertEqual(call_args.kwargs['priority'], LOW_PRIORITY)
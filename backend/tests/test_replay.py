@@ -0,0 +1,182 @@
+import datetime
+import io
+import json
+import tempfile
+import threading
+from http import HTTPStatus
+from unittest.mock import patch
+
+import requests
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from backend.models import Plant, Datapoint
+from backend.replay import Recording, Replayer, load_recordings, make_server
+from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
+
+ITEMS = [
+    {
+        "datetime": "2019-01-01T00:00:00",
+        "expected": {"energy": 87.5, "irradiation": 98.25},
+        "observed": {"energy": 90, "irradiation": 30.5}
+    },
+    {
+        "datetime": "2019-01-01T01:00:00",
+        "expected": {"energy": 12.5, "irradiation": 8.25},
+        "observed": {"energy": 10.0, "irradiation": 3.5}
+    },
+    {
+        "datetime": "2019-01-02T00:00:00",
+        "expected": {"energy": 1.5, "irradiation": 2.5},
+        "observed": {"energy": 3.5, "irradiation": 4.5}
+    },
+    {
+        "datetime": "2019-01-02T01:00:00",
+        "expected": {"energy": "invalid", "irradiation": 2.5},
+        "observed": {"energy": 3.5, "irradiation": 4.5}
+    },
+]
+
+
+class ReplayTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        recording = Recording(self.existent_plant.id)
+        recording.add_response(ITEMS, 0.25)
+        recording.save(self.directory)
+        self.recordings = load_recordings(self.directory)
+
+    def get_items(self, replayer: Replayer, date_from: datetime.date, date_to: datetime.date, plant_id=None):
+        status, body, _ = replayer.respond(plant_id or self.existent_plant.id, date_from, date_to)
+        self.assertEqual(status, HTTPStatus.OK)
+        return json.loads(body)
+
+    def test_round_trip(self):
+        """Recorded days are replayed as they were received, including malformed items"""
+        replayer = Replayer(self.recordings)
+        self.assertEqual(self.recordings[self.existent_plant.id].latencies, [0.25])
+        self.assertEqual(self.get_items(replayer, datetime.date(2019, 1, 1), datetime.date(2019, 1, 3)), ITEMS)
+        self.assertEqual(
+            self.get_items(replayer, datetime.date(2019, 1, 2), datetime.date(2019, 1, 3)),
+            ITEMS[2:]
+        )
+
+    def test_record_command(self):
+        """Recordings are made requesting the monitoring service by windows"""
+        with patch('backend.management.commands.record_monitoring_data.requests.get') as mock_get:
+            mock_get.return_value.status_code = HTTPStatus.OK
+            mock_get.return_value.json.side_effect = [ITEMS[:2], ITEMS[2:]]
+            call_command(
+                'record_monitoring_data', self.directory, '7',
+                '--from', '2019-01-01', '--to', '2019-01-03', '--window-days', '1',
+                stdout=io.StringIO()
+            )
+        self.assertEqual(mock_get.call_count, 2)
+        recording = load_recordings(self.directory)[7]
+        self.assertEqual(len(recording.latencies), 2)
+        self.assertEqual(
+            self.get_items(Replayer({7: recording}), datetime.date(2019, 1, 1), datetime.date(2019, 1, 3)),
+            ITEMS
+        )
+
+    def test_cyclic_mapping(self):
+        """Days and plants not recorded are mapped onto the recorded ones"""
+        replayer = Replayer(self.recordings)
+        items = self.get_items(replayer, datetime.date(2022, 3, 1), datetime.date(2022, 3, 5), plant_id=1000)
+        # Malformed items are served as they were received
+        items = [item for item in items if item['expected']['energy'] != 'invalid']
+        days = sorted({item['datetime'][:10] for item in items})
+        self.assertEqual(days, ['2022-03-01', '2022-03-02', '2022-03-03', '2022-03-04'])
+        # Every day is served with the items of one of the recorded days
+        for day in days:
+            values = [item['expected'] for item in items if item['datetime'].startswith(day)]
+            self.assertIn(values, [[item['expected'] for item in ITEMS[:2]], [ITEMS[2]['expected']]])
+
+    def test_scale(self):
+        """Scaled replays spread copies of each datapoint until the next one"""
+        replayer = Replayer(self.recordings, scale=2)
+        items = self.get_items(replayer, datetime.date(2019, 1, 1), datetime.date(2019, 1, 2))
+        self.assertEqual(
+            [item['datetime'] for item in items],
+            ['2019-01-01T00:00:00', '2019-01-01T00:30:00', '2019-01-01T01:00:00', '2019-01-01T01:30:00']
+        )
+        self.assertEqual(items[1]['observed'], ITEMS[0]['observed'])
+
+    def test_deterministic_errors(self):
+        """Errors and latencies are the same for replays with the same seed"""
+        self.assertEqual(
+            Replayer(self.recordings, error_rate=1).respond(1, datetime.date(2019, 1, 1), datetime.date(2019, 1, 2)),
+            (HTTPStatus.SERVICE_UNAVAILABLE, b'Service Unavailable', 0.25)
+        )
+
+        def get_statuses(seed):
+            replayer = Replayer(self.recordings, error_rate=0.5, seed=seed)
+            return [
+                replayer.respond(plant_id, datetime.date(2019, 1, 1), datetime.date(2019, 1, 2))[0]
+                for plant_id in range(20)
+                for _ in range(3)
+            ]
+
+        statuses = get_statuses('a')
+        self.assertEqual(statuses, get_statuses('a'))
+        self.assertIn(HTTPStatus.OK, statuses)
+        self.assertIn(HTTPStatus.SERVICE_UNAVAILABLE, statuses)
+
+
+class ReplayServerTestCase(TestCase):
+    def setUp(self):
+        patcher = patch('backend.pulls.get_redis', return_value=InMemoryRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        recording = Recording(self.existent_plant.id)
+        recording.add_response(ITEMS, 0.25)
+        self.recordings = {self.existent_plant.id: recording}
+
+    def serve(self, replayer: Replayer):
+        server = make_server(replayer, '127.0.0.1', 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        settings_override = override_settings(MONITORING_SERVICE_URL=f'http://127.0.0.1:{server.server_port}')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_poll_task(self):
+        """Poll task ingests the datapoints replayed, discarding the invalid ones"""
+        self.serve(Replayer(self.recordings, latency=0))
+        with self.assertLogs(level='ERROR'):
+            PollPlantMonitoringData(
+                plant_id=self.existent_plant.id,
+                date_from=datetime.date(2019, 1, 1),
+                date_to=datetime.date(2019, 1, 3)
+            )
+        self.assertEqual(Datapoint.objects.filter(plant=self.existent_plant).count(), 3)
+
+    def test_poll_task_errors(self):
+        """Poll task retries failed requests, storing nothing when all of them fail"""
+        replayer = Replayer(self.recordings, latency=0, error_rate=1)
+        self.serve(replayer)
+        PollPlantMonitoringData(
+            plant_id=self.existent_plant.id,
+            date_from=datetime.date(2019, 1, 1),
+            date_to=datetime.date(2019, 1, 3)
+        )
+        self.assertEqual(sum(replayer.requests.values()), PollPlantMonitoringData.MAX_POLLING_ATTEMPTS)
+        self.assertFalse(Datapoint.objects.filter(plant=self.existent_plant).exists())
+
+    def test_bad_request(self):
+        """Requests without valid parameters are rejected"""
+        self.serve(Replayer(self.recordings))
+        response = requests.get(settings.MONITORING_SERVICE_URL, params={'plant-id': 'x'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
@@ -0,0 +1,75 @@
+import datetime
+from http import HTTPStatus
+from unittest.mock import patch
+
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from backend.models import Plant, Datapoint
+from backend.routers import PIN_PRIMARY_COOKIE
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        Datapoint.objects.create(
+            plant=self.existent_plant,
+            timestamp=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+            energy_expected=1,
+            energy_observed=2,
+            irradiation_expected=3,
+            irradiation_observed=4
+        )
+
+    def request(self, method, path, **kwargs):
+        """
+        Make a request, returning it along with the number of queries sent to the primary and to the replica.
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(path, **kwargs)
+        return response, len(primary), len(replica)
+
+    def test_reads_from_replica(self):
+        """Reports and plant reads are served from the replica"""
+        for path in ('/plants/', f'/plants/{self.existent_plant.id}/', '/plants/report/', '/plants/fleet/'):
+            response, primary, replica = self.request('get', path)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(primary, 0, path)
+            self.assertGreater(replica, 0, path)
+        self.assertEqual(
+            response.json()[0]['id'],
+            self.existent_plant.id
+        )
+
+    def test_writes_to_primary(self):
+        """Plant writes go to the primary"""
+        response, primary, replica = self.request('post', '/plants/', data={'name': 'new-plant'})
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    @patch('backend.views.schedule_polling')
+    def test_read_your_writes(self, mock_schedule):
+        """Reads following a pull request are pinned to the primary"""
+        response, *_ = self.request('post', '/plants/pull_datapoints/', data={})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn(PIN_PRIMARY_COOKIE, response.cookies)
+
+        response, primary, replica = self.request('get', '/plants/report/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_read_primary_header(self):
+        """Clients can force reading from the primary"""
+        response, primary, replica = self.request('get', '/plants/report/', HTTP_X_READ_PRIMARY='1')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
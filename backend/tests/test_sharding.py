@@ -0,0 +1,135 @@
+import datetime
+import io
+import os
+import tempfile
+from http import HTTPStatus
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.apps import apps
+from django.db import connections, router
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from backend.models import Plant, Datapoint
+from backend.sharding import get_shard
+from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
+
+SHARDS = ['shard_0', 'shard_1']
+
+
+@override_settings(DATAPOINT_SHARDS=SHARDS)
+class ShardingTestCase(TransactionTestCase):
+    databases = {'default', *SHARDS}
+
+    def setUp(self):
+        self.plants = [Plant.objects.create(name=f'plant-{i}') for i in range(4)]
+        for i, plant in enumerate(self.plants):
+            Datapoint.objects.using(get_shard(plant.id)).bulk_create([
+                Datapoint(
+                    plant_id=plant.id,
+                    timestamp=datetime.datetime(2020, 1, 1, hour=hour, tzinfo=datetime.timezone.utc),
+                    energy_expected=10,
+                    energy_observed=i,
+                    irradiation_expected=10,
+                    irradiation_observed=i,
+                )
+                # Plant 0 misses a few hours
+                for hour in range(24) if i or hour not in (5, 6)
+            ])
+        for patcher in (
+                patch('backend.streams.get_redis', return_value=InMemoryRedis()),
+                patch('backend.pulls.get_redis', return_value=InMemoryRedis()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shard_map(self):
+        """Plants are spread across shards, unless assigned to one explicitly"""
+        self.assertEqual({get_shard(plant.id) for plant in self.plants}, set(SHARDS))
+        for plant in self.plants:
+            self.assertEqual(Datapoint.objects.using(get_shard(plant.id)).filter(plant=plant).count() > 0, True)
+            self.assertFalse(Datapoint.objects.filter(plant=plant).exists())
+        with override_settings(DATAPOINT_SHARD_MAP={self.plants[0].id: 'shard_1', self.plants[1].id: 'shard_1'}):
+            self.assertEqual({get_shard(plant.id) for plant in self.plants[:2]}, {'shard_1'})
+
+    def test_migrate(self):
+        """Only the datapoints table is created in the shards"""
+        for model in apps.get_models():
+            self.assertEqual(router.allow_migrate_model('shard_0', model), model is Datapoint)
+            self.assertTrue(router.allow_migrate_model('default', model))
+
+    def test_report(self):
+        """Reports read every shard and merge their datapoints"""
+        with CaptureQueriesContext(connections['default']) as default:
+            response = self.client.get('/plants/report/', {'from': '2020-01-01T02:00:00', 'to': '2020-01-01T10:00:00'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        results = response.json()['results']
+        self.assertEqual([result['id'] for result in results], [plant.id for plant in self.plants])
+        self.assertEqual([len(result['datapoints']) for result in results], [6, 8, 8, 8])
+        for i, result in enumerate(results):
+            self.assertEqual({datapoint['energy_observed'] for datapoint in result['datapoints']}, {i})
+            timestamps = [datapoint['timestamp'] for datapoint in result['datapoints']]
+            self.assertEqual(timestamps, sorted(timestamps))
+        self.assertFalse([query for query in default.captured_queries if 'backend_datapoint"' in query['sql']])
+
+    @patch('backend.tasks.requests.get')
+    def test_poll_task(self, mock_get):
+        """Polled datapoints are written to the shard of their plant"""
+        plant = self.plants[0]
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": f"2020-01-01T0{hour}:00:00",
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+            for hour in range(4, 8)
+        ]
+        PollPlantMonitoringData(
+            plant_id=plant.id,
+            date_from=datetime.date(2020, 1, 1),
+            date_to=datetime.date(2020, 1, 2)
+        )
+        datapoints = Datapoint.objects.using(get_shard(plant.id)).filter(plant=plant)
+        self.assertEqual(datapoints.count(), 24)
+        self.assertEqual(datapoints.filter(energy_observed=3.0).count(), 4)
+        plant.refresh_from_db()
+        self.assertEqual(plant.datapoints_version, 1)
+
+    def test_gaps(self):
+        """Gaps are found in every shard"""
+        response = self.client.get('/plants/gaps/')
+        self.assertEqual(
+            [(item['id'], item['missing_datapoints']) for item in response.json()],
+            [(plant.id, 2 if i == 0 else 0) for i, plant in enumerate(self.plants)]
+        )
+
+    def test_fleet(self):
+        """Fleet rankings merge the top plants of every shard"""
+        response = self.client.get('/plants/fleet/', {'limit': 3})
+        self.assertEqual(
+            [item['id'] for item in response.json()],
+            [plant.id for plant in self.plants[:3]]
+        )
+
+    def test_import(self):
+        """Imported datapoints are written to the shard of their plant"""
+        plant = self.plants[1]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'datapoints.csv')
+            with open(path, 'w') as file:
+                file.write(
+                    'datetime,expected.energy,expected.irradiation,observed.energy,observed.irradiation\n'
+                    '2020-01-02T00:00:00,1,2,3,4\n'
+                )
+            call_command('import_datapoints', plant.id, path, stdout=io.StringIO())
+        self.assertEqual(Datapoint.objects.using(get_shard(plant.id)).filter(plant=plant).count(), 25)
+
+    def test_delete_plant(self):
+        """Deleting a plant deletes its datapoints from its shard"""
+        plant = self.plants[2]
+        response = self.client.delete(f'/plants/{plant.id}/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertFalse(Datapoint.objects.using(get_shard(plant.id)).filter(plant_id=plant.id).exists())
@@ -0,0 +1,229 @@
+import datetime
+import io
+import math
+import os
+import random
+import tempfile
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytz
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backend.models import Plant, Datapoint, DatapointSketch
+from backend.sketches import DDSketch, FIELDS, RELATIVE_ACCURACY, get_report_percentiles, rebuild_sketches
+from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
+
+TIME_ZONE = pytz.timezone(settings.TIME_ZONE)
+
+
+def get_exact_percentile(values, percentile):
+    # Value at the rank the sketch estimates
+    values = sorted(values)
+    return values[math.floor(percentile / 100 * (len(values) - 1))]
+
+
+class DDSketchTestCase(TestCase):
+    def setUp(self):
+        generator = random.Random(0)
+        self.values = [generator.lognormvariate(3, 1) for _ in range(5000)] + [0.0] * 500 + [-2.5] * 10
+
+    def assertAccurate(self, sketch: DDSketch, values):
+        for percentile in (0, 1, 5, 25, 50, 75, 95, 99, 100):
+            expected = get_exact_percentile(values, percentile)
+            self.assertLessEqual(
+                abs(sketch.get_quantile(percentile / 100) - expected),
+                RELATIVE_ACCURACY * abs(expected) + 1e-12
+            )
+
+    def test_accuracy(self):
+        """Quantiles are estimated within the relative accuracy"""
+        sketch = DDSketch()
+        for value in self.values:
+            sketch.add(value)
+        self.assertEqual(sketch.count, len(self.values))
+        self.assertAccurate(sketch, self.values)
+        self.assertIsNone(DDSketch().get_quantile(0.5))
+
+    def test_merge(self):
+        """Merged sketches are the same as the sketch of all the values"""
+        sketches = [DDSketch() for _ in range(3)]
+        whole = DDSketch()
+        for index, value in enumerate(self.values):
+            sketches[index % 3].add(value)
+            whole.add(value)
+        merged = DDSketch.from_dict(sketches[0].to_dict())
+        for sketch in sketches[1:]:
+            merged.merge(DDSketch.from_dict(sketch.to_dict()))
+        self.assertEqual(merged.to_dict(), whole.to_dict())
+
+    def test_remove(self):
+        """Removed values are no longer counted"""
+        sketch = DDSketch()
+        for value in self.values:
+            sketch.add(value)
+        for value in self.values[:1000]:
+            sketch.add(value, -1)
+        self.assertAccurate(sketch, self.values[1000:])
+
+
+class SketchesTestCase(TestCase):
+    def setUp(self):
+        for patcher in (
+                patch('backend.streams.get_redis', return_value=InMemoryRedis()),
+                patch('backend.pulls.get_redis', return_value=InMemoryRedis()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.other_plant = Plant.objects.create(
+            name='other-plant'
+        )
+        generator = random.Random(0)
+        self.items = [
+            {
+                "datetime": (datetime.datetime(2020, 1, 1) + datetime.timedelta(hours=hour)).isoformat(),
+                "expected": {"energy": 1.0, "irradiation": 1.0},
+                "observed": {"energy": generator.random() * 100, "irradiation": generator.random() * 1000}
+            }
+            for hour in range(24 * 10)
+        ]
+
+    @patch('backend.tasks.requests.get')
+    def poll(self, items, mock_get):
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = items
+        PollPlantMonitoringData(
+            plant_id=self.existent_plant.id,
+            date_from=datetime.date(2020, 1, 1),
+            date_to=datetime.date(2020, 1, 11)
+        )
+
+    def get_sketches(self, plant: Plant):
+        return dict(DatapointSketch.objects.filter(plant=plant).values_list('day', 'sketches'))
+
+    def get_values(self, plant: Plant, field: str, **filters):
+        return list(Datapoint.objects.filter(plant=plant, **filters).values_list(field, flat=True))
+
+    def assertPercentiles(self, plants, date_from, date_to, **filters):
+        percentiles = get_report_percentiles(plants, date_from, date_to, [5, 50, 95])
+        for plant in plants:
+            for field in FIELDS:
+                values = self.get_values(plant, field, **filters)
+                for percentile in (5, 50, 95):
+                    expected = get_exact_percentile(values, percentile)
+                    self.assertAlmostEqual(
+                        percentiles[plant.id][field][f'p{percentile}'],
+                        expected,
+                        delta=RELATIVE_ACCURACY * expected
+                    )
+
+    def test_poll_task(self):
+        """Poll task updates the sketches of the days written incrementally"""
+        self.poll(self.items[:100])
+        self.poll(self.items[50:])
+        # Updated datapoints replace their previous values
+        for item in self.items[:24]:
+            item['observed']['energy'] += 10
+        self.poll(self.items[:24])
+
+        sketches = self.get_sketches(self.existent_plant)
+        self.assertEqual(len(sketches), 10)
+        self.assertEqual(
+            DatapointSketch.objects.get(plant=self.existent_plant, day=datetime.date(2020, 1, 1)).count,
+            24
+        )
+        rebuild_sketches(self.existent_plant.id)
+        self.assertEqual(self.get_sketches(self.existent_plant), sketches)
+
+    def test_percentiles(self):
+        """Percentiles over whole days are estimated out of the sketches alone"""
+        self.poll(self.items)
+        date_from = datetime.datetime(2020, 1, 2, tzinfo=TIME_ZONE)
+        date_to = datetime.datetime(2020, 1, 5, tzinfo=TIME_ZONE)
+        self.assertPercentiles(
+            [self.existent_plant], date_from, date_to,
+            timestamp__gte=date_from, timestamp__lt=date_to
+        )
+        self.assertPercentiles([self.existent_plant], None, None)
+
+        with CaptureQueriesContext(connection) as context:
+            get_report_percentiles([self.existent_plant, self.other_plant], date_from, date_to, [50])
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertIn(f'FROM "{DatapointSketch._meta.db_table}"', context.captured_queries[0]['sql'])
+
+    def test_partial_days(self):
+        """Percentiles over ranges with partial days read the datapoints of those days only"""
+        self.poll(self.items)
+        for date_from, date_to in (
+                (datetime.datetime(2020, 1, 2, 12), datetime.datetime(2020, 1, 5, 6)),
+                (datetime.datetime(2020, 1, 2, 3), datetime.datetime(2020, 1, 2, 20)),
+                (datetime.datetime(2020, 1, 2), datetime.datetime(2020, 1, 2, 20)),
+                (None, datetime.datetime(2020, 1, 5, 6)),
+                (datetime.datetime(2020, 1, 5, 6), None),
+        ):
+            date_from = date_from and TIME_ZONE.localize(date_from)
+            date_to = date_to and TIME_ZONE.localize(date_to)
+            filters = {}
+            if date_from:
+                filters['timestamp__gte'] = date_from
+            if date_to:
+                filters['timestamp__lt'] = date_to
+            self.assertPercentiles([self.existent_plant], date_from, date_to, **filters)
+
+    def test_report(self):
+        """Reports estimate the requested percentiles instead of listing the datapoints"""
+        self.poll(self.items)
+        response = self.client.get('/plants/report/', {
+            'from': '2020-01-02',
+            'to': '2020-01-05',
+            'percentiles': '5,50,99.9'
+        })
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        results = {result['id']: result for result in response.json()['results']}
+        self.assertNotIn('datapoints', results[self.existent_plant.id])
+        self.assertEqual(set(results[self.existent_plant.id]['percentiles']), set(FIELDS))
+        self.assertEqual(
+            set(results[self.existent_plant.id]['percentiles']['energy_observed']),
+            {'p5', 'p50', 'p99.9'}
+        )
+        # Plants without datapoints have no percentiles
+        self.assertEqual(
+            results[self.other_plant.id]['percentiles']['energy_observed'],
+            {'p5': None, 'p50': None, 'p99.9': None}
+        )
+
+        for percentiles in ('a,50', '101', ''):
+            response = self.client.get('/plants/report/', {'percentiles': percentiles})
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_import(self):
+        """Imported datapoints rebuild the sketches of their days"""
+        self.poll(self.items)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'datapoints.csv')
+            with open(path, 'w') as file:
+                file.write('datetime,expected.energy,expected.irradiation,observed.energy,observed.irradiation\n')
+                file.write('2020-01-03T05:00:00,1.5,2.5,3.5,4.5\n')
+                file.write('2020-01-20T05:00:00,1.5,2.5,3.5,4.5\n')
+            call_command('import_datapoints', self.existent_plant.id, path, stdout=io.StringIO())
+        sketches = self.get_sketches(self.existent_plant)
+        self.assertEqual(len(sketches), 11)
+        rebuild_sketches(self.existent_plant.id)
+        self.assertEqual(self.get_sketches(self.existent_plant), sketches)
+
+    def test_build_command(self):
+        """Sketches are built for the datapoints written before they were maintained"""
+        self.poll(self.items)
+        sketches = self.get_sketches(self.existent_plant)
+        DatapointSketch.objects.all().delete()
+        call_command('build_sketches', stdout=io.StringIO())
+        self.assertEqual(self.get_sketches(self.existent_plant), sketches)
+        self.assertEqual(self.get_sketches(self.other_plant), {})
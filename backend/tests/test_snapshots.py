@@ -0,0 +1,195 @@
+import datetime
+import os
+import random
+import tempfile
+from http import HTTPStatus
+from pathlib import Path
+from unittest.mock import patch
+
+import pytz
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from backend import reports
+from backend.models import Plant, Datapoint, DatapointSnapshot
+from backend.snapshots import delete_snapshot_files, get_month, get_unarchived_months, read_snapshot, write_snapshot
+from backend.tasks import PollPlantMonitoringData, archive_closed_months
+from backend.tests.stubs import InMemoryRedis
+
+
+class SnapshotsTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SNAPSHOTS_DIR=Path(directory.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.other_plant = Plant.objects.create(
+            name='other-plant'
+        )
+        datapoints = []
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        timestamp = datetime.datetime(2020, 1, 1, tzinfo=time_zone)
+        while timestamp < datetime.datetime(2020, 4, 1, tzinfo=time_zone):
+            for plant in (self.existent_plant, self.other_plant):
+                datapoints.append(Datapoint(
+                    plant=plant,
+                    timestamp=timestamp,
+                    energy_expected=random.random() * 100,
+                    energy_observed=random.random() * 100,
+                    irradiation_expected=random.random() * 100,
+                    irradiation_observed=random.random() * 100,
+                ))
+            timestamp += datetime.timedelta(hours=1)
+        Datapoint.objects.bulk_create(datapoints)
+
+    def get_reports(self):
+        return [
+            self.client.get('/plants/report/', params).content
+            for params in (
+                {},
+                {'from': '2020-01-15T12:00:00', 'to': '2020-03-02'},
+                {'from': '2020-02-01', 'to': '2020-03-01'},
+                {'plant_ids': [self.other_plant.id], 'to': '2020-01-01T05:00:00'},
+            )
+        ]
+
+    def test_archive(self):
+        """A snapshot is written for each closed month with datapoints"""
+        archive_closed_months()
+        self.assertEqual(
+            list(DatapointSnapshot.objects.order_by('plant_id', 'month').values_list('plant_id', 'month', 'count')),
+            [
+                (plant.id, datetime.date(2020, month, 1), days * 24)
+                for plant in (self.existent_plant, self.other_plant)
+                for month, days in ((1, 31), (2, 29), (3, 31))
+            ]
+        )
+        # Already archived months are not written again
+        archive_closed_months()
+        self.assertEqual(DatapointSnapshot.objects.count(), 6)
+
+    def test_unarchived_months(self):
+        """Months without snapshot are found before, between and after the archived ones"""
+        archive_closed_months()
+        self.assertEqual(get_unarchived_months(), [])
+
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        Datapoint.objects.bulk_create(
+            Datapoint(
+                plant=self.existent_plant,
+                timestamp=timestamp,
+                energy_expected=1,
+                energy_observed=1,
+                irradiation_expected=1,
+                irradiation_observed=1,
+            )
+            for timestamp in (
+                datetime.datetime(2019, 12, 1, tzinfo=time_zone),
+                datetime.datetime(2020, 5, 1, tzinfo=time_zone),
+            )
+        )
+        DatapointSnapshot.objects.filter(plant=self.existent_plant, month=datetime.date(2020, 2, 1)).delete()
+        self.assertEqual(
+            [(item['plant_id'], get_month(item['month'])) for item in get_unarchived_months()],
+            [
+                (self.existent_plant.id, datetime.date(2019, 12, 1)),
+                (self.existent_plant.id, datetime.date(2020, 2, 1)),
+                (self.existent_plant.id, datetime.date(2020, 5, 1)),
+            ]
+        )
+
+    def test_stale_snapshot(self):
+        """Snapshots of months written while being archived are discarded"""
+        replace = os.replace
+
+        def write_meanwhile(*args):
+            replace(*args)
+            Plant.objects.filter(id=self.existent_plant.id).register_datapoints_write(
+                datetime.datetime(2020, 1, 1, tzinfo=pytz.timezone(settings.TIME_ZONE))
+            )
+
+        with patch('backend.snapshots.os.replace', side_effect=write_meanwhile):
+            self.assertIsNone(write_snapshot(self.existent_plant.id, datetime.date(2020, 1, 1), 0))
+        self.assertFalse(DatapointSnapshot.objects.exists())
+        self.assertEqual(os.listdir(settings.SNAPSHOTS_DIR / str(self.existent_plant.id)), [])
+
+    def test_read_snapshot(self):
+        """Snapshots hold the same datapoints as the database"""
+        archive_closed_months()
+        snapshot = DatapointSnapshot.objects.get(plant=self.existent_plant, month=datetime.date(2020, 2, 1))
+        fields = ['timestamp', 'energy_expected', 'energy_observed', 'irradiation_expected', 'irradiation_observed']
+        self.assertEqual(
+            [[getattr(datapoint, field) for field in fields] for datapoint in read_snapshot(snapshot)],
+            list(map(list, Datapoint.objects.filter(
+                plant=self.existent_plant,
+                timestamp__month=2
+            ).order_by('timestamp').values_list(*fields)))
+        )
+
+    def test_report_from_snapshots(self):
+        """Reports served from snapshots are identical to those served from the database"""
+        expected = self.get_reports()
+        archive_closed_months()
+        with patch('backend.reports.read_snapshot', side_effect=read_snapshot) as mock_read:
+            self.assertEqual(self.get_reports(), expected)
+        self.assertTrue(mock_read.called)
+
+    def test_report_with_invalidated_month(self):
+        """Reports are identical when some month in the middle is not archived"""
+        expected = self.get_reports()
+        archive_closed_months()
+        DatapointSnapshot.objects.filter(plant=self.existent_plant, month=datetime.date(2020, 2, 1)).delete()
+        self.assertEqual(self.get_reports(), expected)
+
+    def test_report_with_deleted_snapshot(self):
+        """Reports are identical when a snapshot file is deleted after its index is read"""
+        expected = self.get_reports()
+        archive_closed_months()
+        get_snapshot_runs = reports._get_snapshot_runs
+
+        def delete_meanwhile(*args):
+            runs = get_snapshot_runs(*args)
+            # As a write invalidating the month would, once committed
+            snapshots = DatapointSnapshot.objects.filter(plant=self.existent_plant, month=datetime.date(2020, 2, 1))
+            delete_snapshot_files(list(snapshots.values_list('path', flat=True)))
+            snapshots.delete()
+            return runs
+
+        with patch('backend.reports._get_snapshot_runs', side_effect=delete_meanwhile):
+            self.assertEqual(self.get_reports(), expected)
+
+    @patch('backend.pulls.get_redis', return_value=InMemoryRedis())
+    @patch('backend.streams.get_redis', return_value=InMemoryRedis())
+    @patch('backend.tasks.requests.get')
+    def test_invalidation(self, mock_get, mock_redis, mock_pulls_redis):
+        """Writing datapoints into an archived month invalidates its snapshot"""
+        archive_closed_months()
+        snapshot = DatapointSnapshot.objects.get(plant=self.existent_plant, month=datetime.date(2020, 2, 1))
+
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": "2020-02-10T00:00:00",
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            PollPlantMonitoringData(
+                plant_id=self.existent_plant.id,
+                date_from=datetime.date(2020, 2, 10),
+                date_to=datetime.date(2020, 2, 11)
+            )
+
+        self.assertFalse(DatapointSnapshot.objects.filter(id=snapshot.id).exists())
+        self.assertFalse(os.path.exists(snapshot.path))
+        # Other snapshots are kept
+        self.assertEqual(DatapointSnapshot.objects.count(), 5)
+
+        response = self.client.get('/plants/report/', {'plant_ids': [self.existent_plant.id], 'from': '2020-02-10'})
+        self.assertEqual(response.json()['results'][0]['datapoints'][0]['energy_observed'], 3.0)
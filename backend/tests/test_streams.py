@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import json
+from http import HTTPStatus
+from unittest.mock import patch, AsyncMock
+
+import pytz
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase
+
+from backend.models import Plant, Datapoint
+from backend.streams import DatapointStreamRouter, get_channel, publish_datapoints_change
+from backend.tasks import PollPlantMonitoringData
+from backend.tests.stubs import InMemoryRedis
+
+
+class PublishDatapointsChangeTestCase(TestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        self.redis = InMemoryRedis()
+        for target in ('backend.streams.get_redis', 'backend.pulls.get_redis'):
+            patcher = patch(target, return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch('backend.tasks.requests.get')
+    def test_poll_task_publishes_change(self, mock_get):
+        """A change notification is published once the polled datapoints are committed"""
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = [
+            {
+                "datetime": f"2019-01-01T0{hour}:00:00",
+                "expected": {"energy": 1.0, "irradiation": 2.0},
+                "observed": {"energy": 3.0, "irradiation": 4.0}
+            }
+            for hour in range(3)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            PollPlantMonitoringData(
+                plant_id=self.existent_plant.id,
+                date_from=datetime.date(2019, 1, 1),
+                date_to=datetime.date(2019, 1, 2)
+            )
+            # Nothing is published before the transaction is committed
+            self.assertEqual(self.redis.published, [])
+
+        self.assertEqual(len(self.redis.published), 1)
+        channel, message = self.redis.published[0]
+        self.assertEqual(channel, get_channel(self.existent_plant.id))
+        self.assertEqual(
+            json.loads(message),
+            {
+                'plant_id': self.existent_plant.id,
+                'from': '2019-01-01T00:00:00+00:00',
+                'to': '2019-01-01T02:00:00+00:00',
+                'count': 3
+            }
+        )
+
+    @patch('backend.tasks.requests.get')
+    def test_poll_task_empty_response_publishes_nothing(self, mock_get):
+        """No change notification is published when no datapoints are written"""
+        mock_get.return_value.status_code = HTTPStatus.OK
+        mock_get.return_value.json.return_value = []
+        with self.captureOnCommitCallbacks(execute=True):
+            PollPlantMonitoringData(plant_id=self.existent_plant.id)
+        self.assertEqual(self.redis.published, [])
+
+
+class DatapointStreamTestCase(TransactionTestCase):
+    def setUp(self):
+        self.existent_plant = Plant.objects.create(
+            name='existent-plant'
+        )
+        time_zone = pytz.timezone(settings.TIME_ZONE)
+        self.timestamps = [
+            datetime.datetime(2020, 1, 1, hour=hour, tzinfo=time_zone)
+            for hour in range(4)
+        ]
+        Datapoint.objects.bulk_create([
+            Datapoint(
+                plant=self.existent_plant,
+                timestamp=timestamp,
+                energy_expected=1.0,
+                energy_observed=2.0,
+                irradiation_expected=3.0,
+                irradiation_observed=4.0,
+            )
+            for timestamp in self.timestamps
+        ])
+        self.redis = InMemoryRedis()
+        for target in ('get_redis', 'get_async_redis'):
+            patcher = patch(f'backend.streams.{target}', return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _stream(self, path, on_subscribed=None):
+        """
+        Open a stream, optionally running a callback once subscribed, and return every ASGI message sent.
+        """
+        inner_application = AsyncMock()
+
+        async def scenario():
+            received, sent = asyncio.Queue(), []
+
+            async def send(message):
+                sent.append(message)
+
+            await received.put({'type': 'http.request', 'body': b'', 'more_body': False})
+            application = DatapointStreamRouter(inner_application)
+            task = asyncio.ensure_future(application(
+                {'type': 'http', 'path': path, 'method': 'GET'},
+                received.get,
+                send
+            ))
+            if on_subscribed:
+                while not self.redis.subscribers[get_channel(self.existent_plant.id)] and not task.done():
+                    await asyncio.sleep(0.01)
+                on_subscribed()
+                while len(sent) < 2 and not task.done():
+                    await asyncio.sleep(0.01)
+            await received.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(task, timeout=5)
+            return sent
+
+        return asyncio.run(scenario()), inner_application
+
+    def test_stream(self):
+        """Changed datapoints are pushed to the stream subscribers"""
+        sent, _ = self._stream(
+            f'/plants/{self.existent_plant.id}/stream/',
+            on_subscribed=lambda: publish_datapoints_change(self.existent_plant.id, self.timestamps[1:3])
+        )
+        self.assertEqual(sent[0]['status'], HTTPStatus.OK)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+
+        event = sent[1]['body'].decode()
+        self.assertTrue(event.startswith('event: datapoints\nid: 2020-01-01T02:00:00+00:00\ndata: '))
+        self.assertEqual(
+            json.loads(event.split('data: ', 1)[1]),
+            [
+                {
+                    'timestamp': f'2020-01-01T0{hour}:00:00Z',
+                    'energy_expected': 1.0,
+                    'energy_observed': 2.0,
+                    'irradiation_expected': 3.0,
+                    'irradiation_observed': 4.0
+                }
+                for hour in (1, 2)
+            ]
+        )
+        # Subscription is released once the client disconnects
+        self.assertEqual(self.redis.subscribers[get_channel(self.existent_plant.id)], [])
+
+    def test_stream_nonexistent_plant(self):
+        """Streaming datapoints of a nonexistent plant fails"""
+        sent, _ = self._stream(f'/plants/{self.existent_plant.id + 1}/stream/')
+        self.assertEqual(sent[0]['status'], HTTPStatus.NOT_FOUND)
+
+    def test_other_paths(self):
+        """Requests other than datapoint streams are passed on to the Django application"""
+        _, inner_application = self._stream('/plants/')
+        inner_application.assert_awaited_once()
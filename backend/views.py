@@ -1,65 +1,316 @@
+import datetime
+import hashlib
+import json
+from functools import partial
 from http import HTTPStatus
+from typing import List, Optional, Tuple
 
-from django.db.models import Prefetch
-from rest_framework import viewsets
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import FileResponse, HttpRequest, QueryDict
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import mixins, permissions, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from backend.models import Plant, Datapoint
-from backend.serializers import PlantSerializer, PlantReportSerializer
-from backend.tasks import PollPlantMonitoringData
+from backend.analytics import FLEET_ORDERINGS, get_fleet_ranking
+from backend.exports import request_export
+from backend.fragments import encode_report_datapoints
+from backend.gaps import find_gaps
+from backend.models import Plant, ReportExport
+from backend.profiling import stage
+from backend.reports import get_report_datapoints
+from backend.routers import pin_to_primary, read_from_replicas
+from backend.serializers import PlantSerializer, PlantPercentilesSerializer, PlantReportSerializer, \
+    ReportExportSerializer
+from backend.sketches import get_report_percentiles
+from backend.tasks import export_report, repair_datapoint_gaps, schedule_polling
 from backend.utils import parse_date, parse_ids
 
+FLEET_DEFAULT_LIMIT = 20
+FLEET_MAX_LIMIT = 1000
+
+
+def parse_percentiles(value: Optional[str]) -> Optional[List[float]]:
+    """
+    Get and validate a comma-separated list of percentiles.
+    :param value: Parameter value, if any
+    :return: List of percentiles, or None if not requested
+    """
+    if value is None:
+        return None
+    try:
+        percentiles = [float(percentile) for percentile in value.split(',')]
+    except ValueError:
+        raise ValidationError('Percentiles must be a comma-separated list of numbers')
+    if not all(0 <= percentile <= 100 for percentile in percentiles):
+        raise ValidationError('Percentiles must be between 0 and 100')
+    return percentiles
+
+
+def parse_report_request(
+        queryset: QuerySet,
+        params: QueryDict
+) -> Tuple[QuerySet, Optional[datetime.datetime], Optional[datetime.datetime], Optional[List[float]]]:
+    """
+    Get and validate the parameters of a report request.
+    :param queryset: Plant queryset
+    :param params: Report request parameters
+    :return: Tuple with the queryset filtered by the requested plants, start date, end date and percentiles requested
+        instead of the datapoints, if any
+    """
+    # Get and validate list of plant IDs
+    plant_ids = parse_ids(
+        model=Plant,
+        id_list=params.getlist('plant_ids', [])
+    )
+    # Get and validate dates
+    date_from = parse_date(params.get('from'), as_datetime=True)
+    date_to = parse_date(params.get('to'), as_datetime=True)
+    percentiles = parse_percentiles(params.get('percentiles'))
+    return queryset.filter(id__in=plant_ids), date_from, date_to, percentiles
+
+
+def serialize_report(
+        plants: List[Plant],
+        date_from: Optional[datetime.datetime],
+        date_to: Optional[datetime.datetime],
+        percentiles: Optional[List[float]] = None
+) -> list:
+    """
+    Serialize the report of the given plants.
+    The datapoints of each plant are encoded as JSON already, reusing the fragments cached for closed days.
+    :param plants: Plants to report
+    :param date_from: Start date
+    :param date_to: End date
+    :param percentiles: Percentiles of the observed values reported instead of the datapoints, if any
+    :return: Serialized report
+    """
+    if percentiles is not None:
+        # Estimated out of the daily sketches, without reading the datapoints
+        with stage('percentiles'):
+            estimates = get_report_percentiles(plants, date_from, date_to, percentiles)
+            for plant in plants:
+                plant.report_percentiles = estimates[plant.id]
+            return PlantPercentilesSerializer(plants, many=True).data
+    with stage('datapoints'):
+        datapoints = get_report_datapoints(plants, date_from, date_to)
+    with stage('serialize'):
+        encoded = encode_report_datapoints(plants, datapoints, date_from, date_to)
+        for plant in plants:
+            plant.report_datapoints = encoded[plant.id]
+        return PlantReportSerializer(plants, many=True).data
+
+
+def parse_fleet_request(params: QueryDict) -> Tuple[Optional[list], Optional[datetime.datetime],
+                                                     Optional[datetime.datetime], str, int]:
+    """
+    Get and validate the parameters of a fleet analytics request.
+    :param params: Request parameters
+    :return: Tuple with the plant IDs (None for all), start date, end date, ranking criterion and number of plants
+    """
+    plant_ids = None
+    if params.getlist('plant_ids'):
+        plant_ids = list(parse_ids(
+            model=Plant,
+            id_list=params.getlist('plant_ids')
+        ))
+    date_from = parse_date(params.get('from'), as_datetime=True)
+    date_to = parse_date(params.get('to'), as_datetime=True)
+
+    order = params.get('order', 'ratio')
+    if order not in FLEET_ORDERINGS:
+        raise ValidationError(f"Invalid order '{order}'. Valid values are: {', '.join(FLEET_ORDERINGS)}.")
+    try:
+        limit = int(params.get('limit', FLEET_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValidationError('Limit must be an integer value')
+    if not 0 < limit <= FLEET_MAX_LIMIT:
+        raise ValidationError(f'Limit must be between 1 and {FLEET_MAX_LIMIT}')
+    return plant_ids, date_from, date_to, order, limit
+
+
+def parse_pull_request(data: dict) -> tuple:
+    """
+    Get and validate the parameters of a datapoints pulling request.
+    :param data: Request data
+    :return: Tuple with the plant IDs, start date and end date
+    """
+    plant_ids = parse_ids(
+        model=Plant,
+        id_list=data.get('plant_ids', [])
+    )
+    date_from = parse_date(data.get('from'))
+    date_to = parse_date(data.get('to'))
+    return plant_ids, date_from, date_to
+
+
+def parse_export_request(data: dict) -> Tuple[List[int], Optional[datetime.datetime],
+                                             Optional[datetime.datetime], str]:
+    """
+    Get and validate the parameters of a report export request.
+    :param data: Request data
+    :return: Tuple with the plant IDs, start date, end date and file format
+    """
+    plant_ids = list(parse_ids(
+        model=Plant,
+        id_list=data.get('plant_ids', [])
+    ))
+    date_from = parse_date(data.get('from'), as_datetime=True)
+    date_to = parse_date(data.get('to'), as_datetime=True)
+    export_format = data.get('format', ReportExport.CSV)
+    formats = dict(ReportExport.FORMATS)
+    if export_format not in formats:
+        raise ValidationError(f"Invalid format '{export_format}'. Valid values are: {', '.join(formats)}.")
+    return plant_ids, date_from, date_to, export_format
+
+
+def get_data_etag(request: HttpRequest, plants: QuerySet) -> str:
+    """
+    Get the ETag of a response built out of the data of the given plants.
+    It only depends on the plants and their data version, so no datapoints need to be read to compute it. There is no
+    last modification date, as plants renamed, added or deleted would leave it unchanged.
+    :param request: Request
+    :param plants: Plant queryset
+    :return: ETag
+    """
+    versions = list(plants.order_by('id').values_list(
+        'id', 'name', 'datapoints_version', 'last_datapoint_timestamp'
+    ))
+    etag = hashlib.md5(
+        json.dumps([request.get_full_path(), versions], default=str).encode()
+    ).hexdigest()
+    return quote_etag(etag)
+
 
 class PlantViewSet(viewsets.ModelViewSet):
     queryset = Plant.objects.order_by('id')
     serializer_class = PlantSerializer
 
+    def conditional(self, request, plants: QuerySet, view, *args, **kwargs):
+        """
+        Answer a conditional request without calling the view when the client's copy is still valid.
+        :param request: Request
+        :param plants: Plant queryset with the data the response is built out of
+        :param view: View producing the response otherwise
+        :return: Response
+        """
+        with stage('validators'):
+            etag = get_data_etag(request, plants)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        if response.status_code == HTTPStatus.OK:
+            response['ETag'] = etag
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in permissions.SAFE_METHODS and response.status_code < HTTPStatus.BAD_REQUEST:
+            pin_to_primary(response)
+        return response
+
+    @read_from_replicas
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @read_from_replicas
+    def retrieve(self, request, *args, **kwargs):
+        plants = self.get_queryset().filter(pk=self.get_object().pk)
+        return self.conditional(request, plants, super().retrieve, *args, **kwargs)
+
     @action(detail=False)
+    @read_from_replicas
     def report(self, request):
-        # Get and validate list of plant IDs
+        with stage('parse'):
+            plants, date_from, date_to, percentiles = parse_report_request(self.queryset, request.GET)
+        return self.conditional(request, plants, self._report, plants, date_from, date_to, percentiles)
+
+    def _report(self, request, plants, date_from, date_to, percentiles):
+        with stage('paginate'):
+            page = self.paginate_queryset(plants)
+        if page is None:
+            return Response(serialize_report(list(plants), date_from, date_to, percentiles))
+        return self.get_paginated_response(serialize_report(page, date_from, date_to, percentiles))
+
+    @action(detail=False)
+    @read_from_replicas
+    def fleet(self, request):
+        plant_ids, date_from, date_to, order, limit = parse_fleet_request(request.GET)
+        plants = self.queryset if plant_ids is None else self.queryset.filter(id__in=plant_ids)
+        return self.conditional(request, plants, self._fleet, plant_ids, date_from, date_to, order, limit)
+
+    def _fleet(self, request, plant_ids, date_from, date_to, order, limit):
+        return Response(get_fleet_ranking(plant_ids, date_from, date_to, order, limit))
+
+    @action(detail=False, methods=['POST'])
+    def pull_datapoints(self, request):
+        plant_ids, date_from, date_to = parse_pull_request(request.data)
+        # Launch task for each plant
+        schedule_polling(plant_ids, date_from, date_to)
+        return Response(status=HTTPStatus.OK)
+
+    @action(detail=False)
+    def gaps(self, request):
         plant_ids = parse_ids(
             model=Plant,
             id_list=request.GET.getlist('plant_ids', [])
         )
-        # Get and validate dates
-        date_from = parse_date(request.GET.get('from'), as_datetime=True)
-        date_to = parse_date(request.GET.get('to'), as_datetime=True)
-
-        conditions = {}
-        if date_from:
-            conditions['timestamp__gte'] = date_from
-        if date_to:
-            conditions['timestamp__lt'] = date_to
-
-        # Filter queryset by plant IDs and date ranges
-        self.queryset = self.queryset.filter(
-            id__in=plant_ids
-        ).prefetch_related(
-            Prefetch(
-                'datapoints',
-                queryset=Datapoint.objects.filter(**conditions).order_by('timestamp')
-            )
-        )
-        self.serializer_class = PlantReportSerializer
-        return self.list(request)
+        gaps_by_plant = {plant_id: [] for plant_id in plant_ids}
+        for gap in find_gaps(plant_ids):
+            gaps_by_plant[gap.plant_id].append(gap)
+
+        return Response([
+            {
+                'id': plant_id,
+                'gaps': len(gaps),
+                'missing_datapoints': sum(gap.missing for gap in gaps),
+                'ranges': [
+                    {
+                        'from': gap.start,
+                        'to': gap.end,
+                        'missing_datapoints': gap.missing
+                    }
+                    for gap in gaps
+                ]
+            }
+            for plant_id, gaps in sorted(gaps_by_plant.items())
+        ])
 
     @action(detail=False, methods=['POST'])
-    def pull_datapoints(self, request):
-        # Get and validate list of plant IDs
+    def repair_gaps(self, request):
         plant_ids = parse_ids(
             model=Plant,
             id_list=request.data.get('plant_ids', [])
         )
-        # Get and validate dates
-        date_from = parse_date(request.data.get('from'))
-        date_to = parse_date(request.data.get('to'))
-
-        # Launch task for each plant
-        for plant_id in plant_ids:
-            PollPlantMonitoringData.delay(
-                plant_id=plant_id,
-                date_from=date_from,
-                date_to=date_to
-            )
+        repair_datapoint_gaps.delay(plant_ids=list(plant_ids))
         return Response(status=HTTPStatus.OK)
+
+
+class ReportExportViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = ReportExport.objects.order_by('id')
+    serializer_class = ReportExportSerializer
+
+    def create(self, request):
+        plant_ids, date_from, date_to, export_format = parse_export_request(request.data)
+        export, enqueue = request_export(plant_ids, date_from, date_to, export_format)
+        if enqueue:
+            transaction.on_commit(partial(export_report.delay, export_id=export.id))
+        return Response(
+            self.get_serializer(export).data,
+            status=HTTPStatus.OK if export.status == ReportExport.DONE else HTTPStatus.ACCEPTED
+        )
+
+    @action(detail=True)
+    def download(self, request, pk=None):
+        export = self.get_object()
+        if export.status != ReportExport.DONE:
+            return Response({'detail': f'Export is {export.status}.'}, status=HTTPStatus.CONFLICT)
+        return FileResponse(
+            open(export.path, 'rb'),
+            as_attachment=True,
+            filename=f'report-{export.id}.{export.format}.gz',
+            content_type='application/gzip'
+        )
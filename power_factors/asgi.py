@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'power_factors.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Django must be set up before importing the application modules
+from backend.streams import DatapointStreamRouter  # noqa: E402
+
+application = DatapointStreamRouter(django_application)
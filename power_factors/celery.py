@@ -1,5 +1,9 @@
+import datetime
+
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
+from kombu import Queue
 
 app = Celery(
     'tasks',
@@ -16,9 +20,47 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+# Queues. Each one is consumed by its own workers (see docker-compose.yml),
+# so that long backfills or exports can't starve the daily updates
+INCREMENTAL_QUEUE = 'incremental'
+BACKFILL_QUEUE = 'backfill'
+EXPORTS_QUEUE = 'exports'
+
+# Priorities. On Redis, 0 is the highest one
+HIGH_PRIORITY = 0
+DEFAULT_PRIORITY = 5
+LOW_PRIORITY = 9
+
+app.conf.task_queues = [
+    Queue(INCREMENTAL_QUEUE),
+    Queue(BACKFILL_QUEUE),
+    Queue(EXPORTS_QUEUE),
+]
+app.conf.task_default_queue = INCREMENTAL_QUEUE
+app.conf.task_default_priority = DEFAULT_PRIORITY
+app.conf.task_routes = {
+    'backend.tasks.poll_monitoring_data': {'queue': INCREMENTAL_QUEUE},
+    'backend.tasks.poll_intraday_monitoring_data': {'queue': INCREMENTAL_QUEUE},
+    'backend.tasks.repair_datapoint_gaps': {'queue': BACKFILL_QUEUE},
+    'backend.tasks.archive_closed_months': {'queue': EXPORTS_QUEUE},
+    'backend.tasks.export_report': {'queue': EXPORTS_QUEUE},
+}
+app.conf.broker_transport_options = {
+    'priority_steps': list(range(10)),
+    'queue_order_strategy': 'priority',
+}
+
 app.conf.beat_schedule = {
     'daily-monitoring-data-poll': {
         'task': 'backend.tasks.poll_monitoring_data',
         'schedule': crontab(hour='0')
+    },
+    'intraday-monitoring-data-poll': {
+        'task': 'backend.tasks.poll_intraday_monitoring_data',
+        'schedule': datetime.timedelta(minutes=settings.INTRADAY_POLLING_MINUTES)
+    },
+    'daily-closed-months-archive': {
+        'task': 'backend.tasks.archive_closed_months',
+        'schedule': crontab(minute=0, hour=1)
     }
 }
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,9 +77,51 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Read replica of the default database. Only used when listed in REPLICA_DATABASES
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DATABASE_REPLICA_NAME', BASE_DIR / 'db.sqlite3'),
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+    # Datapoint shards. Only used when listed in DATAPOINT_SHARDS
+    **{
+        f'shard_{index}': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'shard_{index}.sqlite3',
+        }
+        for index in range(int(os.environ.get('DATAPOINT_SHARD_DATABASES', 2)))
+    },
 }
 
+DATABASE_ROUTERS = ['backend.routers.ShardRouter', 'backend.routers.ReplicaRouter']
+
+# Aliases of the databases datapoints are sharded across by plant. Datapoints are stored in the default database if empty
+DATAPOINT_SHARDS = [alias for alias in os.environ.get('DATAPOINT_SHARDS', '').split(',') if alias]
+# Plant IDs assigned to a shard explicitly, instead of by their ID modulo the number of shards
+DATAPOINT_SHARD_MAP = {}
+
+# Aliases of the replicas serving reports and plant reads
+REPLICA_DATABASES = [alias for alias in os.environ.get('REPLICA_DATABASES', '').split(',') if alias]
+# Seconds the reads of a client are served from the primary after it writes something, so it reads its own writes.
+# Clients can also force it through the header below
+REPLICA_PIN_SECONDS = 60
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+
+# Directory where the snapshots of closed months of datapoints are stored
+SNAPSHOTS_DIR = Path(os.environ.get('SNAPSHOTS_DIR', BASE_DIR / 'snapshots'))
+
+# Directory where report exports are written
+EXPORTS_DIR = Path(os.environ.get('EXPORTS_DIR', BASE_DIR / 'exports'))
+# Seconds after which pending or running exports with no progress are considered abandoned, and restarted if requested
+EXPORT_STALE_TIMEOUT = 60 * 60
+
+# Directory where the serialized datapoints of each closed plant-day are cached for reports. Disabled if empty.
+# It must be shared by the web servers and the Celery workers, which invalidate the fragments when writing datapoints
+REPORT_FRAGMENTS_DIR = os.environ.get('REPORT_FRAGMENTS_DIR')
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -125,10 +168,42 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'backend.fragments.FragmentJSONRenderer',
     ]
 }
 
+# Address of the monitoring service datapoints are pulled from. Point it to `replay_monitoring_data` for load tests
+MONITORING_SERVICE_URL = os.environ.get('MONITORING_SERVICE_URL', 'http://monitoring:5000')
+
+# Redis options
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
+
+# Seconds between keepalive comments sent to idle datapoint stream subscribers
+DATAPOINT_STREAM_KEEPALIVE = 15
+
 # Celery options
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_ACCEPT_CONTENT = ['json', 'pickle']
+# Tasks reserved in advance by each worker process. Keep it low so that queued tasks are served by priority
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
+
+# Days of data pulled by each of the subtasks a backfill is split into
+BACKFILL_WINDOW_DAYS = int(os.environ.get('BACKFILL_WINDOW_DAYS', 30))
+
+# Seconds the registry of requested pulls of a plant is kept after its last change, so stale entries expire
+PULL_REGISTRY_TIMEOUT = 6 * 60 * 60
+# Seconds the lock on writing datapoints of a plant is held at most
+DATAPOINTS_WRITE_LOCK_TIMEOUT = 60
+# Minutes between intraday polls, which only pull the datapoints after the last one stored for each plant
+INTRADAY_POLLING_MINUTES = int(os.environ.get('INTRADAY_POLLING_MINUTES', 15))
+
+# Profiling options
+# Requests with this header set are profiled, along with a random sample of the rest
+PROFILING_HEADER = 'X-Profile'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_TASK_SAMPLE_RATE = float(os.environ.get('PROFILING_TASK_SAMPLE_RATE', 0))
+# Profiled requests and tasks slower than these many seconds are written to the slow log
+PROFILING_SLOW_THRESHOLD = float(os.environ.get('PROFILING_SLOW_THRESHOLD', 1))
+PROFILING_SLOW_TASK_THRESHOLD = float(os.environ.get('PROFILING_SLOW_TASK_THRESHOLD', 60))
+# Directory cProfile dumps of slow executions are written to. Profiling with cProfile is disabled if empty
+PROFILING_CPROFILE_DIR = os.environ.get('PROFILING_CPROFILE_DIR')
@@ -1,11 +1,14 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from backend import views
+from backend import async_views, views
 
 router = routers.DefaultRouter()
 router.register(r'plants', views.PlantViewSet)
+router.register(r'exports', views.ReportExportViewSet)
 
 urlpatterns = [
+    path('async/plants/report/', async_views.report),
+    path('async/plants/pull_datapoints/', async_views.pull_datapoints),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,43 @@
+"""
+Fire concurrent report requests against a running backend and print latency and throughput figures.
+
+Usage:
+    python scripts/load_test_report.py --url http://localhost:8000/async/plants/report/ --concurrency 50
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url: str) -> float:
+    start = time.monotonic()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000/async/plants/report/')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = sorted(executor.map(fetch, [args.url] * args.requests))
+    elapsed = time.monotonic() - start
+
+    print(f'Requests:     {len(latencies)}')
+    print(f'Concurrency:  {args.concurrency}')
+    print(f'Elapsed:      {elapsed:.2f} s')
+    print(f'Throughput:   {len(latencies) / elapsed:.2f} req/s')
+    print(f'Latency p50:  {statistics.median(latencies):.3f} s')
+    print(f'Latency p95:  {latencies[int(len(latencies) * 0.95) - 1]:.3f} s')
+    print(f'Latency max:  {latencies[-1]:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
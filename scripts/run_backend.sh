@@ -1,2 +1,6 @@
 python manage.py migrate
-gunicorn power_factors.wsgi --bind 0.0.0.0:8000 --log-level debug
\ No newline at end of file
+# Shards only get the datapoints table, see backend.routers.ShardRouter
+for alias in $(echo "$DATAPOINT_SHARDS" | tr ',' ' '); do
+  python manage.py migrate --database "$alias"
+done
+gunicorn power_factors.asgi --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --log-level debug
\ No newline at end of file